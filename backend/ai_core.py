@@ -1,7 +1,32 @@
+import asyncio
 import json
+import logging
 import os
-from typing import List, Dict, Optional
-from database import StructuredMemory, get_db
+import re
+import threading
+import time
+from datetime import datetime
+from typing import AsyncIterator, List, Dict, Optional
+from sqlalchemy import Text, cast, func, tuple_
+from sqlalchemy.dialects.postgresql import JSONB
+from database import (
+    StructuredMemory, EntityCooccurrence, SessionLocal, isolated_async_sessionmaker, session_scope, upsert_statement
+)
+from entity_graph import EntityIndex, EntityIndexRegistry, cooccurrence_pairs
+from vector_store import VectorStore
+from ann_index import IVFIndex
+from quantization import create_quantizer
+from embedding import EmbeddingProvider, HashingEmbedder, EmbeddingCache, CachedEmbedder
+from embedding_batcher import EmbeddingBatcher
+from lexical_index import NgramInvertedIndex, reciprocal_rank_fusion
+from retrieval_cache import RetrievalCache, normalize_query
+from prompt_builder import PromptBuilder
+from conversation_context import ConversationContextCache
+from entity_extractor import load_default_extractor
+import instrumentation
+from instrumentation import TurnInstrumentation, span
+
+logger = logging.getLogger(__name__)
 
 # 模拟OpenAI和ChromaDB，因为在当前环境中无法实际导入
 class OpenAI:
@@ -16,156 +41,1103 @@ class ChromaDB:
 openai = OpenAI()
 chromadb = ChromaDB()
 
-# 模拟chroma客户端和集合
+# 向量维度 (与OpenAI text-embedding-ada-002一致)
+EMBEDDING_DIM = 1536
+
+# 集合规模超过该阈值后自动启用近似最近邻(IVF)索引
+ANN_THRESHOLD = int(os.getenv("ANN_THRESHOLD", "5000"))
+# 近似检索默认扫描的桶数, 越大召回率越高、延迟越高
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+# 分区规模增长到ANN索引训练时的该倍数后, 在后台重新训练 (桶数随规模增加)
+ANN_RETRAIN_GROWTH = float(os.getenv("ANN_RETRAIN_GROWTH", "4"))
+# 持久化分区中保存ANN聚类中心的文件, 各worker启动时直接载入, 不必各自重新聚类
+ANN_CENTROIDS_FILE = "ivf_centroids.npz"
+# 量化方式: none / int8 / pq, 分区规模超过阈值后启用, 全精度向量仅用于重排
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+QUANTIZATION_THRESHOLD = int(os.getenv("QUANTIZATION_THRESHOLD", "1000"))
+# 是否启用词法+向量混合检索, 以及每一路召回的候选倍数
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", "4"))
+# 检索结果缓存的容量和有效期
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "300"))
+# 向量记忆的持久化目录, 未配置时只保存在内存中
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR")
+# 向量缓存的磁盘文件 (SQLite), 未配置时只使用进程内缓存
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+# 写入路径的向量化微批处理参数
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "10"))
+EMBEDDING_QUEUE_SIZE = int(os.getenv("EMBEDDING_QUEUE_SIZE", "1024"))
+# 每轮对话是否把用户的发言写入向量记忆, 供之后的对话检索
+DIALOGUE_MEMORY_ON_WRITE = os.getenv("DIALOGUE_MEMORY_ON_WRITE", "true").lower() == "true"
+# 本地替身模型逐个输出词元的间隔, 用于模拟真实模型的生成速度
+STREAM_TOKEN_DELAY_MS = float(os.getenv("STREAM_TOKEN_DELAY_MS", "20"))
+# 异步对话流水线各阶段的超时 (秒), 超时的阶段以空结果降级
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "1.0"))
+HISTORY_TIMEOUT = float(os.getenv("HISTORY_TIMEOUT", "1.0"))
+ENTITY_TIMEOUT = float(os.getenv("ENTITY_TIMEOUT", "0.5"))
+
+# 模拟chroma客户端和集合, 底层使用NumPy向量存储
+# 向量按元数据中的user_id分区存放, 带user_id条件的查询只会扫描该用户的分区
+# 指定persist_directory时每个分区是一个内存映射的磁盘目录 (user_{user_id}),
+# 多个worker打开同一目录即可共享向量页, 并在查询前看到其他进程追加的记忆
 class ChromaCollection:
-    def __init__(self):
-        self.data = []
+    def __init__(
+        self,
+        dim: int = EMBEDDING_DIM,
+        ann_threshold: int = ANN_THRESHOLD,
+        ann_retrain_growth: float = ANN_RETRAIN_GROWTH,
+        persist_directory: Optional[str] = None,
+        quantization: str = VECTOR_QUANTIZATION,
+        quantization_threshold: int = QUANTIZATION_THRESHOLD
+    ):
+        self.dim = dim
+        self.ann_threshold = ann_threshold
+        self.ann_retrain_growth = ann_retrain_growth
+        self.quantization = quantization
+        self.quantization_threshold = quantization_threshold
+        self.persist_directory = persist_directory
+        self.partitions: Dict[Optional[int], VectorStore] = {}
+        # 并发写入新用户时只创建一个分区
+        self._partitions_lock = threading.Lock()
+        # 正在后台重建ANN索引的分区
+        self._ann_rebuilds: Dict[int, threading.Thread] = {}
+        self._ann_rebuilds_lock = threading.Lock()
+        
+        if persist_directory:
+            os.makedirs(persist_directory, exist_ok=True)
+            self._load_partitions()
+    
+    def add_memories(self, user_id: Optional[int], documents, embeddings, metadatas) -> List[str]:
+        """
+        写入用户的记忆并分配单调递增的ID, 格式为 "{user_id}_{序号}"
+        
+        序号由分区在写锁内分配, 多个进程共享同一持久化目录时也不会重复
+        
+        Returns:
+            新记忆的ID列表
+        """
+        store = self._get_partition(user_id, create=True)
+        ids = store.add_with_sequence_ids(str(user_id), embeddings, documents, metadatas)
+        self._maybe_attach_indexes(store)
+        return ids
     
     def add(self, documents, embeddings, metadatas, ids):
+        grouped = {}
         for doc, emb, meta, id_val in zip(documents, embeddings, metadatas, ids):
-            self.data.append({
-                'document': doc,
-                'embedding': emb,
-                'metadata': meta,
-                'id': id_val
-            })
-    
-    def get(self):
-        return {'ids': [item['id'] for item in self.data]}
-    
-    def query(self, query_embeddings, n_results):
-        # 简化的查询实现
-        return {
-            'documents': [[item['document'] for item in self.data[:n_results]]],
-            'metadatas': [[item['metadata'] for item in self.data[:n_results]]]
-        }
+            batch = grouped.setdefault(meta.get('user_id'), ([], [], [], []))
+            batch[0].append(id_val)
+            batch[1].append(emb)
+            batch[2].append(doc)
+            batch[3].append(meta)
+        
+        for user_id, (batch_ids, batch_embeddings, batch_documents, batch_metadatas) in grouped.items():
+            store = self._get_partition(user_id, create=True)
+            store.add(
+                ids=batch_ids,
+                embeddings=batch_embeddings,
+                documents=batch_documents,
+                metadatas=batch_metadatas
+            )
+            self._maybe_attach_indexes(store)
+    
+    def get(self, where: Optional[Dict] = None):
+        results = {'ids': [], 'documents': [], 'metadatas': []}
+        for store, remaining in self._resolve_partitions(where):
+            with store.lock:
+                rows = store.filter_rows(remaining)
+                if rows is None:
+                    rows = range(len(store))
+                for i in rows:
+                    results['ids'].append(store.ids[i])
+                    results['documents'].append(store.documents[i])
+                    results['metadatas'].append(store.metadatas[i])
+        return results
+    
+    def count(self, where: Optional[Dict] = None) -> int:
+        if not where:
+            return sum(store.live_count for store in self.partitions.values())
+        return len(self.get(where)['ids'])
+    
+    def partition(self, user_id: Optional[int]) -> Optional[VectorStore]:
+        """用户的向量分区, 不存在时返回None"""
+        return self._get_partition(user_id)
+    
+    def delete(self, user_id: Optional[int], ids: List[str]) -> int:
+        """删除用户分区中的记忆, 返回实际删除的数量"""
+        store = self._get_partition(user_id)
+        return store.delete(ids) if store is not None else 0
+    
+    def compact(self, user_id: Optional[int]) -> Dict:
+        """压缩用户分区, 回收已删除记忆占用的空间"""
+        store = self._get_partition(user_id)
+        if store is None:
+            return {'removed': 0, 'bytes_before': 0, 'bytes_after': 0, 'bytes_reclaimed': 0}
+        report = store.compact()
+        # 压缩后分区可能缩小到阈值以下, 按新的规模重新判断索引
+        self._maybe_attach_indexes(store)
+        return report
+    
+    def user_ids(self) -> List[Optional[int]]:
+        """已有记忆的用户"""
+        if self.persist_directory:
+            self._load_partitions()
+        return list(self.partitions)
+    
+    def generation(self, user_id: Optional[int]) -> int:
+        """用户分区的数据代数, 分区每次写入(包括其他进程的写入)后递增"""
+        store = self._get_partition(user_id)
+        return store.version if store is not None else 0
+    
+    def get_by_time_range(self, user_id: int, start=None, end=None) -> Dict:
+        """
+        按时间范围获取某个用户的记忆, 在分区的时间索引上二分查找
+        
+        Returns:
+            按元数据timestamp升序排列的ids/documents/metadatas
+        """
+        results = {'ids': [], 'documents': [], 'metadatas': []}
+        store = self._get_partition(user_id)
+        if store is None:
+            return results
+        
+        with store.lock:
+            for i in store.rows_in_time_range(start, end):
+                results['ids'].append(store.ids[i])
+                results['documents'].append(store.documents[i])
+                results['metadatas'].append(store.metadatas[i])
+        return results
+    
+    def query(
+        self,
+        query_embeddings,
+        n_results,
+        where: Optional[Dict] = None,
+        nprobe: Optional[int] = None,
+        query_texts: Optional[List[str]] = None
+    ):
+        """
+        相似度检索, 每个查询向量返回一组按相似度降序排列的结果
+        
+        where中的user_id用于定位分区, 其余条件在打分前过滤候选行。
+        传入query_texts时同时做BM25词法检索, 两路结果按倒数排名融合,
+        只被词法命中的记录distance为None。
+        """
+        fetch = n_results * HYBRID_CANDIDATE_FACTOR if query_texts else n_results
+        vector_hits = [[] for _ in query_embeddings]
+        lexical_hits = [[] for _ in query_embeddings]
+        # 命中的记录在分区锁内取出, 之后分区被压缩、行号改变也不影响结果
+        records = {}
+        
+        def remember(store: VectorStore, i) -> tuple:
+            key = (id(store), int(i))
+            if key not in records:
+                records[key] = (store.ids[key[1]], store.documents[key[1]], store.metadatas[key[1]])
+            return key
+        
+        for store, remaining in self._resolve_partitions(where):
+            with store.lock:
+                rows = store.filter_rows(remaining)
+                if rows is not None and len(rows) == 0:
+                    continue
+                
+                top_rows, top_scores = store.search(query_embeddings, fetch, rows=rows, nprobe=nprobe)
+                for hits, row, row_scores in zip(vector_hits, top_rows, top_scores):
+                    # 近似检索候选不足时会以-1补齐
+                    hits.extend((float(score), remember(store, i)) for i, score in zip(row, row_scores) if i >= 0)
+                
+                if query_texts and store.lexical_index is not None:
+                    for hits, text in zip(lexical_hits, query_texts):
+                        matched_rows, matched_scores = store.lexical_index.search(text, fetch, rows=rows)
+                        hits.extend((float(score), remember(store, i)) for i, score in zip(matched_rows, matched_scores))
+        
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        for vector_ranked, lexical_ranked in zip(vector_hits, lexical_hits):
+            # 多个分区的结果合并后重新排序
+            vector_ranked.sort(key=lambda hit: hit[0], reverse=True)
+            
+            if query_texts:
+                lexical_ranked.sort(key=lambda hit: hit[0], reverse=True)
+                similarities = {key: score for score, key in vector_ranked}
+                fused = reciprocal_rank_fusion([
+                    [key for _, key in vector_ranked],
+                    [key for _, key in lexical_ranked]
+                ])[:n_results]
+                hits = [(similarities.get(key), key) for key, _ in fused]
+            else:
+                hits = vector_ranked[:n_results]
+            
+            results['ids'].append([records[key][0] for _, key in hits])
+            results['documents'].append([records[key][1] for _, key in hits])
+            results['metadatas'].append([records[key][2] for _, key in hits])
+            results['distances'].append([1 - score if score is not None else None for score, _ in hits])
+        
+        return results
+    
+    def _resolve_partitions(self, where: Optional[Dict]):
+        """根据where中的user_id等值条件定位分区, 返回(分区, 剩余过滤条件)列表"""
+        if where and 'user_id' in where and not isinstance(where['user_id'], dict):
+            remaining = {key: value for key, value in where.items() if key != 'user_id'}
+            store = self._get_partition(where['user_id'])
+            return [(store, remaining)] if store is not None else []
+        
+        if self.persist_directory:
+            self._load_partitions()
+            for store in self.partitions.values():
+                store.refresh()
+        return [(store, where) for store in self.partitions.values()]
+    
+    def _get_partition(self, user_id: Optional[int], create: bool = False) -> Optional[VectorStore]:
+        """获取用户分区, 持久化模式下会先同步磁盘上的新增记录"""
+        store = self.partitions.get(user_id)
+        if store is not None:
+            store.refresh()
+            return store
+        
+        with self._partitions_lock:
+            store = self.partitions.get(user_id)
+            if store is not None:
+                return store
+            
+            if self.persist_directory:
+                path = self._partition_path(user_id)
+                if create or os.path.exists(path):
+                    store = VectorStore(dim=self.dim, path=path)
+            elif create:
+                store = VectorStore(dim=self.dim)
+            
+            # 索引挂载完成后才对其他线程可见
+            if store is not None:
+                store.attach_lexical_index(NgramInvertedIndex())
+                self._maybe_attach_indexes(store)
+                self.partitions[user_id] = store
+        
+        return store
+    
+    def _maybe_attach_indexes(self, store: VectorStore):
+        """每个用户的分区独立判断是否需要启用ANN索引和量化编码"""
+        with store.lock:
+            if store.ann_index is None and len(store) >= self.ann_threshold:
+                index = self._load_ann_index(store)
+                trained = index.is_trained
+                store.attach_ann_index(index, train=not trained)
+                if not trained:
+                    self._save_ann_index(store, index)
+            elif store.ann_index is not None and store.ann_index.needs_retrain(self.ann_retrain_growth):
+                self._schedule_ann_rebuild(store)
+            
+            # 仅内存模式下全精度矩阵仍常驻, 量化只会额外占用编码的内存, 因此只对持久化分区启用
+            if (
+                self.quantization != 'none'
+                and store.path is not None
+                and store.quantizer is None
+                and len(store) >= self.quantization_threshold
+            ):
+                store.attach_quantizer(create_quantizer(self.quantization, self.dim))
+    
+    def rebuild_ann_index(self, user_id: Optional[int]) -> bool:
+        """
+        按分区当前的规模重新训练ANN索引并替换, 检索不受影响
+        
+        Returns:
+            是否已替换 (分区没有ANN索引或重建期间被压缩时为False)
+        """
+        store = self._get_partition(user_id)
+        return store is not None and self._rebuild_ann_index(store)
+    
+    def _rebuild_ann_index(self, store: VectorStore) -> bool:
+        if store.ann_index is None:
+            return False
+        index = self._load_ann_index(store)
+        trained = index.is_trained
+        replaced = store.rebuild_ann_index(index, train=not trained)
+        if replaced and not trained:
+            self._save_ann_index(store, index)
+        if replaced:
+            logger.info("ANN索引已重建: %s个桶, %s条向量", index.centroids.shape[0], len(index))
+        return replaced
+    
+    def _schedule_ann_rebuild(self, store: VectorStore):
+        """在后台线程中重建分区的ANN索引, 同一分区同时只有一个重建任务"""
+        def rebuild():
+            try:
+                self._rebuild_ann_index(store)
+            except Exception as e:
+                logger.exception("重建ANN索引失败: %s", e)
+            finally:
+                with self._ann_rebuilds_lock:
+                    self._ann_rebuilds.pop(id(store), None)
+        
+        with self._ann_rebuilds_lock:
+            if id(store) in self._ann_rebuilds:
+                return
+            thread = self._ann_rebuilds[id(store)] = threading.Thread(target=rebuild, daemon=True)
+        thread.start()
+    
+    def _load_ann_index(self, store: VectorStore) -> IVFIndex:
+        """
+        新建ANN索引
+        
+        持久化分区保存过聚类中心、且分区规模尚未达到重新训练的倍数时直接载入,
+        否则返回未训练的索引
+        """
+        index = IVFIndex(dim=self.dim, nprobe=ANN_NPROBE)
+        if store.path is None:
+            return index
+        if index.load_centroids(os.path.join(store.path, ANN_CENTROIDS_FILE)) and \
+                len(store) < index.trained_size * self.ann_retrain_growth:
+            return index
+        return IVFIndex(dim=self.dim, nprobe=ANN_NPROBE)
+    
+    def _save_ann_index(self, store: VectorStore, index: IVFIndex):
+        if store.path is not None and not store.read_only:
+            index.save_centroids(os.path.join(store.path, ANN_CENTROIDS_FILE))
+    
+    def _partition_path(self, user_id: Optional[int]) -> str:
+        return os.path.join(self.persist_directory, f"user_{user_id}")
+    
+    def _load_partitions(self):
+        """打开持久化目录中尚未加载的分区"""
+        for name in os.listdir(self.persist_directory):
+            if not name.startswith("user_"):
+                continue
+            key = name[len("user_"):]
+            user_id = int(key) if key.isdigit() else None
+            if user_id not in self.partitions:
+                self._get_partition(user_id)
 
 class ChromaClient:
-    def __init__(self):
+    def __init__(self, persist_directory: Optional[str] = None):
+        self.persist_directory = persist_directory
         self.collections = {}
     
     def create_collection(self, name):
-        self.collections[name] = ChromaCollection()
+        path = os.path.join(self.persist_directory, name) if self.persist_directory else None
+        self.collections[name] = ChromaCollection(persist_directory=path)
         return self.collections[name]
 
 # 初始化ChromaDB客户端
-chroma_client = ChromaClient()
+chroma_client = ChromaClient(persist_directory=VECTOR_STORE_DIR)
 collection = chroma_client.create_collection(name="memory_collection")
 
+# 向量化服务, 默认使用本地哈希向量化, 外面包一层按内容哈希的两级缓存
+embedding_cache = EmbeddingCache(max_memory_entries=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH)
+embedder = CachedEmbedder(HashingEmbedder(dim=EMBEDDING_DIM), embedding_cache)
+
+# 异步写入路径共用的微批处理器, 把并发的单条向量化请求合并成批
+embedding_batcher = EmbeddingBatcher(
+    embedder,
+    max_batch_size=EMBEDDING_BATCH_SIZE,
+    max_wait_ms=EMBEDDING_BATCH_WAIT_MS,
+    max_queue_size=EMBEDDING_QUEUE_SIZE
+)
+
+entity_indexes = EntityIndexRegistry()
+conversation_contexts = ConversationContextCache()
+# 实体词典在启动时编译一次
+entity_extractor = load_default_extractor()
+# 检索结果缓存, 按用户集合代数失效
+retrieval_cache = RetrievalCache(max_entries=RETRIEVAL_CACHE_SIZE, ttl_seconds=RETRIEVAL_CACHE_TTL)
+
+def set_embedding_provider(provider: EmbeddingProvider):
+    """替换向量化服务 (如接入OpenAI), 缓存层保持不变"""
+    global embedder
+    if provider.dim != EMBEDDING_DIM:
+        raise ValueError(f"向量维度必须为{EMBEDDING_DIM}")
+    embedder = CachedEmbedder(provider, embedding_cache)
+    embedding_batcher.embedder = embedder
+    retrieval_cache.clear()
+
+class GenerationMetrics:
+    """流式生成指标 - 首词元延迟(TTFT)与生成速度"""
+    
+    def __init__(self):
+        self.streams = 0
+        self.tokens = 0
+        self.ttft_total = 0.0
+        self.ttft_max = 0.0
+        self.generation_seconds = 0.0
+        
+    def observe(self, ttft: float, tokens: int, duration: float):
+        """
+        记录一次流式生成
+        
+        Args:
+            ttft: 从开始生成到第一个词元的秒数
+            tokens: 输出的词元数
+            duration: 整次生成的秒数
+        """
+        self.streams += 1
+        self.tokens += tokens
+        self.ttft_total += ttft
+        self.ttft_max = max(self.ttft_max, ttft)
+        self.generation_seconds += duration
+        
+    def snapshot(self) -> Dict:
+        return {
+            'streams': self.streams,
+            'tokens': self.tokens,
+            'avg_ttft_ms': round(self.ttft_total / self.streams * 1000, 3) if self.streams else 0.0,
+            'max_ttft_ms': round(self.ttft_max * 1000, 3),
+            'tokens_per_second': round(self.tokens / self.generation_seconds, 2) if self.generation_seconds else 0.0
+        }
+
+class LocalStreamingModel:
+    """
+    本地替身模型 - 在接入真实模型前模拟逐词元输出
+    
+    中文按单字、英文和数字按单词切分, 每个词元之间等待 token_delay_ms 毫秒
+    """
+    
+    _TOKEN_PATTERN = re.compile(r'[a-zA-Z0-9]+|\s+|.', re.S)
+    
+    def __init__(self, token_delay_ms: Optional[float] = None):
+        if token_delay_ms is None:
+            token_delay_ms = STREAM_TOKEN_DELAY_MS
+        self.token_delay = token_delay_ms / 1000
+        
+    def complete(self, prompt: str, user_input: str) -> str:
+        """
+        生成完整回复
+        
+        Args:
+            prompt: 提示词 (真实模型据此生成, 替身模型不解析)
+            user_input: 用户输入, 替身模型用它拼出固定格式的回复
+        """
+        return f"感谢您分享关于'{user_input[:20]}...'的内容。根据我们的对话历史和相关回忆，我想了解更多关于这个话题的细节。"
+        
+    async def stream(self, prompt: str, user_input: str) -> AsyncIterator[str]:
+        """逐个输出回复的词元"""
+        for token in self._TOKEN_PATTERN.findall(self.complete(prompt, user_input)):
+            await asyncio.sleep(self.token_delay)
+            yield token
+
+generation_metrics = GenerationMetrics()
+# 每轮对话各阶段 (检索、向量化、提示词构建、生成、实体抽取、写库) 的延迟分布
+turn_metrics = TurnInstrumentation()
+
 class MemorySystem:
     """长期记忆系统"""
     
-    def __init__(self, user_id: int):
+    def __init__(self, user_id: int, session_factory=None):
         self.user_id = user_id
-        self.db = next(get_db())
+        # 每次写入通过session_scope开启短事务, 不长期持有数据库连接
+        self.session_factory = session_factory or SessionLocal
+        self._pending_entities: List[Dict] = []
         
     def store_structured_memory(self, entity_type: str, entity_name: str, attributes: dict):
-        """存储结构化记忆"""
-        memory = StructuredMemory(
-            user_id=self.user_id,
-            entity_type=entity_type,
-            entity_name=entity_name,
-            attributes=json.dumps(attributes)
+        """存储结构化记忆 (同名实体已存在时合并属性)"""
+        return self.store_structured_memories_bulk([{
+            'type': entity_type,
+            'name': entity_name,
+            'attributes': attributes
+        }])[0]
+        
+    def remember_entity(self, entity_type: str, entity_name: str, attributes: Optional[dict] = None):
+        """暂存一个实体, 在本轮对话结束时由 flush_structured_memories 统一写入"""
+        self._pending_entities.append({
+            'type': entity_type,
+            'name': entity_name,
+            'attributes': attributes or {}
+        })
+        
+    def flush_structured_memories(self) -> List[StructuredMemory]:
+        """在一个事务中写入本轮暂存的全部实体, 并记录它们之间的共现关系"""
+        entities, self._pending_entities = self._pending_entities, []
+        return self.store_structured_memories_bulk(entities, record_cooccurrence=True)
+        
+    def store_structured_memories_bulk(
+        self,
+        entities: List[Dict],
+        record_cooccurrence: bool = False
+    ) -> List[StructuredMemory]:
+        """
+        批量存储结构化记忆
+        
+        同一批次内重复的实体先合并, 再以 INSERT ... ON CONFLICT 在一个事务中写入;
+        与数据库中已有属性的合并 (新值覆盖旧值) 在冲突更新语句中完成, 并发写入同一实体的不同属性不会丢失。
+        
+        Args:
+            entities: 实体列表, 每项包含 type、name 和可选的 attributes
+            record_cooccurrence: 是否把这批实体视为同一条消息中共同出现
+            
+        Returns:
+            写入后的结构化记忆, 与去重后的实体一一对应
+        """
+        merged: Dict[tuple, dict] = {}
+        for entity in entities:
+            key = (entity['type'], entity['name'])
+            merged.setdefault(key, {}).update(entity.get('attributes') or {})
+        if not merged:
+            return []
+            
+        keys = list(merged)
+        with session_scope(self.session_factory) as session:
+            rows = [{
+                'user_id': self.user_id,
+                'entity_type': entity_type,
+                'entity_name': entity_name,
+                'attributes': json.dumps(merged[(entity_type, entity_name)], ensure_ascii=False)
+            } for entity_type, entity_name in keys]
+            self._upsert_structured_memories(session, rows)
+            pairs = cooccurrence_pairs(keys) if record_cooccurrence else []
+            if pairs:
+                self._upsert_cooccurrences(session, pairs)
+            
+            memories = session.query(StructuredMemory).filter(
+                StructuredMemory.user_id == self.user_id,
+                tuple_(StructuredMemory.entity_type, StructuredMemory.entity_name).in_(keys)
+            ).populate_existing().all()
+            # 脱离会话后返回, 提交时不会过期已加载的属性
+            session.expunge_all()
+            
+        # 只同步已加载的索引, 未加载的用户下次访问时会从数据库读到最新数据
+        index = entity_indexes.loaded(self.user_id)
+        if index is not None:
+            index.apply_memories(memories)
+            index.add_cooccurrences(pairs)
+            
+        by_key = {(memory.entity_type, memory.entity_name): memory for memory in memories}
+        return [by_key[key] for key in keys]
+        
+    @property
+    def entity_index(self) -> EntityIndex:
+        """当前用户的实体索引 (首次访问时加载)"""
+        return entity_indexes.get(self.user_id, self.session_factory)
+        
+    def get_entity(self, entity_type: str, entity_name: str, neighbour_limit: int = 5) -> Optional[Dict]:
+        """
+        查询实体的属性和关联实体
+        
+        Args:
+            entity_type: 实体类型
+            entity_name: 实体名称
+            neighbour_limit: 最多返回的关联实体数
+            
+        Returns:
+            包含 type、name、attributes、neighbours 的字典, 实体不存在时返回None
+        """
+        index = self.entity_index
+        attributes = index.get(entity_type, entity_name)
+        if attributes is None:
+            return None
+        return {
+            'type': entity_type,
+            'name': entity_name,
+            'attributes': attributes,
+            'neighbours': index.neighbours(entity_type, entity_name, neighbour_limit)
+        }
+        
+    def _upsert_cooccurrences(self, session, pairs: List[tuple]):
+        rows = [{
+            'user_id': self.user_id,
+            'source_type': source[0],
+            'source_name': source[1],
+            'target_type': target[0],
+            'target_name': target[1],
+            'weight': 1
+        } for source, target in pairs]
+        
+        statement = upsert_statement(
+            session.get_bind().dialect.name,
+            EntityCooccurrence,
+            ['user_id', 'source_type', 'source_name', 'target_type', 'target_name'],
+            lambda excluded: {'weight': EntityCooccurrence.weight + excluded.weight}
         )
-        self.db.add(memory)
-        self.db.commit()
-        self.db.refresh(memory)
-        return memory
+        if statement is not None:
+            session.execute(statement.values(rows))
+            return
+            
+        for row in rows:
+            edge = session.query(EntityCooccurrence).filter_by(**{
+                key: value for key, value in row.items() if key != 'weight'
+            }).first()
+            if edge is None:
+                session.add(EntityCooccurrence(**row))
+            else:
+                edge.weight += 1
+        session.flush()
+        
+    def _upsert_structured_memories(self, session, rows: List[Dict]):
+        dialect = session.get_bind().dialect.name
+        stored = func.coalesce(StructuredMemory.attributes, '{}')
+        
+        def merge_attributes(excluded):
+            if dialect == 'postgresql':
+                return {'attributes': cast(cast(stored, JSONB).op('||')(cast(excluded.attributes, JSONB)), Text)}
+            # json_patch 与 jsonb || 一样按键合并, 区别是值为null的键会被删除
+            return {'attributes': func.json_patch(stored, excluded.attributes)}
+        
+        statement = upsert_statement(
+            dialect, StructuredMemory, ['user_id', 'entity_type', 'entity_name'], merge_attributes
+        )
+        if statement is not None:
+            session.execute(statement.values(rows))
+            return
+            
+        # 其他数据库没有通用的upsert语法, 锁定已有的行后逐条合并或插入
+        existing = session.query(StructuredMemory).filter(
+            StructuredMemory.user_id == self.user_id,
+            tuple_(StructuredMemory.entity_type, StructuredMemory.entity_name).in_(
+                [(row['entity_type'], row['entity_name']) for row in rows]
+            )
+        ).with_for_update().all()
+        by_key = {(memory.entity_type, memory.entity_name): memory for memory in existing}
+        for row in rows:
+            memory = by_key.get((row['entity_type'], row['entity_name']))
+            if memory is None:
+                session.add(StructuredMemory(**row))
+            else:
+                attributes = json.loads(memory.attributes) if memory.attributes else {}
+                attributes.update(json.loads(row['attributes']))
+                memory.attributes = json.dumps(attributes, ensure_ascii=False)
+        session.flush()
         
-    def store_unstructured_memory(self, content: str, metadata: Optional[dict] = None):
+    def store_unstructured_memory(self, content: str, metadata: Optional[dict] = None) -> str:
         """存储非结构化记忆（向量化）"""
-        if metadata is None:
-            metadata = {}
+        return self.store_unstructured_memories_bulk([content], [metadata])[0]
+        
+    def store_unstructured_memories_bulk(
+        self, contents: List[str], metadatas: Optional[List[Optional[dict]]] = None
+    ) -> List[str]:
+        """
+        批量存储非结构化记忆, 一次完成向量化和写入 (用于导入历史日记等场景)
+        
+        Args:
+            contents: 记忆文本列表
+            metadatas: 与文本一一对应的元数据列表
             
+        Returns:
+            新记忆的ID列表
+        """
+        if metadatas is None:
+            metadatas = [None] * len(contents)
+        if len(metadatas) != len(contents):
+            raise ValueError("contents 和 metadatas 的长度必须一致")
+        
+        now = datetime.utcnow().isoformat()
+        metadatas = [dict(metadata or {}) for metadata in metadatas]
+        for metadata in metadatas:
+            metadata["user_id"] = self.user_id
+            metadata.setdefault("timestamp", now)
+        
+        # 将文本批量转换为向量
+        embeddings = embedder.embed(contents)
+        
+        return self._add_to_collection(contents, embeddings, metadatas)
+        
+    async def astore_unstructured_memory(
+        self,
+        content: str,
+        metadata: Optional[dict] = None,
+        batcher: Optional[EmbeddingBatcher] = None
+    ) -> str:
+        """
+        异步存储非结构化记忆
+        
+        向量化请求经过微批处理器 (默认为全局的处理器), 与同一时刻其他会话的写入合并为一次调用
+        """
+        metadata = dict(metadata or {})
         metadata["user_id"] = self.user_id
+        metadata.setdefault("timestamp", datetime.utcnow().isoformat())
         
-        # 模拟将文本转换为向量
-        embedding = [0.1] * 1536  # 模拟1536维向量
+        embedding = await (batcher or embedding_batcher).embed(content)
         
-        # 存储到ChromaDB
-        collection.add(
-            documents=[content],
-            embeddings=[embedding],
-            metadatas=[metadata],
-            ids=[f"{self.user_id}_{len(collection.get()['ids'])}"]
+        # 写入分区时可能等待整理任务持有的锁, 不在事件循环上执行
+        ids = await instrumentation.run_in_executor(
+            asyncio.get_running_loop(), self._add_to_collection, [content], [embedding], [metadata]
         )
+        return ids[0]
+        
+    def _add_to_collection(self, contents: List[str], embeddings, metadatas: List[dict]) -> List[str]:
+        """写入向量集合, ID由集合在写入时分配"""
+        return collection.add_memories(self.user_id, list(contents), embeddings, metadatas)
         
-    def retrieve_relevant_memories(self, query: str, top_k: int = 5) -> List[Dict]:
+    def retrieve_relevant_memories(self, query: str, top_k: int = 5, where: Optional[Dict] = None) -> List[Dict]:
         """检索相关记忆"""
-        # 模拟将查询转换为向量
-        query_embedding = [0.1] * 1536  # 模拟1536维向量
+        return self.retrieve_relevant_memories_batch([query], top_k, where)[0]
         
-        # 在ChromaDB中检索相似记忆
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k
-        )
+    def retrieve_relevant_memories_batch(
+        self, queries: List[str], top_k: int = 5, where: Optional[Dict] = None
+    ) -> List[List[Dict]]:
+        """
+        批量检索相关记忆, 多个探测查询合并为一次向量检索
+        
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回的记忆数量
+            where: 额外的元数据过滤条件 (如日期范围、主题), 总是限定在当前用户范围内
+        """
+        generation = collection.generation(self.user_id)
+        where_key = json.dumps(where, sort_keys=True, default=str) if where else None
+        keys = [(self.user_id, normalize_query(query), top_k, where_key) for query in queries]
         
-        return [
-            {"document": doc, "metadata": meta}
-            for doc, meta in zip(results['documents'][0], results['metadatas'][0])
-        ]
+        with span('retrieval'):
+            # 先查缓存, 只对未命中的查询做检索
+            cached = [retrieval_cache.get(key, generation) for key in keys]
+            pending = [i for i, result in enumerate(cached) if result is None]
+            if not pending:
+                return [list(result) for result in cached]
+            
+            started = time.perf_counter()
+            pending_queries = [queries[i] for i in pending]
+            
+            # 将查询转换为向量
+            with span('embedding'):
+                query_embeddings = embedder.embed(pending_queries)
+            
+            # 在ChromaDB中检索相似记忆, 只检索当前用户的分区
+            with span('vector_search'):
+                results = collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=top_k,
+                    where=self._scoped_where(where),
+                    query_texts=pending_queries if HYBRID_RETRIEVAL else None
+                )
+        
+        elapsed = (time.perf_counter() - started) / len(pending)
+        for i, documents, metadatas, distances in zip(
+            pending, results['documents'], results['metadatas'], results['distances']
+        ):
+            cached[i] = [
+                {"document": doc, "metadata": meta, "distance": distance}
+                for doc, meta, distance in zip(documents, metadatas, distances)
+            ]
+            retrieval_cache.put(keys[i], generation, cached[i], elapsed)
+        
+        return [list(result) for result in cached]
+        
+    def _scoped_where(self, where: Optional[Dict] = None) -> Dict:
+        """为过滤条件加上当前用户的限定"""
+        scoped = dict(where or {})
+        scoped['user_id'] = self.user_id
+        return scoped
 
 class DialogueManager:
     """对话管理器"""
     
-    def __init__(self, user_id: int):
+    def __init__(
+        self,
+        user_id: int,
+        model: Optional[LocalStreamingModel] = None,
+        prompt_builder: Optional[PromptBuilder] = None
+    ):
         self.user_id = user_id
         self.memory_system = MemorySystem(user_id)
+        # 模拟OpenAI API, 在实际应用中替换为真实模型
+        self.model = model or LocalStreamingModel()
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        # 最近一次构建的提示词报告 (各段词元数、前缀哈希等)
+        self.last_prompt_report: Optional[Dict] = None
+        
+    def generate_response(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]] = None,
+        conversation_id: Optional[int] = None
+    ) -> str:
+        """
+        生成AI回复
+        
+        Args:
+            user_input: 用户输入
+            conversation_history: 对话历史; 为None且指定了conversation_id时使用服务端缓存的上下文
+            conversation_id: 会话ID, 指定时本轮的两条消息会写入该会话
+        """
+        with turn_metrics.turn(user_id=self.user_id):
+            prompt = self._prepare_prompt(user_input, conversation_history, conversation_id)
+            
+            with span('generation'):
+                response = self.model.complete(prompt, user_input)
+            
+            self._record_turn(user_input, response, conversation_id)
+        
+        return response
+        
+    async def stream_response(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]] = None,
+        conversation_id: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """
+        流式生成AI回复
+        
+        检索和写库是阻塞调用, 放到线程池中执行, 不阻塞事件循环上的其他连接;
+        子类通过 _aprepare / _arecord_turn 替换准备和写入阶段, 生成循环和指标记录共用
+        
+        Args:
+            user_input: 用户输入
+            conversation_history: 对话历史; 为None且指定了conversation_id时使用服务端缓存的上下文
+            conversation_id: 会话ID, 指定时本轮的两条消息会写入该会话
+            
+        Returns:
+            逐个产出词元的异步迭代器
+        """
+        started = time.perf_counter()
+        # 计时记录只在两次yield之间激活, 避免跨yield设置上下文变量
+        trace = turn_metrics.start(user_id=self.user_id)
+        
+        with instrumentation.activate(trace):
+            prompt, entities = await self._aprepare(user_input, conversation_history, conversation_id)
+        
+        generation_started = time.perf_counter()
+        first_token_at = None
+        chunks = []
+        async for token in self.model.stream(prompt, user_input):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks.append(token)
+            yield token
+            
+        finished = time.perf_counter()
+        generation_metrics.observe((first_token_at or finished) - started, len(chunks), finished - started)
+        trace.add('generation', finished - generation_started)
         
-    def generate_response(self, user_input: str, conversation_history: List[Dict]) -> str:
-        """生成AI回复"""
-        # 检索相关记忆
+        with instrumentation.activate(trace):
+            await self._arecord_turn(user_input, ''.join(chunks), entities, conversation_id)
+        turn_metrics.record(trace)
+        
+    async def _aprepare(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]],
+        conversation_id: Optional[int]
+    ):
+        """在线程池中检索记忆并构建提示词, 返回提示词和本轮抽取的实体 (写入时再抽取, 这里为None)"""
+        prompt = await instrumentation.run_in_executor(
+            asyncio.get_running_loop(), self._prepare_prompt, user_input, conversation_history, conversation_id
+        )
+        return prompt, None
+        
+    async def _arecord_turn(
+        self,
+        user_input: str,
+        response: str,
+        entities: Optional[List[Dict]],
+        conversation_id: Optional[int]
+    ):
+        """在线程池中保存本轮对话"""
+        await instrumentation.run_in_executor(
+            asyncio.get_running_loop(), self._record_turn, user_input, response, conversation_id
+        )
+        
+    def _prepare_prompt(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]],
+        conversation_id: Optional[int] = None
+    ) -> str:
+        """检索相关记忆并构建提示词"""
+        if conversation_history is None:
+            with span('history'):
+                conversation_history = (
+                    conversation_contexts.get(conversation_id, self.user_id) if conversation_id is not None else []
+                )
+        elif conversation_id is not None:
+            # 本轮消息会写入该会话, 即使客户端自带历史也要先校验归属
+            conversation_contexts.check_owner(conversation_id, self.user_id)
         relevant_memories = self.memory_system.retrieve_relevant_memories(user_input)
+        return self._build_prompt(user_input, conversation_history, relevant_memories)
         
-        # 构建提示词
-        prompt = self._build_prompt(user_input, conversation_history, relevant_memories)
+    def _record_turn(self, user_input: str, response: str, conversation_id: Optional[int] = None):
+        """本轮提到的实体在一个事务中写入结构化记忆, 用户的发言写入向量记忆, 指定会话时同时保存本轮消息"""
+        for entity in self.extract_entities(user_input):
+            self.memory_system.remember_entity(entity['type'], entity['name'], {'context': entity['context']})
         
-        # 模拟调用OpenAI API生成回复
-        # 在实际应用中，这里会调用真实的API
-        response = f"感谢您分享关于'{user_input[:20]}...'的内容。根据我们的对话历史和相关回忆，我想了解更多关于这个话题的细节。"
+        with span('persistence'):
+            self.memory_system.flush_structured_memories()
+            
+            if DIALOGUE_MEMORY_ON_WRITE:
+                self.memory_system.store_unstructured_memory(user_input, self._dialogue_metadata(conversation_id))
+            
+            if conversation_id is not None:
+                conversation_contexts.append(conversation_id, [
+                    {'role': 'user', 'content': user_input},
+                    {'role': 'assistant', 'content': response}
+                ], user_id=self.user_id)
         
-        return response
+    @staticmethod
+    def _dialogue_metadata(conversation_id: Optional[int]) -> Dict:
+        """对话中写入的向量记忆的元数据"""
+        metadata = {'type': 'dialogue'}
+        if conversation_id is not None:
+            metadata['conversation_id'] = conversation_id
+        return metadata
         
     def _build_prompt(self, user_input: str, conversation_history: List[Dict], relevant_memories: List[Dict]) -> str:
-        """构建提示词"""
-        prompt = f"用户说: {user_input}\n\n"
-        
-        if relevant_memories:
-            prompt += "相关回忆:\n"
-            for memory in relevant_memories:
-                prompt += f"- {memory['document']}\n"
-            prompt += "\n"
-            
-        if conversation_history:
-            prompt += "对话历史:\n"
-            for msg in conversation_history[-3:]:  # 只取最近3轮对话
-                prompt += f"{msg['role']}: {msg['content']}\n"
-                
-        prompt += "\n请根据以上信息，以温暖、有同理心的方式回应用户。"
-        
-        return prompt
+        """构建提示词 (在词元预算内, 前缀为系统提示和用户的核心实体)"""
+        core_entities = self.memory_system.entity_index.entities()
+        with span('prompt_build'):
+            report = self.prompt_builder.build(user_input, conversation_history, relevant_memories, core_entities)
+        self.last_prompt_report = report
+        return report['prompt']
         
     def extract_entities(self, text: str) -> List[Dict]:
-        """从文本中提取实体信息"""
-        # 这里可以使用更复杂的NLP技术，如spaCy或自定义模型
-        # 简化示例中我们使用简单的关键词匹配
-        
-        entities = []
-        
-        # 简单的关键词匹配示例
-        family_keywords = ["妈妈", "爸爸", "爷爷", "奶奶", "外公", "外婆", "儿子", "女儿", "妻子", "丈夫"]
-        for keyword in family_keywords:
-            if keyword in text:
-                entities.append({
-                    "type": "family_member",
-                    "name": keyword,
-                    "context": self._extract_context(text, keyword)
-                })
-                
-        return entities
+        """
+        从文本中提取实体信息
+        
+        Returns:
+            实体列表, 每项包含 type、name、start、end 和所在句子 context
+        """
+        with span('entity_extraction'):
+            return entity_extractor.extract(text)
+
+class AsyncDialogueManager(DialogueManager):
+    """
+    异步对话管理器
+    
+    每轮对话的准备阶段 (记忆检索、实体抽取、核心实体加载、会话历史读取) 通过 asyncio.gather 并发执行,
+    各阶段有独立的超时, 超时或失败的阶段以空结果降级, 不影响回复生成。
+    会话历史和消息写入使用异步数据库会话; 检索等CPU密集或仍为同步实现的步骤放到线程池中执行。
+    """
+    
+    def __init__(
+        self,
+        user_id: int,
+        model: Optional[LocalStreamingModel] = None,
+        prompt_builder: Optional[PromptBuilder] = None,
+        async_session_factory=None,
+        stage_timeouts: Optional[Dict[str, float]] = None,
+        batcher: Optional[EmbeddingBatcher] = None
+    ):
+        super().__init__(user_id, model, prompt_builder)
+        self.async_session_factory = async_session_factory
+        # 为None时使用全局的微批处理器
+        self.embedding_batcher = batcher
+        self.stage_timeouts = {
+            'retrieval': RETRIEVAL_TIMEOUT,
+            'entities': ENTITY_TIMEOUT,
+            'core_entities': ENTITY_TIMEOUT,
+            'history': HISTORY_TIMEOUT
+        }
+        self.stage_timeouts.update(stage_timeouts or {})
+        # 最近一轮各阶段的状态 ('ok' / 'timeout' / 'error') 和耗时
+        self.last_stage_report: Dict[str, Dict] = {}
+        
+    def generate_response(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]] = None,
+        conversation_id: Optional[int] = None
+    ) -> str:
+        """
+        同步接口 (供测试和脚本使用), 不能在运行中的事件循环里调用
+        
+        asyncio.run 会新建事件循环, 而全局异步连接池和微批处理器属于服务的事件循环;
+        这里改用本次调用独占的异步引擎和微批处理器, 结束时一并释放
+        """
+        return asyncio.run(self._agenerate_isolated(user_input, conversation_history, conversation_id))
+        
+    async def _agenerate_isolated(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]],
+        conversation_id: Optional[int]
+    ) -> str:
+        shared = self.async_session_factory, self.embedding_batcher
+        self.embedding_batcher = EmbeddingBatcher(embedder)
+        try:
+            async with isolated_async_sessionmaker(self.async_session_factory) as session_factory:
+                self.async_session_factory = session_factory
+                return await self.agenerate_response(user_input, conversation_history, conversation_id)
+        finally:
+            await self.embedding_batcher.stop()
+            self.async_session_factory, self.embedding_batcher = shared
+        
+    async def agenerate_response(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]] = None,
+        conversation_id: Optional[int] = None
+    ) -> str:
+        """异步生成完整回复"""
+        return ''.join([
+            token async for token in self.stream_response(user_input, conversation_history, conversation_id)
+        ])
+        
+    async def _aprepare(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]],
+        conversation_id: Optional[int]
+    ):
+        """并发执行准备阶段, 返回提示词和本轮抽取的实体"""
+        loop = asyncio.get_running_loop()
+        if conversation_id is not None:
+            # 归属校验不走降级的阶段, 会话不属于当前用户时直接拒绝本轮
+            await conversation_contexts.acheck_owner(conversation_id, self.user_id, self.async_session_factory)
+        
+        async def load_history():
+            if conversation_history is not None:
+                return conversation_history
+            if conversation_id is None:
+                return []
+            with span('history'):
+                return await conversation_contexts.aget(conversation_id, self.async_session_factory, self.user_id)
+            
+        # 线程池中的阶段通过instrumentation.run_in_executor带上本轮的计时记录
+        relevant_memories, entities, core_entities, history = await asyncio.gather(
+            self._stage('retrieval', instrumentation.run_in_executor(
+                loop, self.memory_system.retrieve_relevant_memories, user_input
+            ), []),
+            self._stage('entities', instrumentation.run_in_executor(loop, self.extract_entities, user_input), []),
+            self._stage('core_entities', instrumentation.run_in_executor(
+                loop, lambda: self.memory_system.entity_index.entities()
+            ), []),
+            self._stage('history', load_history(), [])
+        )
+        
+        with span('prompt_build'):
+            report = self.prompt_builder.build(user_input, history, relevant_memories, core_entities)
+        self.last_prompt_report = report
+        return report['prompt'], entities
+        
+    async def _stage(self, name: str, awaitable, default):
+        """带超时执行一个阶段, 超时或出错时返回默认值"""
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout=self.stage_timeouts[name])
+            status = 'ok'
+        except asyncio.TimeoutError:
+            result, status = default, 'timeout'
+        except Exception as e:
+            logger.warning("对话阶段%s失败: %s", name, e)
+            result, status = default, 'error'
+        self.last_stage_report[name] = {
+            'status': status,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3)
+        }
+        return result
+        
+    async def _arecord_turn(
+        self,
+        user_input: str,
+        response: str,
+        entities: List[Dict],
+        conversation_id: Optional[int]
+    ):
+        """
+        写入本轮实体、向量记忆和消息
         
-    def _extract_context(self, text: str, keyword: str) -> str:
-        """提取关键词上下文"""
-        # 简化实现，实际应用中可能需要更复杂的NLP处理
-        return text[:100]  # 返回前100个字符作为上下文
\ No newline at end of file
+        实体upsert复用同步实现, 在线程池中执行; 用户发言的向量化经过微批处理器,
+        与同一时刻其他连接的写入合并为一次调用
+        """
+        for entity in entities:
+            self.memory_system.remember_entity(entity['type'], entity['name'], {'context': entity['context']})
+        with span('persistence'):
+            writes = [instrumentation.run_in_executor(
+                asyncio.get_running_loop(), self.memory_system.flush_structured_memories
+            )]
+            if DIALOGUE_MEMORY_ON_WRITE:
+                writes.append(self.memory_system.astore_unstructured_memory(
+                    user_input, self._dialogue_metadata(conversation_id), self.embedding_batcher
+                ))
+            if conversation_id is not None:
+                writes.append(conversation_contexts.aappend(conversation_id, [
+                    {'role': 'user', 'content': user_input},
+                    {'role': 'assistant', 'content': response}
+                ], self.async_session_factory, user_id=self.user_id))
+            await asyncio.gather(*writes)
@@ -0,0 +1,261 @@
+"""
+近似最近邻索引 - 倒排文件(IVF)索引,用于大规模记忆集合的快速检索
+"""
+
+from typing import Dict, Optional, Sequence, Tuple
+from array import array
+import os
+import time
+import numpy as np
+
+from vector_store import top_k_indices
+
+
+def spherical_kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    iterations: int = 10,
+    seed: int = 0,
+    chunk_size: int = 4096
+) -> np.ndarray:
+    """
+    球面k-means聚类 (以内积作为相似度)
+
+    Args:
+        vectors: 已归一化的(n, dim)矩阵
+        n_clusters: 聚类中心数量
+        iterations: 迭代次数
+        seed: 随机种子
+        chunk_size: 分块计算的行数,用于限制临时内存
+
+    Returns:
+        (n_clusters, dim)的聚类中心矩阵
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    n_clusters = min(n_clusters, n)
+
+    centroids = vectors[rng.choice(n, n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(vectors, centroids, chunk_size)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # 空簇重新随机选点,避免聚类中心退化
+        empty = np.flatnonzero(counts == 0)
+        if len(empty) > 0:
+            sums[empty] = vectors[rng.choice(n, len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+    """将每个向量分配到内积最大的聚类中心"""
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], chunk_size):
+        block = vectors[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """
+    倒排文件索引
+
+    向量按最近的聚类中心分桶,检索时只扫描与查询最接近的nprobe个桶。
+    训练完成后的新向量直接追加到对应的桶中,无需重建索引; 但桶数按训练时的规模决定,
+    数据增长到训练时的数倍后每个桶过大, 应重新训练 (见 needs_retrain)。
+    nprobe越大召回率越高,延迟也越高。
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        n_lists: Optional[int] = None,
+        nprobe: int = 8,
+        train_iterations: int = 10,
+        seed: int = 0,
+        train_samples_per_list: int = 64
+    ):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.seed = seed
+        # 每个桶最多使用的训练样本数, 大规模数据只抽样训练
+        self.train_samples_per_list = train_samples_per_list
+
+        self.centroids: Optional[np.ndarray] = None
+        # 训练时的向量数
+        self.trained_size = 0
+        self._lists = []
+        self._size = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def train(self, vectors: np.ndarray):
+        """
+        训练聚类中心
+
+        Args:
+            vectors: 全部向量,未指定n_lists时按 sqrt(n) 决定桶数;
+                超过 n_lists * train_samples_per_list 行时随机抽样训练
+        """
+        n = vectors.shape[0]
+        n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+        sample_size = n_lists * self.train_samples_per_list
+        if n > sample_size:
+            rows = np.sort(np.random.default_rng(self.seed).choice(n, sample_size, replace=False))
+            vectors = vectors[rows]
+        self.set_centroids(
+            spherical_kmeans(np.asarray(vectors), n_lists, iterations=self.train_iterations, seed=self.seed),
+            trained_size=n
+        )
+
+    def set_centroids(self, centroids: np.ndarray, trained_size: int):
+        """使用已训练好的聚类中心, 并清空所有桶"""
+        self.centroids = centroids
+        self.trained_size = trained_size
+        self._lists = [array('q') for _ in range(centroids.shape[0])]
+        self._size = 0
+
+    def needs_retrain(self, growth_factor: float) -> bool:
+        """索引中的向量数是否已达到训练时的growth_factor倍"""
+        return self.is_trained and self._size >= self.trained_size * growth_factor
+
+    def save_centroids(self, path: str):
+        """把聚类中心和训练时的规模写入文件 (先写临时文件再替换)"""
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, centroids=self.centroids, trained_size=self.trained_size)
+        os.replace(path + '.tmp', path)
+
+    def load_centroids(self, path: str) -> bool:
+        """
+        读取 save_centroids 保存的聚类中心
+
+        Returns:
+            是否读取成功 (文件不存在或维度不一致时为False)
+        """
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            centroids, trained_size = data['centroids'], int(data['trained_size'])
+        if centroids.ndim != 2 or centroids.shape[1] != self.dim:
+            return False
+        self.set_centroids(centroids.astype(np.float32), trained_size)
+        return True
+
+    def add(self, rows: Sequence[int], vectors: np.ndarray):
+        """
+        增量写入向量
+
+        Args:
+            rows: 向量在存储中的行号
+            vectors: 对应的向量
+        """
+        if not self.is_trained:
+            raise RuntimeError("索引尚未训练")
+
+        assignments = assign_to_centroids(vectors, self.centroids)
+        for row, list_id in zip(rows, assignments):
+            self._lists[list_id].append(int(row))
+        self._size += len(assignments)
+
+    def search(
+        self,
+        vectors: np.ndarray,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        近似Top-K检索
+
+        Args:
+            vectors: 存储中的全部向量,候选行在其中精确打分
+            queries: 已归一化的(q, dim)查询矩阵
+            k: 每个查询返回的数量
+            nprobe: 扫描的桶数,默认使用索引配置
+
+        Returns:
+            (行号矩阵, 分数矩阵),候选不足k个时以-1和-inf补齐
+        """
+        if not self.is_trained:
+            raise RuntimeError("索引尚未训练")
+
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        probes = top_k_indices(queries @ self.centroids.T, nprobe)
+
+        result_rows = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        result_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([
+                np.frombuffer(self._lists[list_id], dtype=np.int64)
+                for list_id in probes[i]
+            ])
+            if len(candidates) == 0:
+                continue
+
+            scores = vectors[candidates] @ query
+            count = min(k, len(candidates))
+            top = top_k_indices(scores.reshape(1, -1), count)[0]
+
+            result_rows[i, :count] = candidates[top]
+            result_scores[i, :count] = scores[top]
+
+        return result_rows, result_scores
+
+
+def evaluate_recall(
+    store,
+    queries: Sequence[Sequence[float]],
+    k: int = 10,
+    nprobe: Optional[int] = None
+) -> Dict:
+    """
+    评估近似检索相对精确检索的召回率
+
+    Args:
+        store: 已建立ANN索引的VectorStore
+        queries: 查询向量列表
+        k: Top-K
+        nprobe: 扫描的桶数
+
+    Returns:
+        召回率及两种检索方式的平均延迟(毫秒)
+    """
+    started = time.perf_counter()
+    exact_rows, _ = store.search(queries, k, exact=True)
+    exact_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    approx_rows, _ = store.search(queries, k, nprobe=nprobe)
+    approx_ms = (time.perf_counter() - started) * 1000
+
+    hits = 0
+    total = 0
+    for exact, approx in zip(exact_rows, approx_rows):
+        hits += len(set(exact.tolist()) & set(approx.tolist()))
+        total += len(exact)
+
+    query_count = max(len(exact_rows), 1)
+    return {
+        'k': k,
+        'nprobe': nprobe or (store.ann_index.nprobe if store.ann_index else None),
+        'recall': round(hits / total, 4) if total else 1.0,
+        'exact_latency_ms': round(exact_ms / query_count, 3),
+        'approx_latency_ms': round(approx_ms / query_count, 3)
+    }
@@ -0,0 +1,30 @@
+"""
+后台定时任务 - 按固定间隔在线程池中执行阻塞的维护任务 (记忆整理、分区维护、汇总追赶等)
+"""
+
+from typing import Any, Callable
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def run_periodically(task: Callable[[], Any], interval_seconds: float, description: str):
+    """
+    在后台按固定间隔执行任务
+
+    任务在线程池中运行, 不阻塞事件循环; 单次失败只记录日志, 下个周期继续执行
+
+    Args:
+        task: 无参数的阻塞函数, 返回值会写入日志
+        interval_seconds: 两次执行之间的间隔 (秒)
+        description: 日志中的任务名称
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            result = await loop.run_in_executor(None, task)
+            logger.info("%s完成: %s", description, result)
+        except Exception as e:
+            logger.exception("%s失败: %s", description, e)
+        await asyncio.sleep(interval_seconds)
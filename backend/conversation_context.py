@@ -0,0 +1,240 @@
+"""
+对话上下文缓存 - 按会话在服务端保存最近若干轮消息,未命中时从数据库加载
+"""
+
+from typing import Dict, List, Optional, Sequence
+from collections import OrderedDict, deque
+import os
+import threading
+
+from sqlalchemy import select
+from database import Conversation, Message, SessionLocal, session_scope, async_session_scope
+
+# 每个会话保留的最近消息数, 以及最多缓存的会话数
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", "20"))
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "1000"))
+
+
+class ConversationAccessError(PermissionError):
+    """会话不存在或不属于当前用户"""
+
+
+class ConversationContextCache:
+    """
+    会话上下文环形缓冲
+
+    每个会话对应一个定长deque,追加消息时自动丢弃最早的一条;
+    会话之间按LRU淘汰。读取一轮上下文的开销只与窗口大小有关,与会话总长度无关。
+    指定user_id时, 读写前校验会话属于该用户; 会话的所属用户同样按LRU缓存。
+    """
+
+    def __init__(
+        self,
+        window: Optional[int] = None,
+        max_conversations: Optional[int] = None,
+        session_factory=None
+    ):
+        self.window = window or CONTEXT_WINDOW
+        self.max_conversations = max_conversations or CONTEXT_CACHE_SIZE
+        self.session_factory = session_factory
+        self._buffers: OrderedDict = OrderedDict()
+        self._owners: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, conversation_id: int, user_id: Optional[int] = None) -> List[Dict]:
+        """
+        获取会话最近的消息
+
+        Args:
+            conversation_id: 会话ID
+            user_id: 当前用户; 指定时会话不属于该用户则抛出ConversationAccessError
+
+        Returns:
+            按时间顺序的消息列表, 每项包含role和content
+        """
+        if user_id is not None:
+            self.check_owner(conversation_id, user_id)
+        cached = self._lookup(conversation_id)
+        if cached is not None:
+            return cached
+
+        # 加载期间不持有锁, 避免慢查询阻塞其他会话
+        return self._store_loaded(conversation_id, self._load(conversation_id))
+
+    async def aget(
+        self,
+        conversation_id: int,
+        async_session_factory=None,
+        user_id: Optional[int] = None
+    ) -> List[Dict]:
+        """get() 的异步版本, 未命中时通过异步会话加载"""
+        if user_id is not None:
+            await self.acheck_owner(conversation_id, user_id, async_session_factory)
+        cached = self._lookup(conversation_id)
+        if cached is not None:
+            return cached
+
+        async with async_session_scope(async_session_factory) as session:
+            result = await session.execute(self._recent_messages_query(conversation_id))
+            rows = result.all()
+        return self._store_loaded(conversation_id, self._to_messages(rows))
+
+    def append(self, conversation_id: int, messages: Sequence[Dict], user_id: Optional[int] = None):
+        """
+        写入消息并同步缓冲
+
+        消息先在一个事务中写入数据库, 提交成功后再追加到缓冲;
+        未缓存的会话不加载, 下次读取时会从数据库得到最新内容。
+
+        Args:
+            conversation_id: 会话ID
+            messages: 消息列表, 每项包含role和content
+            user_id: 当前用户; 指定时会话不属于该用户则抛出ConversationAccessError
+        """
+        if not messages:
+            return
+        if user_id is not None:
+            self.check_owner(conversation_id, user_id)
+
+        with session_scope(self.session_factory or SessionLocal) as session:
+            session.add_all(self._to_rows(conversation_id, messages, user_id))
+        self._extend(conversation_id, messages)
+
+    async def aappend(
+        self,
+        conversation_id: int,
+        messages: Sequence[Dict],
+        async_session_factory=None,
+        user_id: Optional[int] = None
+    ):
+        """append() 的异步版本"""
+        if not messages:
+            return
+        if user_id is not None:
+            await self.acheck_owner(conversation_id, user_id, async_session_factory)
+
+        async with async_session_scope(async_session_factory) as session:
+            session.add_all(self._to_rows(conversation_id, messages, user_id))
+        self._extend(conversation_id, messages)
+
+    def check_owner(self, conversation_id: int, user_id: int):
+        """
+        校验会话属于指定用户
+
+        Raises:
+            ConversationAccessError: 会话不存在或属于其他用户
+        """
+        owner = self._lookup_owner(conversation_id)
+        if owner is None:
+            session = (self.session_factory or SessionLocal)()
+            try:
+                owner = session.execute(self._owner_query(conversation_id)).scalar()
+            finally:
+                session.close()
+        self._verify_owner(conversation_id, owner, user_id)
+
+    async def acheck_owner(self, conversation_id: int, user_id: int, async_session_factory=None):
+        """check_owner() 的异步版本"""
+        owner = self._lookup_owner(conversation_id)
+        if owner is None:
+            async with async_session_scope(async_session_factory) as session:
+                owner = (await session.execute(self._owner_query(conversation_id))).scalar()
+        self._verify_owner(conversation_id, owner, user_id)
+
+    def invalidate(self, conversation_id: Optional[int] = None):
+        """丢弃一个或全部会话的缓冲"""
+        with self._lock:
+            if conversation_id is None:
+                self._buffers.clear()
+                self._owners.clear()
+            else:
+                self._buffers.pop(conversation_id, None)
+                self._owners.pop(conversation_id, None)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'conversations': len(self._buffers),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions
+        }
+
+    def _lookup(self, conversation_id: int) -> Optional[List[Dict]]:
+        with self._lock:
+            buffer = self._buffers.get(conversation_id)
+            if buffer is None:
+                self.misses += 1
+                return None
+            self._buffers.move_to_end(conversation_id)
+            self.hits += 1
+            return list(buffer)
+
+    def _store_loaded(self, conversation_id: int, messages: List[Dict]) -> List[Dict]:
+        loaded = deque(messages, maxlen=self.window)
+        with self._lock:
+            # 加载期间其他线程可能已经写入了该会话, 以已有的缓冲为准
+            buffer = self._buffers.setdefault(conversation_id, loaded)
+            self._buffers.move_to_end(conversation_id)
+            self._evict()
+            return list(buffer)
+
+    def _extend(self, conversation_id: int, messages: Sequence[Dict]):
+        with self._lock:
+            buffer = self._buffers.get(conversation_id)
+            if buffer is not None:
+                buffer.extend({'role': message['role'], 'content': message['content']} for message in messages)
+
+    def _lookup_owner(self, conversation_id: int) -> Optional[int]:
+        with self._lock:
+            owner = self._owners.get(conversation_id)
+            if owner is not None:
+                self._owners.move_to_end(conversation_id)
+            return owner
+
+    def _verify_owner(self, conversation_id: int, owner: Optional[int], user_id: int):
+        if owner != user_id:
+            raise ConversationAccessError(f"会话{conversation_id}不存在或不属于当前用户")
+        with self._lock:
+            self._owners[conversation_id] = owner
+            self._owners.move_to_end(conversation_id)
+            while len(self._owners) > self.max_conversations:
+                self._owners.popitem(last=False)
+
+    @staticmethod
+    def _owner_query(conversation_id: int):
+        return select(Conversation.user_id).where(Conversation.id == conversation_id)
+
+    def _recent_messages_query(self, conversation_id: int):
+        return select(Message.role, Message.content).where(
+            Message.conversation_id == conversation_id
+        ).order_by(Message.timestamp.desc(), Message.id.desc()).limit(self.window)
+
+    def _load(self, conversation_id: int) -> List[Dict]:
+        session = (self.session_factory or SessionLocal)()
+        try:
+            rows = session.execute(self._recent_messages_query(conversation_id)).all()
+        finally:
+            session.close()
+        return self._to_messages(rows)
+
+    @staticmethod
+    def _to_messages(rows) -> List[Dict]:
+        return [{'role': role, 'content': content} for role, content in reversed(rows)]
+
+    @staticmethod
+    def _to_rows(conversation_id: int, messages: Sequence[Dict], user_id: Optional[int] = None) -> List[Message]:
+        return [
+            Message(conversation_id=conversation_id, user_id=user_id, role=message['role'], content=message['content'])
+            for message in messages
+        ]
+
+    def _evict(self):
+        while len(self._buffers) > self.max_conversations:
+            self._buffers.popitem(last=False)
+            self.evictions += 1
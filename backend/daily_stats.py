@@ -0,0 +1,317 @@
+"""
+按天统计汇总 - 维护daily_user_stats, 每个用户每天一行
+
+消息和对话的写入、修改和删除在同一事务中增量更新 (见 database.update_daily_stats);
+关闭增量更新、直接用SQL导入、修改或删除数据后, 用 rebuild_daily_stats 按时间段重算。
+回顾读取时会用本期的原始计数校验汇总, 不一致时退回逐条分析 (见 review_aggregator)。
+回顾的统计数据、情感时间线和主题频次从汇总行得到, 年度回顾最多读取366行。
+
+用法:
+    python daily_stats.py                       # 重算最近 DAILY_STATS_CATCH_UP_DAYS 天
+    python daily_stats.py 2024-01-01 2024-12-31 # 重算指定时间段
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+import logging
+import os
+import sys
+
+from sqlalchemy import delete, inspect, select, tuple_
+
+from database import Conversation, DailyUserStats, Message, engine, upsert_statement
+from review_analyzer import EmotionAnalyzer, TopicExtractor
+
+# 写入消息时是否同步更新汇总
+DAILY_STATS_ON_WRITE = os.getenv("DAILY_STATS_ON_WRITE", "true").lower() == "true"
+# 后台重算最近若干天汇总的间隔 (秒), 为0时不启动
+DAILY_STATS_CATCH_UP_INTERVAL = float(os.getenv("DAILY_STATS_CATCH_UP_INTERVAL", "0"))
+DAILY_STATS_CATCH_UP_DAYS = int(os.getenv("DAILY_STATS_CATCH_UP_DAYS", "2"))
+
+COUNTER_COLUMNS = (
+    'user_messages', 'assistant_messages', 'conversations',
+    'positive_messages', 'neutral_messages', 'negative_messages'
+)
+
+_emotion_analyzer = EmotionAnalyzer()
+_topic_extractor = TopicExtractor()
+_table = DailyUserStats.__table__
+
+logger = logging.getLogger(__name__)
+
+
+def empty_stats() -> Dict:
+    stats = {column: 0 for column in COUNTER_COLUMNS}
+    stats.update(sentiment_sum=0.0, topic_counts={}, active=False)
+    return stats
+
+
+def add_message(stats: Dict, role: str, content: Optional[str]):
+    """把一条消息计入当天的统计"""
+    stats['active'] = True
+    if role == 'assistant':
+        stats['assistant_messages'] += 1
+    if role != 'user':
+        return
+
+    content = content or ''
+    score, emotion = _emotion_analyzer.score_message(content)
+    stats['user_messages'] += 1
+    stats['sentiment_sum'] += score
+    stats[f'{emotion}_messages'] += 1
+    for topic in _topic_extractor.match_topics(content):
+        stats['topic_counts'][topic] = stats['topic_counts'].get(topic, 0) + 1
+
+
+def merge_stats(target: Dict, increment: Dict) -> Dict:
+    """把increment累加到target上 (target可以是数据库中的汇总行)"""
+    merged = {column: (target.get(column) or 0) + increment[column] for column in COUNTER_COLUMNS}
+    merged['sentiment_sum'] = (target.get('sentiment_sum') or 0.0) + increment['sentiment_sum']
+    topic_counts = dict(target.get('topic_counts') or {})
+    for topic, count in increment['topic_counts'].items():
+        topic_counts[topic] = topic_counts.get(topic, 0) + count
+    merged['topic_counts'] = {topic: count for topic, count in topic_counts.items() if count > 0}
+    if increment.get('retracted'):
+        # 撤回消息后按剩余的消息数重新判断当天是否活跃
+        merged['active'] = merged['user_messages'] + merged['assistant_messages'] > 0
+    else:
+        merged['active'] = bool(target.get('active')) or increment['active']
+    return merged
+
+
+def retract_stats(increments: Dict[Tuple[int, date], Dict]) -> Dict[Tuple[int, date], Dict]:
+    """把collect_stats()的结果取反, 用于从汇总中减去删除或修改前的消息"""
+    return {
+        key: dict(
+            {column: -stats[column] for column in COUNTER_COLUMNS},
+            sentiment_sum=-stats['sentiment_sum'],
+            topic_counts={topic: -count for topic, count in stats['topic_counts'].items()},
+            active=False,
+            retracted=True
+        )
+        for key, stats in increments.items()
+    }
+
+
+def collect_stats(
+    messages: Iterable[Tuple[int, datetime, str, str]],
+    conversations: Iterable[Tuple[int, datetime]] = ()
+) -> Dict[Tuple[int, date], Dict]:
+    """
+    按 (用户, 日期) 汇总消息和对话
+
+    Args:
+        messages: (user_id, timestamp, role, content)
+        conversations: (user_id, created_at)
+
+    Returns:
+        (user_id, day) -> 统计
+    """
+    stats: Dict[Tuple[int, date], Dict] = {}
+    for user_id, timestamp, role, content in messages:
+        if user_id is not None and timestamp is not None:
+            add_message(stats.setdefault((user_id, timestamp.date()), empty_stats()), role, content)
+    for user_id, created_at in conversations:
+        if user_id is not None and created_at is not None:
+            stats.setdefault((user_id, created_at.date()), empty_stats())['conversations'] += 1
+    return stats
+
+
+def apply_stats(connection, increments: Dict[Tuple[int, date], Dict]):
+    """
+    把增量累加到汇总行
+
+    先为缺少的 (用户, 日期) 插入空行 (冲突时忽略), 再锁定这些行逐行累加,
+    并发写入同一天的消息时不会丢失计数。
+
+    Args:
+        connection: 数据库连接, 在调用方的事务中执行
+        increments: collect_stats() 的结果
+    """
+    if not increments:
+        return
+
+    keys = list(increments)
+    statement = upsert_statement(connection.dialect.name, _table, ['user_id', 'day'])
+    if statement is not None:
+        connection.execute(statement, [{'user_id': user_id, 'day': day} for user_id, day in keys])
+
+    rows = connection.execute(
+        select(_table).where(tuple_(_table.c.user_id, _table.c.day).in_(keys)).with_for_update()
+    ).mappings().all()
+    existing = {(row['user_id'], row['day']): row for row in rows}
+
+    for key, increment in increments.items():
+        row = existing.get(key)
+        if row is None:
+            # 其他数据库没有冲突忽略的插入, 直接插入
+            connection.execute(_table.insert().values(
+                user_id=key[0], day=key[1], updated_at=datetime.utcnow(), **stored_stats(merge_stats({}, increment))
+            ))
+        else:
+            connection.execute(_table.update().where(_table.c.id == row['id']).values(
+                updated_at=datetime.utcnow(), **stored_stats(merge_stats(dict(row), increment))
+            ))
+
+
+def stored_stats(stats: Dict) -> Dict:
+    """去掉merge_stats()结果中不属于汇总表的键"""
+    return {key: value for key, value in stats.items() if key != 'retracted'}
+
+
+MESSAGE_FIELDS = ('user_id', 'timestamp', 'role', 'content')
+CONVERSATION_FIELDS = ('user_id', 'created_at')
+
+
+def row_values(obj, fields: Tuple[str, ...]) -> Tuple:
+    return tuple(getattr(obj, field) for field in fields)
+
+
+def previous_values(obj, fields: Tuple[str, ...]) -> Optional[Tuple]:
+    """
+    修改前的字段值
+
+    Returns:
+        字段均未修改时返回None
+    """
+    state = inspect(obj)
+    histories = [state.attrs[field].history for field in fields]
+    if not any(history.has_changes() for history in histories):
+        return None
+    return tuple(
+        (history.deleted or history.unchanged or history.added or [None])[0]
+        for history in histories
+    )
+
+
+def record_changes(session):
+    """after_flush钩子: 把本次flush新写入、修改和删除的消息及对话计入汇总"""
+    fields = {Message: MESSAGE_FIELDS, Conversation: CONVERSATION_FIELDS}
+    added = {Message: [], Conversation: []}
+    removed = {Message: [], Conversation: []}
+
+    for obj in session.new:
+        if type(obj) in fields:
+            added[type(obj)].append(row_values(obj, fields[type(obj)]))
+    for obj in session.deleted:
+        if type(obj) in fields:
+            removed[type(obj)].append(row_values(obj, fields[type(obj)]))
+    for obj in session.dirty:
+        if type(obj) in fields:
+            previous = previous_values(obj, fields[type(obj)])
+            if previous is not None:
+                removed[type(obj)].append(previous)
+                added[type(obj)].append(row_values(obj, fields[type(obj)]))
+
+    if added[Message] or added[Conversation]:
+        apply_stats(session.connection(), collect_stats(added[Message], added[Conversation]))
+    if removed[Message] or removed[Conversation]:
+        apply_stats(session.connection(), retract_stats(collect_stats(removed[Message], removed[Conversation])))
+
+
+def rebuild_daily_stats(
+    connection,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: Optional[int] = None,
+    batch_size: int = 5000
+) -> int:
+    """
+    按原始消息和对话重算一段时间的汇总行 (追赶任务和首次回填)
+
+    Args:
+        connection: 数据库连接, 在调用方的事务中执行
+        start: 起始日期 (含), 为None时从最早的数据开始
+        end: 结束日期 (含), 为None时到最新的数据
+        user_id: 只重算该用户
+
+    Returns:
+        写入的汇总行数
+    """
+    def in_range(query, user_column, time_column):
+        if user_id is not None:
+            query = query.where(user_column == user_id)
+        if start is not None:
+            query = query.where(time_column >= datetime.combine(start, datetime.min.time()))
+        if end is not None:
+            query = query.where(time_column < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+        return query
+
+    stale = delete(_table)
+    if user_id is not None:
+        stale = stale.where(_table.c.user_id == user_id)
+    if start is not None:
+        stale = stale.where(_table.c.day >= start)
+    if end is not None:
+        stale = stale.where(_table.c.day <= end)
+    connection.execute(stale)
+
+    # 按id分批读取消息, 不一次把整段时间的原文载入内存
+    stats: Dict[Tuple[int, date], Dict] = {}
+    last_id = 0
+    while True:
+        batch = connection.execute(in_range(
+            select(Message.id, Message.user_id, Message.timestamp, Message.role, Message.content),
+            Message.user_id, Message.timestamp
+        ).where(Message.id > last_id).order_by(Message.id).limit(batch_size)).all()
+        if not batch:
+            break
+        for key, increment in collect_stats(row[1:] for row in batch).items():
+            stats[key] = merge_stats(stats.get(key, {}), increment)
+        last_id = batch[-1][0]
+
+    conversations = connection.execute(in_range(
+        select(Conversation.user_id, Conversation.created_at), Conversation.user_id, Conversation.created_at
+    )).all()
+    for key, increment in collect_stats((), conversations).items():
+        stats[key] = merge_stats(stats.get(key, {}), increment)
+
+    if stats:
+        connection.execute(_table.insert(), [
+            dict(user_id=user_id_, day=day, updated_at=datetime.utcnow(), **values)
+            for (user_id_, day), values in stats.items()
+        ])
+    return len(stats)
+
+
+def catch_up(days: int = DAILY_STATS_CATCH_UP_DAYS, bind=None, today: Optional[date] = None) -> int:
+    """重算最近days天 (含今天) 的汇总"""
+    today = today or datetime.utcnow().date()
+    with (bind or engine).begin() as connection:
+        return rebuild_daily_stats(connection, start=today - timedelta(days=days - 1), end=today)
+
+
+def load_daily_stats(session, user_id: int, start: date, end: date) -> List[Dict]:
+    """
+    读取用户一段时间的汇总行
+
+    Returns:
+        按日期排列的统计, date为ISO格式字符串
+    """
+    rows = session.execute(
+        select(_table).where(
+            _table.c.user_id == user_id, _table.c.day >= start, _table.c.day <= end
+        ).order_by(_table.c.day)
+    ).mappings().all()
+    return [
+        dict(
+            {column: row[column] or 0 for column in COUNTER_COLUMNS},
+            date=row['day'].isoformat(),
+            sentiment_sum=row['sentiment_sum'] or 0.0,
+            topic_counts=row['topic_counts'] or {},
+            active=bool(row['active'])
+        )
+        for row in rows
+    ]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) == 3:
+        with engine.begin() as connection:
+            count = rebuild_daily_stats(
+                connection, date.fromisoformat(sys.argv[1]), date.fromisoformat(sys.argv[2])
+            )
+    else:
+        count = catch_up()
+    logger.info("已写入%s行汇总", count)
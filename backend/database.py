@@ -1,15 +1,111 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import create_engine, event, inspect, select, Column, Integer, String, Text, DateTime, Date, Float, Boolean, ForeignKey, JSON, UniqueConstraint, Index
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import Session, sessionmaker, relationship
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+from contextlib import contextmanager, asynccontextmanager
 from datetime import datetime
+from typing import Callable, Dict, List, Optional
 import os
+import threading
+import time
 
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/echoes_of_memory")
 
-engine = create_engine(DATABASE_URL)
+# 连接池配置: 常驻连接数、高峰时允许额外创建的连接数、取连接的最长等待秒数、
+# 连接回收周期 (秒, 早于数据库或中间代理的空闲断开时间), 以及取出前是否先探活
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+class InstrumentedQueuePool(QueuePool):
+    """记录取连接等待时间和超时次数的连接池"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        
+    def _do_get(self):
+        # 等待时间包含池中无空闲连接时新建连接的耗时
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self._record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        self._record_wait(time.perf_counter() - started)
+        return connection
+        
+    def _record_wait(self, seconds: float, timed_out: bool = False):
+        with self._stats_lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            
+    def wait_stats(self) -> Dict:
+        with self._stats_lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(self.wait_seconds / attempts * 1000, 3) if attempts else 0.0,
+                'max_wait_ms': round(self.max_wait_seconds * 1000, 3)
+            }
+
+# 按连接串生成引擎参数; SQLite使用驱动默认的连接池, 只对服务端数据库配置池大小
+def engine_options(url: str) -> Dict:
+    options = {'pool_pre_ping': DB_POOL_PRE_PING}
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE
+        )
+    return options
+
+# 创建同步引擎, 服务端数据库使用带等待统计的连接池
+def create_db_engine(url: str):
+    options = engine_options(url)
+    if not url.startswith("sqlite"):
+        options['poolclass'] = InstrumentedQueuePool
+    return create_engine(url, **options)
+
+# 连接池的实时状态
+def pool_stats(bind=None) -> Dict:
+    pool = (bind or engine).pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            # overflow() 在常驻连接未用满时为负数
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.wait_stats())
+    return stats
+
+engine = create_db_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步引擎在首次使用时创建, 只使用同步接口的进程不需要安装异步驱动
+_async_engine = None
+_async_sessionmaker = None
+
 Base = declarative_base()
 
 # 用户模型
@@ -28,6 +124,10 @@ class User(Base):
 # 对话记录模型
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # 按用户和时间段查询对话 (回顾数据聚合)
+        Index("ix_conversations_user_created", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -44,9 +144,16 @@ class Conversation(Base):
 # 消息模型
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # 按会话和时间段查询消息
+        Index("ix_messages_conversation_timestamp", "conversation_id", "timestamp"),
+        # 按用户和时间段查询消息, 不需要先列出用户的全部会话
+        Index("ix_messages_user_timestamp", "user_id", "timestamp"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
+    user_id = Column(Integer, ForeignKey("users.id"))  # 冗余自所属会话, 写入时自动填充
     content = Column(Text)
     role = Column(String)  # 'user' 或 'assistant'
     timestamp = Column(DateTime, default=datetime.utcnow)
@@ -54,9 +161,40 @@ class Message(Base):
     # 关联对话
     conversation = relationship("Conversation", back_populates="messages")
 
+# 消息的user_id始终取所属会话的用户, 调用方指定的值与会话不一致时拒绝写入
+@event.listens_for(Message, "before_insert")
+def fill_message_user_id(mapper, connection, target):
+    if target.conversation_id is None:
+        return
+    owner = connection.execute(
+        select(Conversation.user_id).where(Conversation.id == target.conversation_id)
+    ).scalar()
+    if owner is None:
+        return
+    if target.user_id is not None and target.user_id != owner:
+        raise ValueError(f"消息的user_id({target.user_id})与会话{target.conversation_id}的用户({owner})不一致")
+    target.user_id = owner
+
+# 更新时只在会话或用户发生变化时重新校验
+@event.listens_for(Message, "before_update")
+def refill_message_user_id(mapper, connection, target):
+    state = inspect(target)
+    conversation_changed = state.attrs.conversation_id.history.has_changes()
+    user_changed = state.attrs.user_id.history.has_changes()
+    if conversation_changed or user_changed:
+        if not user_changed:
+            # 消息移到其他会话时user_id跟随新会话
+            target.user_id = None
+        fill_message_user_id(mapper, connection, target)
+
 # 结构化记忆模型
 class StructuredMemory(Base):
     __tablename__ = "structured_memories"
+    __table_args__ = (
+        # 同一用户的同名实体只保留一行, 作为upsert的冲突目标
+        UniqueConstraint("user_id", "entity_type", "entity_name", name="uq_structured_memory_entity"),
+        Index("ix_structured_memories_user_created", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -68,9 +206,31 @@ class StructuredMemory(Base):
     # 关联用户
     user = relationship("User")
 
+# 实体共现关系模型 (同一条消息中同时出现的两个实体, 按类型和名称排序后只存一行)
+class EntityCooccurrence(Base):
+    __tablename__ = "entity_cooccurrences"
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "source_type", "source_name", "target_type", "target_name",
+            name="uq_entity_cooccurrence_pair"
+        ),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    source_type = Column(String)
+    source_name = Column(String)
+    target_type = Column(String)
+    target_name = Column(String)
+    weight = Column(Integer, default=1)  # 共现次数
+
 # 回顾报告模型
 class Review(Base):
     __tablename__ = "reviews"
+    __table_args__ = (
+        # 同一用户同一类型同一时间段只有一份报告, 也是查询已有报告的索引
+        Index("uq_reviews_period", "user_id", "review_type", "period_start", "period_end", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -91,14 +251,130 @@ class Review(Base):
     # 关联用户
     user = relationship("User")
 
-# 创建数据库表
+# 按用户按天的统计汇总 (写入、修改和删除消息及对话时增量更新, 回顾的统计和情感时间线直接读取)
+class DailyUserStats(Base):
+    __tablename__ = "daily_user_stats"
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", name="uq_daily_user_stats_day"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    day = Column(Date)
+    user_messages = Column(Integer, default=0)
+    assistant_messages = Column(Integer, default=0)
+    conversations = Column(Integer, default=0)  # 当天新建的对话数
+    sentiment_sum = Column(Float, default=0.0)  # 用户消息情感分数之和
+    positive_messages = Column(Integer, default=0)
+    neutral_messages = Column(Integer, default=0)
+    negative_messages = Column(Integer, default=0)
+    topic_counts = Column(JSON, default=dict)  # 主题 -> 命中的用户消息数
+    active = Column(Boolean, default=False)  # 当天是否有消息
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# 同一事务中把新写入、修改和删除的消息及对话计入按天汇总
+@event.listens_for(Session, "after_flush")
+def update_daily_stats(session, flush_context):
+    from daily_stats import DAILY_STATS_ON_WRITE, record_changes
+    if DAILY_STATS_ON_WRITE:
+        record_changes(session)
+
+# 生成 INSERT ... ON CONFLICT 语句: update接收excluded并返回要更新的列, 为None时冲突的行保持不变;
+# 其他数据库没有通用的upsert语法, 返回None由调用方逐行处理
+def upsert_statement(
+    dialect: str,
+    target,
+    index_elements: List[str],
+    update: Optional[Callable[[object], Dict]] = None
+):
+    if dialect not in ('postgresql', 'sqlite'):
+        return None
+    insert = (postgresql if dialect == 'postgresql' else sqlite).insert(target)
+    if update is None:
+        return insert.on_conflict_do_nothing(index_elements=index_elements)
+    return insert.on_conflict_do_update(index_elements=index_elements, set_=update(insert.excluded))
+
+# 创建数据库表, 并把已有数据库升级到最新的结构版本
 def create_tables():
+    from migrations import migrate
     Base.metadata.create_all(bind=engine)
+    migrate(engine)
 
 # 获取数据库会话
 def get_db():
-    db = SessionLocal()
-    try:
+    # 作为依赖注入使用时与session_scope相同: 请求正常结束提交, 出错回滚, 最终关闭
+    with session_scope() as db:
         yield db
+
+# 事务范围的会话: 正常结束时提交, 异常时回滚, 最终总是关闭
+@contextmanager
+def session_scope(session_factory=None):
+    session = (session_factory or SessionLocal)()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+# 把同步驱动的连接串转换为对应的异步驱动 (PostgreSQL -> asyncpg, SQLite -> aiosqlite)
+def to_async_url(url: str) -> str:
+    for sync_prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgres://", "postgresql+asyncpg://"),
+        ("sqlite+pysqlite://", "sqlite+aiosqlite://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+# 获取异步引擎
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        url = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+        _async_engine = create_async_engine(url, **engine_options(url))
+    return _async_engine
+
+# 获取异步会话工厂
+def get_async_sessionmaker():
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import AsyncSession
+        _async_sessionmaker = sessionmaker(
+            bind=get_async_engine(), class_=AsyncSession, expire_on_commit=False
+        )
+    return _async_sessionmaker
+
+# 临时事件循环 (如同步接口内的asyncio.run) 使用的异步会话工厂:
+# 未指定工厂时创建不复用连接的独立引擎, 退出时释放, 不占用全局异步连接池
+@asynccontextmanager
+async def isolated_async_sessionmaker(session_factory=None):
+    if session_factory is not None:
+        yield session_factory
+        return
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    url = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+    isolated_engine = create_async_engine(url, poolclass=NullPool)
+    try:
+        yield sessionmaker(bind=isolated_engine, class_=AsyncSession, expire_on_commit=False)
+    finally:
+        await isolated_engine.dispose()
+
+# 异步事务范围的会话
+@asynccontextmanager
+async def async_session_scope(session_factory=None):
+    session = (session_factory or get_async_sessionmaker())()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
     finally:
-        db.close()
\ No newline at end of file
+        await session.close()
@@ -0,0 +1,244 @@
+"""
+文本向量化 - 可插拔的向量化服务接口、本地哈希向量化实现和两级缓存
+"""
+
+from typing import Dict, List, Optional, Sequence
+from collections import OrderedDict
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+
+
+class EmbeddingProvider:
+    """向量化服务接口,实现方需提供 name、dim 和批量的 embed 方法"""
+
+    name = 'base'
+    dim = 0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        批量向量化
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            形状为(len(texts), dim)的float32矩阵
+        """
+        raise NotImplementedError
+
+
+class HashingEmbedder(EmbeddingProvider):
+    """
+    本地哈希向量化 - 无需网络和模型文件,结果在不同进程间确定一致
+
+    中文按字符1~3元组、其他文字按单词切分,特征经哈希映射到固定维度并带符号,
+    词频取对数后做L2归一化。字面重合越多的文本余弦相似度越高,适合离线和测试环境。
+    """
+
+    name = 'hashing-v1'
+
+    _TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fa5]+|[a-zA-Z0-9]+')
+
+    def __init__(self, dim: int = 1536, ngram_range: tuple = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            features: Dict[int, float] = {}
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                bucket = value % self.dim
+                sign = 1.0 if (value >> 63) & 1 else -1.0
+                features[bucket] = features.get(bucket, 0.0) + sign
+
+            for bucket, weight in features.items():
+                matrix[row, bucket] = np.sign(weight) * np.log1p(abs(weight))
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        low, high = self.ngram_range
+        for token in self._TOKEN_PATTERN.findall(text.lower()):
+            if token.isascii():
+                features.append(token)
+                continue
+            for n in range(low, high + 1):
+                features.extend(token[i:i + n] for i in range(len(token) - n + 1))
+        return features
+
+
+class EmbeddingCache:
+    """
+    两级向量缓存
+
+    - 进程内LRU: 以OrderedDict实现,命中时移到末尾
+    - 磁盘存储: SQLite文件,超过容量时淘汰最久未使用的条目
+    """
+
+    def __init__(
+        self,
+        max_memory_entries: int = 10000,
+        path: Optional[str] = None,
+        max_disk_entries: int = 200000
+    ):
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)"
+            )
+            self._conn.commit()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        批量查询缓存
+
+        Returns:
+            命中的 key -> 向量
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.memory_hits += len(found)
+
+            missing = [key for key in keys if key not in found]
+            if missing and self._conn is not None:
+                from_disk = self._load_from_disk(missing)
+                self.disk_hits += len(from_disk)
+                for key, vector in from_disk.items():
+                    self._remember(key, vector)
+                found.update(from_disk)
+
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        """批量写入两级缓存"""
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+
+            if self._conn is not None and items:
+                now = time.time()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+                )
+                self._evict_disk()
+                self._conn.commit()
+
+    def stats(self) -> Dict:
+        """缓存命中统计"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            'memory_entries': len(self._memory)
+        }
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _load_from_disk(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        # 分批查询,避免超出SQLite的参数数量限制
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+
+        if found:
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            self._conn.commit()
+        return found
+
+    def _evict_disk(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                "SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (overflow,)
+            )
+
+
+class CachedEmbedder(EmbeddingProvider):
+    """带缓存的向量化服务 - 以内容哈希为键,只对未命中的文本调用底层服务"""
+
+    def __init__(self, provider: EmbeddingProvider, cache: Optional[EmbeddingCache] = None):
+        self.provider = provider
+        self.cache = cache or EmbeddingCache()
+        self.name = provider.name
+        self.dim = provider.dim
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        keys = [self.cache_key(text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        found = self.cache.get_many(unique_keys)
+
+        # 同一批次中重复的文本只向量化一次
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+
+        if pending:
+            vectors = self.provider.embed(list(pending.values()))
+            computed = dict(zip(pending.keys(), vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        if not keys:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([found[key] for key in keys]).astype(np.float32, copy=False)
+
+    def cache_key(self, text: str) -> str:
+        """缓存键包含服务名和维度,切换模型后不会读到旧向量"""
+        return hashlib.sha256(f"{self.provider.name}:{self.dim}:{text}".encode('utf-8')).hexdigest()
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
@@ -0,0 +1,177 @@
+"""
+向量化微批处理 - 合并并发的向量化请求,按最大批量或最长等待时间统一提交
+"""
+
+from typing import Dict, List, Optional
+import asyncio
+import time
+import numpy as np
+
+from embedding import EmbeddingProvider
+
+
+class QueueFullError(Exception):
+    """队列已满且调用方选择不等待时抛出"""
+
+
+class EmbeddingBatcher:
+    """
+    向量化微批处理器
+
+    调用方通过 embed() 提交单条文本并等待结果;后台任务从有界队列中取出请求,
+    凑满 max_batch_size 条或等待超过 max_wait_ms 后一次性调用底层服务,
+    再把结果分发回各调用方。队列满时 embed() 会等待(或按需立即失败),形成背压。
+    """
+
+    def __init__(
+        self,
+        embedder: EmbeddingProvider,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+        max_queue_size: int = 1024
+    ):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        self.metrics = BatcherMetrics()
+
+    async def start(self):
+        """启动后台批处理任务 (事件循环更换后会重新创建队列)"""
+        if self._worker is None or self._worker.get_loop() is not asyncio.get_running_loop():
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """处理完队列中剩余的请求后停止"""
+        if self._worker is None:
+            return
+        if self._worker.get_loop() is not asyncio.get_running_loop():
+            # 创建后台任务的事件循环已经结束, 没有可以等待的请求
+            self._worker = None
+            return
+
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def embed(self, text: str, wait: bool = True) -> np.ndarray:
+        """
+        提交一条文本并等待向量结果
+
+        Args:
+            text: 待向量化的文本
+            wait: 队列已满时是否等待;为False时抛出QueueFullError
+
+        Returns:
+            该文本的向量
+        """
+        await self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        item = (text, future, time.perf_counter())
+
+        if wait:
+            await self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self.metrics.rejected += 1
+                raise QueueFullError("向量化队列已满")
+
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> np.ndarray:
+        """并发提交多条文本,结果按输入顺序返回"""
+        if not texts:
+            return np.zeros((0, self.embedder.dim), dtype=np.float32)
+        vectors = await asyncio.gather(*(self.embed(text) for text in texts))
+        return np.stack(vectors)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+
+                # 超时后取消等待中的get, 此时尚未取出的请求仍留在队列中
+                getter = asyncio.ensure_future(self._queue.get())
+                done, _ = await asyncio.wait({getter}, timeout=remaining)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                batch.append(getter.result())
+
+            await self._process(batch)
+
+    async def _process(self, batch: List[tuple]):
+        started = time.perf_counter()
+        for _, _, enqueued_at in batch:
+            self.metrics.observe_queue_latency(started - enqueued_at)
+        self.metrics.observe_batch(len(batch))
+
+        try:
+            # 底层服务可能是阻塞调用, 放到线程池中执行
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                None, self.embedder.embed, [text for text, _, _ in batch]
+            )
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future, _), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+
+class BatcherMetrics:
+    """批处理指标 - 批大小分布与排队延迟"""
+
+    def __init__(self):
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self.batch_size_histogram: Dict[int, int] = {}
+        self.queue_latency_total = 0.0
+        self.queue_latency_max = 0.0
+
+    def observe_batch(self, size: int):
+        self.batches += 1
+        self.items += size
+        self.batch_size_histogram[size] = self.batch_size_histogram.get(size, 0) + 1
+
+    def observe_queue_latency(self, seconds: float):
+        self.queue_latency_total += seconds
+        self.queue_latency_max = max(self.queue_latency_max, seconds)
+
+    def snapshot(self) -> Dict:
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'rejected': self.rejected,
+            'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+            'batch_size_histogram': dict(sorted(self.batch_size_histogram.items())),
+            'avg_queue_latency_ms': round(self.queue_latency_total / self.items * 1000, 3) if self.items else 0.0,
+            'max_queue_latency_ms': round(self.queue_latency_max * 1000, 3)
+        }
@@ -0,0 +1,201 @@
+"""
+实体抽取 - 基于Aho-Corasick自动机的多模式词典匹配,一次扫描找出全部实体及其所在句子
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from bisect import bisect_left, bisect_right
+from collections import deque
+import json
+import os
+import re
+
+# 额外的实体词典文件 (JSON, 格式为 {"类型": ["词条", ...]}), 与内置词典合并
+ENTITY_LEXICON_PATH = os.getenv("ENTITY_LEXICON_PATH")
+
+# 内置词典
+DEFAULT_LEXICON: Dict[str, List[str]] = {
+    'family_member': [
+        "妈妈", "爸爸", "爷爷", "奶奶", "外公", "外婆", "儿子", "女儿", "妻子", "丈夫",
+        "母亲", "父亲", "哥哥", "姐姐", "弟弟", "妹妹", "姥姥", "姥爷", "叔叔", "阿姨",
+        "舅舅", "舅妈", "姑姑", "姑父", "伯伯", "伯母", "婶婶", "姨妈", "姨父", "孙子",
+        "孙女", "外孙", "外孙女", "老伴", "老公", "老婆", "公公", "婆婆", "岳父", "岳母",
+        "表哥", "表姐", "表弟", "表妹", "堂哥", "堂姐", "堂弟", "堂妹"
+    ],
+    'place': [
+        "北京", "上海", "天津", "重庆", "广州", "深圳", "杭州", "南京", "苏州", "武汉",
+        "成都", "西安", "长沙", "郑州", "济南", "青岛", "沈阳", "哈尔滨", "昆明", "厦门",
+        "老家", "故乡", "村里", "县城"
+    ],
+    'school': [
+        "小学", "初中", "高中", "中学", "大学", "学院", "幼儿园", "北京大学", "清华大学",
+        "复旦大学", "浙江大学", "南京大学", "武汉大学"
+    ],
+    'employer': [
+        "工厂", "公司", "单位", "医院", "银行", "政府", "研究所", "供销社", "生产队"
+    ]
+}
+
+_SENTENCE_END = re.compile(r'[。！？!?；;\n]')
+
+
+class AhoCorasickAutomaton:
+    """
+    Aho-Corasick多模式匹配自动机
+
+    词条编译成带失败指针的字典树,匹配时对文本只扫描一遍,
+    时间复杂度为 O(文本长度 + 匹配数),与词条数量无关。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态结束的词条编号 (含沿失败指针可达的后缀词条)
+        self._output: List[List[int]] = [[]]
+
+        for pattern in patterns:
+            if pattern:
+                self._insert(pattern)
+        self._build_failure_links()
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, int, int]]:
+        """
+        查找全部匹配 (允许重叠)
+
+        Args:
+            text: 待匹配文本
+
+        Returns:
+            (起始位置, 结束位置, 词条编号) 的迭代器, 按结束位置排序
+        """
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern_id in self._output[state]:
+                end = position + 1
+                yield end - len(self.patterns[pattern_id]), end, pattern_id
+
+    def _insert(self, pattern: str):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        if not self._output[state]:
+            self._output[state].append(len(self.patterns))
+            self.patterns.append(pattern)
+
+    def _build_failure_links(self):
+        # 按广度优先顺序计算失败指针, 父状态的失败指针总是先于子状态确定
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+
+class EntityExtractor:
+    """
+    词典实体抽取器
+
+    启动时把各类型的词典编译成一个自动机;同一词条出现在多个类型中时以先出现的类型为准。
+    """
+
+    def __init__(self, lexicon: Optional[Dict[str, Sequence[str]]] = None, max_context: int = 100):
+        self.max_context = max_context
+        self._types: Dict[str, str] = {}
+        for entity_type, terms in (lexicon or DEFAULT_LEXICON).items():
+            for term in terms:
+                self._types.setdefault(term, entity_type)
+        self._automaton = AhoCorasickAutomaton(self._types)
+
+    @classmethod
+    def from_file(cls, path: str, max_context: int = 100) -> 'EntityExtractor':
+        """在内置词典的基础上合并JSON词典文件"""
+        with open(path, 'r', encoding='utf-8') as f:
+            extra = json.load(f)
+
+        lexicon = {entity_type: list(terms) for entity_type, terms in DEFAULT_LEXICON.items()}
+        for entity_type, terms in extra.items():
+            lexicon.setdefault(entity_type, []).extend(terms)
+        return cls(lexicon, max_context)
+
+    @property
+    def lexicon_size(self) -> int:
+        return len(self._automaton)
+
+    def extract(self, text: str, overlapping: bool = False) -> List[Dict]:
+        """
+        抽取文本中的实体
+
+        Args:
+            text: 文本
+            overlapping: 是否保留相互重叠的匹配; 默认从左到右取最长匹配,
+                         例如"北京大学"不会再报告其中的"北京"
+
+        Returns:
+            按出现位置排序的实体列表, 每项包含 type、name、start、end 和 context
+        """
+        matches = sorted(
+            self._automaton.iter_matches(text),
+            key=lambda match: (match[0], -(match[1] - match[0]))
+        )
+        if not overlapping:
+            matches = self._leftmost_longest(matches)
+
+        boundaries = [m.end() for m in _SENTENCE_END.finditer(text)]
+        entities = []
+        for start, end, pattern_id in matches:
+            name = self._automaton.patterns[pattern_id]
+            entities.append({
+                'type': self._types[name],
+                'name': name,
+                'start': start,
+                'end': end,
+                'context': self._context(text, boundaries, start, end)
+            })
+        return entities
+
+    def _leftmost_longest(self, matches: List[Tuple[int, int, int]]) -> List[Tuple[int, int, int]]:
+        selected = []
+        covered_until = 0
+        for match in matches:
+            if match[0] >= covered_until:
+                selected.append(match)
+                covered_until = match[1]
+        return selected
+
+    def _context(self, text: str, boundaries: List[int], start: int, end: int) -> str:
+        """匹配所在的句子; 句子过长时截取以匹配为中心的max_context个字符"""
+        index = bisect_right(boundaries, start)
+        sentence_start = boundaries[index - 1] if index else 0
+        index = bisect_left(boundaries, end)
+        sentence_end = boundaries[index] if index < len(boundaries) else len(text)
+
+        if sentence_end - sentence_start > self.max_context:
+            center = (start + end) // 2
+            sentence_start = max(sentence_start, center - self.max_context // 2)
+            sentence_end = min(sentence_end, sentence_start + self.max_context)
+        return text[sentence_start:sentence_end].strip()
+
+
+def load_default_extractor() -> EntityExtractor:
+    """按配置创建抽取器, 配置了词典文件时合并文件中的词条"""
+    if ENTITY_LEXICON_PATH:
+        return EntityExtractor.from_file(ENTITY_LEXICON_PATH)
+    return EntityExtractor()
@@ -0,0 +1,175 @@
+"""
+实体索引 - 按用户常驻内存的结构化记忆索引与实体共现关系图
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+import itertools
+import json
+import os
+import threading
+
+from database import StructuredMemory, EntityCooccurrence, SessionLocal
+
+# 最多常驻内存的用户实体索引数, 超过后淘汰最久未访问的用户
+ENTITY_INDEX_CACHE_SIZE = int(os.getenv("ENTITY_INDEX_CACHE_SIZE", "1000"))
+
+EntityKey = Tuple[str, str]
+
+
+def cooccurrence_pairs(keys: Sequence[EntityKey]) -> List[Tuple[EntityKey, EntityKey]]:
+    """
+    计算同一条消息中出现的实体两两组合
+
+    每对实体按 (类型, 名称) 排序后只保留一次,重复出现的实体只计一次
+
+    Args:
+        keys: 实体的 (类型, 名称) 列表
+
+    Returns:
+        有序的实体对列表
+    """
+    unique = sorted(set(keys))
+    return list(itertools.combinations(unique, 2))
+
+
+class EntityIndex:
+    """
+    单个用户的实体索引
+
+    - 属性表: (类型, 名称) -> 已解析的属性字典
+    - 关系图: (类型, 名称) -> {相邻实体: 共现次数}, 无向图, 两个方向各存一份
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self._attributes: Dict[EntityKey, Dict] = {}
+        self._by_type: Dict[str, Dict[str, Dict]] = {}
+        self._neighbours: Dict[EntityKey, Dict[EntityKey, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._attributes)
+
+    @classmethod
+    def load(cls, session, user_id: int) -> 'EntityIndex':
+        """从数据库加载一个用户的全部实体和共现关系"""
+        index = cls(user_id)
+        index.apply_memories(
+            session.query(StructuredMemory).filter(StructuredMemory.user_id == user_id).all()
+        )
+        for edge in session.query(EntityCooccurrence).filter(EntityCooccurrence.user_id == user_id):
+            index._link(
+                (edge.source_type, edge.source_name),
+                (edge.target_type, edge.target_name),
+                edge.weight
+            )
+        return index
+
+    def apply_memories(self, memories: Sequence[StructuredMemory]):
+        """用写入后的结构化记忆更新属性表"""
+        with self._lock:
+            for memory in memories:
+                attributes = json.loads(memory.attributes) if memory.attributes else {}
+                self._attributes[(memory.entity_type, memory.entity_name)] = attributes
+                self._by_type.setdefault(memory.entity_type, {})[memory.entity_name] = attributes
+
+    def add_cooccurrences(self, pairs: Sequence[Tuple[EntityKey, EntityKey]], weight: int = 1):
+        """累加实体对的共现次数"""
+        with self._lock:
+            for source, target in pairs:
+                self._link(source, target, weight)
+
+    def get(self, entity_type: str, entity_name: str) -> Optional[Dict]:
+        """
+        查询实体属性
+
+        Returns:
+            属性字典, 实体不存在时返回None
+        """
+        return self._attributes.get((entity_type, entity_name))
+
+    def entities(self) -> List[Tuple[str, str, Dict]]:
+        """全部实体, 按类型和名称排序"""
+        return [(key[0], key[1], attributes) for key, attributes in sorted(self._attributes.items())]
+
+    def entities_of_type(self, entity_type: str) -> Dict[str, Dict]:
+        """某一类型的全部实体: 名称 -> 属性"""
+        return dict(self._by_type.get(entity_type, {}))
+
+    def neighbours(
+        self,
+        entity_type: str,
+        entity_name: str,
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        查询与实体共同出现过的其他实体
+
+        Args:
+            entity_type: 实体类型
+            entity_name: 实体名称
+            limit: 最多返回的数量
+
+        Returns:
+            按共现次数降序排列的相邻实体
+        """
+        edges = self._neighbours.get((entity_type, entity_name), {})
+        ranked = sorted(edges.items(), key=lambda item: (-item[1], item[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [
+            {'type': key[0], 'name': key[1], 'weight': weight}
+            for key, weight in ranked
+        ]
+
+    def _link(self, source: EntityKey, target: EntityKey, weight: int):
+        for a, b in ((source, target), (target, source)):
+            edges = self._neighbours.setdefault(a, {})
+            edges[b] = edges.get(b, 0) + weight
+
+
+class EntityIndexRegistry:
+    """
+    按用户懒加载的实体索引
+
+    首次访问某个用户时从数据库加载,之后由写入路径增量同步;未加载的用户不占内存。
+    用户之间按LRU淘汰, 被淘汰的用户下次访问时重新加载。
+    """
+
+    def __init__(self, max_users: Optional[int] = None):
+        self.max_users = max_users or ENTITY_INDEX_CACHE_SIZE
+        self._indexes: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, user_id: int, session_factory=None) -> EntityIndex:
+        """获取用户的实体索引, 未加载时从数据库加载"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+
+            session = (session_factory or SessionLocal)()
+            try:
+                index = EntityIndex.load(session, user_id)
+            finally:
+                session.close()
+            self._indexes[user_id] = index
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+                self.evictions += 1
+            return index
+
+    def loaded(self, user_id: int) -> Optional[EntityIndex]:
+        """已加载时返回索引, 否则返回None (写入路径只需同步已加载的索引)"""
+        return self._indexes.get(user_id)
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """丢弃一个或全部用户的索引, 下次访问时重新加载"""
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(user_id, None)
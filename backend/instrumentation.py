@@ -0,0 +1,237 @@
+"""
+耗时埋点 - 对话每一轮各阶段的计时、延迟直方图与慢请求日志
+"""
+
+from typing import Dict, List, Optional, Sequence
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+# 一轮对话超过该耗时 (毫秒) 时记录慢请求日志
+SLOW_TURN_MS = float(os.getenv("SLOW_TURN_MS", "2000"))
+
+# 直方图的桶上界 (毫秒)
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+logger = logging.getLogger(__name__)
+
+_current_trace: ContextVar = ContextVar('turn_trace', default=None)
+# 当前所在的阶段, 子阶段结束时把耗时计入它, 用于计算父阶段的独占耗时
+_current_span: ContextVar = ContextVar('turn_span', default=None)
+
+
+class LatencyHistogram:
+    """
+    延迟直方图
+
+    累计各桶计数用于长期统计, 另保留最近window个样本用于计算p50/p95/p99
+    """
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS, window: int = 2048):
+        self.buckets_ms = tuple(buckets_ms)
+        self.bucket_counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, milliseconds: float):
+        index = next((i for i, bound in enumerate(self.buckets_ms) if milliseconds <= bound), len(self.buckets_ms))
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.total_ms += milliseconds
+        self.max_ms = max(self.max_ms, milliseconds)
+        self._recent.append(milliseconds)
+
+    def quantile(self, q: float) -> float:
+        """最近样本的分位数 (最近邻取值)"""
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict:
+        buckets = {f"le_{bound}": count for bound, count in zip(self.buckets_ms, self.bucket_counts)}
+        buckets['le_inf'] = self.bucket_counts[-1]
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.5), 3),
+            'p95_ms': round(self.quantile(0.95), 3),
+            'p99_ms': round(self.quantile(0.99), 3),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': buckets
+        }
+
+
+class TurnTrace:
+    """
+    一轮对话的计时记录: 阶段名 -> 累计耗时 (同名阶段多次出现时累加)
+
+    spans 是包含子阶段在内的耗时, self_spans 是扣除子阶段后的独占耗时
+    (如 retrieval 扣除其中的 embedding 和 vector_search)
+    """
+
+    def __init__(self, labels: Optional[Dict] = None):
+        self.labels = labels or {}
+        self.spans: Dict[str, float] = {}
+        self.self_spans: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, self_seconds: Optional[float] = None):
+        """累加一个阶段的耗时; self_seconds 为扣除子阶段后的耗时, 不传时与 seconds 相同"""
+        with self._lock:
+            self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+            self.self_spans[stage] = self.self_spans.get(stage, 0.0) + (
+                seconds if self_seconds is None else self_seconds
+            )
+
+    def breakdown_ms(self) -> Dict[str, float]:
+        return {stage: round(seconds * 1000, 3) for stage, seconds in self.spans.items()}
+
+    def self_breakdown_ms(self) -> Dict[str, float]:
+        return {stage: round(seconds * 1000, 3) for stage, seconds in self.self_spans.items()}
+
+
+class _SpanFrame:
+    """进行中的阶段, 记录其子阶段的累计耗时"""
+
+    __slots__ = ('children',)
+
+    def __init__(self):
+        self.children = 0.0
+
+
+@contextmanager
+def span(stage: str):
+    """
+    为当前一轮对话记录一个阶段的耗时
+
+    没有进行中的计时记录时 (如离线脚本直接调用) 不做任何事
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    parent = _current_span.get()
+    frame = _SpanFrame()
+    token = _current_span.set(frame)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_span.reset(token)
+        # 并发执行的子阶段之和可能超过父阶段的耗时
+        trace.add(stage, elapsed, max(elapsed - frame.children, 0.0))
+        if parent is not None:
+            with trace._lock:
+                parent.children += elapsed
+
+
+@contextmanager
+def activate(trace: Optional[TurnTrace]):
+    """在当前上下文中设置计时记录, 供内部调用的 span() 使用"""
+    token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(token)
+
+
+def run_in_executor(loop, func, *args):
+    """在线程池中执行, 并把当前的计时记录带入工作线程"""
+    return loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args))
+
+
+class TurnInstrumentation:
+    """
+    对话耗时统计
+
+    每个阶段和整轮各有一个延迟直方图; 超过slow_turn_ms的轮次连同阶段明细写入日志,
+    并保留最近的若干条供程序读取。
+    各阶段另有一个独占耗时的直方图, 用于找出真正耗时的阶段 (父阶段不因包含子阶段而排在前面)。
+    """
+
+    def __init__(self, slow_turn_ms: Optional[float] = None, max_slow_turns: int = 100):
+        self.slow_turn_ms = SLOW_TURN_MS if slow_turn_ms is None else slow_turn_ms
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.self_histograms: Dict[str, LatencyHistogram] = {}
+        self._slow_turns = deque(maxlen=max_slow_turns)
+        self._lock = threading.Lock()
+
+    def start(self, **labels) -> TurnTrace:
+        return TurnTrace(labels)
+
+    @contextmanager
+    def turn(self, **labels):
+        """同步代码中计时一整轮对话"""
+        trace = self.start(**labels)
+        with activate(trace):
+            yield trace
+        self.record(trace)
+
+    def record(self, trace: TurnTrace):
+        """记录一轮对话的各阶段耗时"""
+        trace.duration = time.perf_counter() - trace.started
+        total_ms = trace.duration * 1000
+        breakdown = trace.breakdown_ms()
+        self_breakdown = trace.self_breakdown_ms()
+
+        with self._lock:
+            for stage, milliseconds in breakdown.items():
+                self._histogram(stage).observe(milliseconds)
+            for stage, milliseconds in self_breakdown.items():
+                self._histogram(stage, self.self_histograms).observe(milliseconds)
+            self._histogram('turn').observe(total_ms)
+
+            if total_ms >= self.slow_turn_ms:
+                entry = {
+                    'total_ms': round(total_ms, 3),
+                    'stages': breakdown,
+                    'self_stages': self_breakdown,
+                    'labels': trace.labels,
+                    'at': time.time()
+                }
+                self._slow_turns.append(entry)
+                logger.warning("慢对话 %.1fms, 阶段耗时: %s, %s", total_ms, breakdown, trace.labels)
+
+    def snapshot(self) -> Dict:
+        """各阶段的延迟统计"""
+        with self._lock:
+            return {stage: histogram.snapshot() for stage, histogram in self.histograms.items()}
+
+    def slow_turns(self) -> List[Dict]:
+        """最近的慢对话记录"""
+        with self._lock:
+            return list(self._slow_turns)
+
+    def dominant_stage(self, quantile: float = 0.99) -> Optional[str]:
+        """在给定分位数上独占耗时最长的阶段 (不含整轮, 父阶段扣除子阶段的耗时)"""
+        with self._lock:
+            stages = {stage: histogram.quantile(quantile) for stage, histogram in self.self_histograms.items()}
+        return max(stages, key=stages.get) if stages else None
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.self_histograms.clear()
+            self._slow_turns.clear()
+
+    def _histogram(self, stage: str, histograms: Optional[Dict[str, LatencyHistogram]] = None) -> LatencyHistogram:
+        histograms = self.histograms if histograms is None else histograms
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = LatencyHistogram()
+        return histogram
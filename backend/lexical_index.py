@@ -0,0 +1,182 @@
+"""
+词法检索 - 基于中文字符n-gram的倒排索引与BM25打分,以及多路结果的倒数排名融合
+"""
+
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+from array import array
+import math
+import re
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fa5]+|[a-zA-Z0-9]+')
+
+
+def tokenize(text: str, ngram_sizes: Sequence[int] = (2, 3)) -> List[str]:
+    """
+    切分检索词项
+
+    中文连续片段切为字符n-gram(长度不足时保留整段),英文和数字按单词切分并转小写
+
+    Args:
+        text: 原文
+        ngram_sizes: 中文n-gram的长度
+
+    Returns:
+        词项列表(可重复,用于统计词频)
+    """
+    terms = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token.isascii():
+            terms.append(token)
+            continue
+        if len(token) < min(ngram_sizes):
+            terms.append(token)
+            continue
+        for n in ngram_sizes:
+            terms.extend(token[i:i + n] for i in range(len(token) - n + 1))
+    return terms
+
+
+class NgramInvertedIndex:
+    """
+    n-gram倒排索引
+
+    每个词项的倒排表由两个紧凑的整型数组组成(行号、词频),写入时增量追加,
+    查询时零拷贝转换为NumPy数组后用BM25累加打分。
+    """
+
+    def __init__(self, ngram_sizes: Sequence[int] = (2, 3), k1: float = 1.2, b: float = 0.75):
+        self.ngram_sizes = tuple(ngram_sizes)
+        self.k1 = k1
+        self.b = b
+
+        self._term_ids: Dict[str, int] = {}
+        self._posting_rows: List[array] = []
+        self._posting_freqs: List[array] = []
+
+        self._doc_lengths = array('i')
+        self._total_length = 0
+        self._doc_count = 0
+
+    def __len__(self) -> int:
+        return self._doc_count
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self._term_ids)
+
+    def clear(self):
+        """清空索引 (存储压缩后重新写入)"""
+        self._term_ids = {}
+        self._posting_rows = []
+        self._posting_freqs = []
+        self._doc_lengths = array('i')
+        self._total_length = 0
+        self._doc_count = 0
+
+    def add(self, row: int, text: str):
+        """
+        写入一篇文档
+
+        Args:
+            row: 文档行号 (与向量存储的行号一致)
+            text: 文档原文
+        """
+        terms = tokenize(text, self.ngram_sizes)
+
+        if row >= len(self._doc_lengths):
+            self._doc_lengths.extend([0] * (row + 1 - len(self._doc_lengths)))
+        self._doc_lengths[row] = len(terms)
+        self._total_length += len(terms)
+        self._doc_count += 1
+
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+
+        for term, frequency in frequencies.items():
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                term_id = self._term_ids[term] = len(self._posting_rows)
+                self._posting_rows.append(array('i'))
+                self._posting_freqs.append(array('i'))
+            self._posting_rows[term_id].append(row)
+            self._posting_freqs[term_id].append(frequency)
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25检索
+
+        Args:
+            query: 查询文本
+            k: 返回数量
+            rows: 可选的候选行号,只对这些行打分
+
+        Returns:
+            (行号数组, 分数数组),按分数降序,不含零分文档
+        """
+        if self._doc_count == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.int32)
+        avg_length = self._total_length / self._doc_count or 1.0
+        scores = np.zeros(len(doc_lengths), dtype=np.float32)
+
+        for term in set(tokenize(query, self.ngram_sizes)):
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                continue
+
+            posting_rows = np.frombuffer(self._posting_rows[term_id], dtype=np.int32)
+            freqs = np.frombuffer(self._posting_freqs[term_id], dtype=np.int32).astype(np.float32)
+
+            df = len(posting_rows)
+            idf = math.log(1 + (self._doc_count - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[posting_rows] / avg_length)
+            scores[posting_rows] += idf * freqs * (self.k1 + 1) / (freqs + norm)
+
+        if rows is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            mask[rows] = True
+            scores[~mask] = 0
+
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        order = np.argsort(-scores[matched], kind='stable')
+        return matched[order].astype(np.int64), scores[matched[order]]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Hashable]],
+    k: int = 60,
+    weights: Optional[Sequence[float]] = None
+) -> List[Tuple[Hashable, float]]:
+    """
+    倒数排名融合 (RRF)
+
+    每个条目的得分为各路排名中 weight / (k + 名次) 之和,不依赖各路分数的量纲
+
+    Args:
+        rankings: 多路按相关度降序排列的结果
+        k: 平滑常数
+        weights: 各路权重,默认均为1
+
+    Returns:
+        按融合得分降序排列的 (条目, 得分) 列表
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[Hashable, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + weight / (k + rank)
+
+    return sorted(fused.items(), key=lambda pair: pair[1], reverse=True)
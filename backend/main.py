@@ -1,9 +1,26 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from typing import Optional
+import asyncio
+import contextlib
 import os
+import time
+
+import ai_core
+from ai_core import AsyncDialogueManager, DialogueManager, generation_metrics, turn_metrics
+import database
+from conversation_context import ConversationAccessError
+from database import pool_stats
+from background_jobs import run_periodically
+from memory_consolidation import CONSOLIDATION_INTERVAL, ConsolidationJob
+from message_partitions import MESSAGE_PARTITION_CHECK_INTERVAL, ensure_message_partitions
+from daily_stats import DAILY_STATS_CATCH_UP_INTERVAL, catch_up
 
 app = FastAPI(title="记忆回响 API", description="人生回忆录AI助手后端服务")
 
+# 每个WebSocket连接缓冲的词元数, 客户端读取变慢时生成随之暂停
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "16"))
+
 # 添加CORS中间件
 app.add_middleware(
     CORSMiddleware,
@@ -13,6 +30,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_background_jobs():
+    # 配置了整理间隔时在后台定期合并重复记忆、汇总久远记忆并压缩存储
+    if CONSOLIDATION_INTERVAL > 0:
+        job = ConsolidationJob(ai_core.collection, ai_core.embedder.embed)
+        app.state.consolidation_task = asyncio.create_task(
+            run_periodically(job.run, CONSOLIDATION_INTERVAL, "记忆整理")
+        )
+    # PostgreSQL上的消息分区表需要提前建好未来月份的分区
+    if MESSAGE_PARTITION_CHECK_INTERVAL > 0 and database.engine.dialect.name == "postgresql":
+        app.state.partition_task = asyncio.create_task(
+            run_periodically(ensure_message_partitions, MESSAGE_PARTITION_CHECK_INTERVAL, "补建消息分区")
+        )
+    # 按天统计汇总的追赶任务, 关闭了写入时更新或有外部导入的数据时使用
+    if DAILY_STATS_CATCH_UP_INTERVAL > 0:
+        app.state.daily_stats_task = asyncio.create_task(
+            run_periodically(catch_up, DAILY_STATS_CATCH_UP_INTERVAL, "重算按天统计汇总")
+        )
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    # 写完队列中尚未向量化的记忆再退出
+    await ai_core.embedding_batcher.stop()
+
 @app.get("/")
 async def root():
     return {"message": "欢迎使用记忆回响API"}
@@ -21,6 +62,115 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics/generation")
+async def get_generation_metrics():
+    return generation_metrics.snapshot()
+
+@app.get("/metrics/latency")
+async def get_latency_metrics():
+    """每轮对话各阶段的延迟分布 (p50/p95/p99) 和最近的慢对话"""
+    return {
+        'stages': turn_metrics.snapshot(),
+        'p99_dominant_stage': turn_metrics.dominant_stage(0.99),
+        'slow_turns': turn_metrics.slow_turns()
+    }
+
+@app.get("/metrics/db-pool")
+async def get_db_pool_metrics():
+    """数据库连接池的实时状态: 常驻/借出/溢出连接数和取连接的等待时间"""
+    return pool_stats()
+
+@app.websocket("/ws/dialogue/{user_id}")
+async def dialogue_stream(websocket: WebSocket, user_id: int):
+    """
+    流式对话
+    
+    客户端发送 {"message": "...", "history": [...]} 或 {"message": "...", "conversation_id": 1},
+    后者使用服务端缓存的会话上下文并保存本轮消息;
+    服务端依次推送 {"type": "token", "content": "..."} 和一条 {"type": "done", ...}
+    """
+    await websocket.accept()
+    manager = AsyncDialogueManager(user_id)
+    
+    try:
+        while True:
+            request = await websocket.receive_json()
+            message = (request.get("message") or "").strip()
+            if not message:
+                await websocket.send_json({"type": "error", "detail": "消息内容不能为空"})
+                continue
+            
+            try:
+                await _stream_reply(
+                    websocket, manager, message, request.get("history"), request.get("conversation_id")
+                )
+            except WebSocketDisconnect:
+                raise
+            except ConversationAccessError as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+            except Exception as e:
+                await websocket.send_json({"type": "error", "detail": f"生成回复失败: {str(e)}"})
+    except WebSocketDisconnect:
+        pass
+
+async def _stream_reply(
+    websocket: WebSocket,
+    manager: DialogueManager,
+    message: str,
+    history: Optional[list],
+    conversation_id: Optional[int] = None
+):
+    """生成任务与发送循环通过有界队列连接, 队列满时生成任务等待 (背压)"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    done = object()
+    started = time.perf_counter()
+    
+    async def produce():
+        stream = manager.stream_response(message, history, conversation_id)
+        cancelled = False
+        try:
+            async for token in stream:
+                await queue.put(token)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            await stream.aclose()
+            # 被取消时客户端已断开, 没有人再读取队列, 不能等待放入结束标记
+            if not cancelled:
+                await queue.put(done)
+    
+    producer = asyncio.create_task(produce())
+    first_token_at = None
+    tokens = 0
+    try:
+        while True:
+            token = await queue.get()
+            if token is done:
+                break
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            tokens += 1
+            await websocket.send_json({"type": "token", "content": token})
+        
+        # 生成过程中的异常在这里抛出
+        await producer
+    finally:
+        # 客户端断开时停止生成, 并等待生成任务退出
+        if not producer.done():
+            producer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await producer
+    
+    finished = time.perf_counter()
+    elapsed = finished - started
+    await websocket.send_json({
+        "type": "done",
+        "tokens": tokens,
+        "ttft_ms": round(((first_token_at or finished) - started) * 1000, 3),
+        "tokens_per_second": round(tokens / elapsed, 2) if elapsed else 0.0
+    })
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
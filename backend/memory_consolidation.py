@@ -0,0 +1,324 @@
+"""
+记忆整理 - 后台合并近似重复的向量记忆,把久远的低重要度记忆汇总为摘要,并压缩存储
+"""
+
+from typing import Callable, Dict, List, Optional
+from datetime import datetime, timedelta
+import json
+import os
+import time
+import numpy as np
+
+from vector_store import to_datetime
+
+# 余弦相似度不低于该值的两条记忆视为重复
+CONSOLIDATION_DUPLICATE_THRESHOLD = float(os.getenv("CONSOLIDATION_DUPLICATE_THRESHOLD", "0.92"))
+# 超过该天数且重要度低于阈值的记忆按月汇总为摘要
+CONSOLIDATION_SUMMARY_AGE_DAYS = int(os.getenv("CONSOLIDATION_SUMMARY_AGE_DAYS", "180"))
+CONSOLIDATION_IMPORTANCE_THRESHOLD = float(os.getenv("CONSOLIDATION_IMPORTANCE_THRESHOLD", "0.3"))
+# 每秒最多整理的用户数, 避免与在线请求争抢资源
+CONSOLIDATION_USERS_PER_SECOND = float(os.getenv("CONSOLIDATION_USERS_PER_SECOND", "2"))
+# 断点文件, 中断后从未完成的用户继续
+CONSOLIDATION_CHECKPOINT_PATH = os.getenv("CONSOLIDATION_CHECKPOINT_PATH")
+# 后台整理的间隔 (秒), 为0时不启动
+CONSOLIDATION_INTERVAL = float(os.getenv("CONSOLIDATION_INTERVAL", "0"))
+
+SUMMARY_TYPE = 'summary'
+
+
+def memory_importance(document: str, metadata: Dict) -> float:
+    """
+    估算记忆的重要度 (0~1)
+
+    元数据中有importance时直接使用; 否则按内容长度和被重复提及的次数估算
+
+    Args:
+        document: 记忆原文
+        metadata: 记忆元数据
+
+    Returns:
+        重要度
+    """
+    if 'importance' in metadata:
+        return float(metadata['importance'])
+    length_score = min(len(document) / 200, 1.0)
+    mention_score = 0.2 * (metadata.get('mention_count', 1) - 1)
+    return min(length_score + mention_score, 1.0)
+
+
+def find_duplicate_groups(store, threshold: float, neighbours: int = 5, batch_size: int = 256) -> List[List[int]]:
+    """
+    查找近似重复的记忆
+
+    每条记忆用存储自身的检索路径 (挂载了ANN索引时为近似检索) 查找最相似的若干条。
+    按 canonical_priority 从高到低, 每条尚未分组的记忆只吸收与它自身相似度超过阈值的近邻,
+    不做传递合并: A与B、B与C相似时, 与A不相似的C不会并入A的组。
+
+    Args:
+        store: VectorStore
+        threshold: 余弦相似度阈值
+        neighbours: 每条记忆检查的近邻数
+        batch_size: 每批查询的记忆数
+
+    Returns:
+        重复组列表, 每组为两个以上的行号, 组内优先级最高的一条 (保留的原文) 与其余每条都超过阈值
+    """
+    rows = store.live_rows()
+    similar: Dict[int, set] = {int(row): set() for row in rows}
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        top_rows, top_scores = store.search(store.vectors[batch], neighbours + 1)
+        for row, candidates, scores in zip(batch, top_rows, top_scores):
+            for other, score in zip(candidates, scores):
+                if other < 0 or other == row or score < threshold:
+                    continue
+                similar[int(row)].add(int(other))
+                similar[int(other)].add(int(row))
+
+    grouped = set()
+    groups = []
+    for row in sorted(similar, key=lambda row: canonical_priority(store, row), reverse=True):
+        if row in grouped:
+            continue
+        group = [row] + [other for other in similar[row] if other not in grouped]
+        if len(group) > 1:
+            grouped.update(group)
+            groups.append(sorted(group))
+    return sorted(groups)
+
+
+def canonical_priority(store, row: int) -> tuple:
+    """重复组中保留哪条原文: 信息最多 (最长) 的优先, 同样长时保留较早写入的"""
+    return len(store.documents[row]), -row
+
+
+def archived_entry(store, row: int) -> Dict:
+    """被合并或汇总的记忆的存档: 原文不丢弃, 随保留的记忆一起存放在元数据中"""
+    return {
+        'id': store.ids[row],
+        'document': store.documents[row],
+        'timestamp': store.metadatas[row].get('timestamp')
+    }
+
+
+class RateLimiter:
+    """按固定速率放行的限流器"""
+
+    def __init__(self, rate_per_second: float, sleep: Callable[[float], None] = time.sleep):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self.sleep = sleep
+        self._next_allowed = 0.0
+
+    def acquire(self):
+        now = time.monotonic()
+        if now < self._next_allowed:
+            self.sleep(self._next_allowed - now)
+            now = self._next_allowed
+        self._next_allowed = now + self.interval
+
+
+class ConsolidationJob:
+    """
+    记忆整理任务
+
+    逐个用户执行: 合并重复记忆 -> 汇总久远的低重要度记忆 -> 压缩分区。
+    被合并和汇总的记忆原文存入新记录元数据的 archived_documents, 不会丢失。
+    新记录总是先写入、旧记录再删除, 中途中断只会留下可在下次整理时再次合并的重复;
+    每完成一个用户写一次断点, 重新运行时跳过已完成的用户。
+    """
+
+    def __init__(
+        self,
+        collection,
+        embed: Callable[[List[str]], np.ndarray],
+        duplicate_threshold: float = CONSOLIDATION_DUPLICATE_THRESHOLD,
+        summary_age_days: int = CONSOLIDATION_SUMMARY_AGE_DAYS,
+        importance_threshold: float = CONSOLIDATION_IMPORTANCE_THRESHOLD,
+        users_per_second: float = CONSOLIDATION_USERS_PER_SECOND,
+        checkpoint_path: Optional[str] = CONSOLIDATION_CHECKPOINT_PATH,
+        min_summary_size: int = 2,
+        max_summary_chars: int = 500,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        self.collection = collection
+        self.embed = embed
+        self.duplicate_threshold = duplicate_threshold
+        self.summary_age = timedelta(days=summary_age_days)
+        self.importance_threshold = importance_threshold
+        self.rate_limiter = RateLimiter(users_per_second, sleep)
+        self.checkpoint_path = checkpoint_path
+        self.min_summary_size = min_summary_size
+        self.max_summary_chars = max_summary_chars
+
+    def run(self, max_users: Optional[int] = None, now: Optional[datetime] = None) -> Dict:
+        """
+        执行一轮整理
+
+        Args:
+            max_users: 本次最多整理的用户数, 用完后保留断点, 下次继续
+            now: 当前时间 (UTC), 用于判断记忆是否久远
+
+        Returns:
+            整理报告
+        """
+        now = now or datetime.utcnow()
+        completed = self._load_checkpoint()
+        pending = [user_id for user_id in self._user_order() if str(user_id) not in completed]
+
+        report = {
+            'users_processed': 0,
+            'users_skipped': len(completed),
+            'duplicates_merged': 0,
+            'memories_summarized': 0,
+            'summaries_created': 0,
+            'bytes_reclaimed': 0,
+            'finished': False
+        }
+        for user_id in pending[:max_users] if max_users is not None else pending:
+            self.rate_limiter.acquire()
+            user_report = self.consolidate_user(user_id, now)
+            for key in ('duplicates_merged', 'memories_summarized', 'summaries_created', 'bytes_reclaimed'):
+                report[key] += user_report[key]
+            report['users_processed'] += 1
+
+            completed.add(str(user_id))
+            self._save_checkpoint(completed)
+
+        report['finished'] = report['users_processed'] == len(pending)
+        if report['finished']:
+            self._clear_checkpoint()
+        return report
+
+    def consolidate_user(self, user_id: Optional[int], now: Optional[datetime] = None) -> Dict:
+        """
+        整理单个用户的记忆
+
+        Returns:
+            合并、汇总的数量和回收的字节数
+        """
+        now = now or datetime.utcnow()
+        store = self.collection.partition(user_id)
+        if store is None:
+            return {'duplicates_merged': 0, 'memories_summarized': 0, 'summaries_created': 0, 'bytes_reclaimed': 0}
+
+        # 查找重复到替换完成期间持有分区锁, 行号不会被其他线程的刷新或压缩改变
+        with store.lock:
+            duplicates_merged = self._merge_duplicates(user_id, store)
+        memories_summarized, summaries_created = self._summarize_old(user_id, store, now)
+        compaction = self.collection.compact(user_id)
+
+        return {
+            'duplicates_merged': duplicates_merged,
+            'memories_summarized': memories_summarized,
+            'summaries_created': summaries_created,
+            'bytes_reclaimed': compaction['bytes_reclaimed']
+        }
+
+    def _merge_duplicates(self, user_id: Optional[int], store) -> int:
+        """
+        每组重复记忆合并为一条: 保留信息最多 (最长) 的原文, 累计提及次数,
+        其余记忆的原文存入 archived_documents
+        """
+        merged = 0
+        for group in find_duplicate_groups(store, self.duplicate_threshold):
+            canonical = max(group, key=lambda row: canonical_priority(store, row))
+            times = sorted(
+                t for t in (to_datetime(store.metadatas[row].get('timestamp')) for row in group) if t is not None
+            )
+            merged_from = []
+            archived = []
+            for row in group:
+                merged_from.append(store.ids[row])
+                merged_from.extend(store.metadatas[row].get('merged_from', []))
+                archived.extend(store.metadatas[row].get('archived_documents', []))
+                if row != canonical:
+                    archived.append(archived_entry(store, row))
+
+            metadata = dict(store.metadatas[canonical])
+            metadata['user_id'] = user_id
+            metadata['merged_from'] = merged_from
+            metadata['archived_documents'] = archived
+            metadata['mention_count'] = sum(store.metadatas[row].get('mention_count', 1) for row in group)
+            if times:
+                metadata['timestamp'] = times[0].isoformat()
+                metadata['last_mentioned'] = times[-1].isoformat()
+
+            old_ids = [store.ids[row] for row in group]
+            self._replace(user_id, old_ids, store.documents[canonical], np.array(store.vectors[canonical]), metadata)
+            merged += len(group) - 1
+        return merged
+
+    def _summarize_old(self, user_id: Optional[int], store, now: datetime):
+        """
+        把久远的低重要度记忆按月汇总为一条摘要
+
+        摘要原文超过 max_summary_chars 时截断, 被汇总的记忆原文完整存入 archived_documents
+        """
+        # 在分区锁内取出记录, 向量化摘要时不持有锁; 每月为 (被汇总的记录, 存档)
+        months: Dict[str, tuple] = {}
+        with store.lock:
+            for row in store.rows_in_time_range(end=now - self.summary_age):
+                metadata = store.metadatas[row]
+                if metadata.get('type') == SUMMARY_TYPE:
+                    continue
+                if memory_importance(store.documents[row], metadata) >= self.importance_threshold:
+                    continue
+                month = to_datetime(metadata['timestamp']).strftime('%Y-%m')
+                records, archived = months.setdefault(month, ([], []))
+                records.append(archived_entry(store, row))
+                # 此前合并进来的原文一并转存
+                archived.append(records[-1])
+                archived.extend(metadata.get('archived_documents', []))
+
+        summarized = created = 0
+        for month, (records, archived) in sorted(months.items()):
+            if len(records) < self.min_summary_size:
+                continue
+            year, month_number = month.split('-')
+            document = f"{year}年{int(month_number)}月的零散回忆：" + "；".join(
+                record['document'] for record in records
+            )
+            if len(document) > self.max_summary_chars:
+                document = document[:self.max_summary_chars - 1] + '…'
+
+            old_ids = [record['id'] for record in records]
+            metadata = {
+                'user_id': user_id,
+                'type': SUMMARY_TYPE,
+                'timestamp': records[0]['timestamp'],
+                'summarized_from': old_ids,
+                'archived_documents': archived,
+                'importance': 0.5
+            }
+            vector = np.asarray(self.embed([document]), dtype=np.float32)[0]
+            self._replace(user_id, old_ids, document, vector, metadata)
+            summarized += len(records)
+            created += 1
+        return summarized, created
+
+    def _replace(self, user_id: Optional[int], old_ids: List[str], document: str, vector: np.ndarray, metadata: Dict):
+        """先写入新记录再删除旧记录"""
+        self.collection.add_memories(user_id, [document], [vector], [metadata])
+        self.collection.delete(user_id, old_ids)
+
+    def _user_order(self) -> List[Optional[int]]:
+        return sorted(self.collection.user_ids(), key=lambda user_id: (user_id is None, user_id or 0))
+
+    def _load_checkpoint(self) -> set:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            return set(json.load(f).get('completed_users', []))
+
+    def _save_checkpoint(self, completed: set):
+        if not self.checkpoint_path:
+            return
+        # 先写临时文件再替换, 中断时不会留下损坏的断点
+        with open(self.checkpoint_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'completed_users': sorted(completed), 'updated_at': datetime.utcnow().isoformat()}, f)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def _clear_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
@@ -0,0 +1,193 @@
+"""
+消息表按月分区 - PostgreSQL上把messages改为按timestamp的声明式范围分区, 提前创建未来月份的分区,
+并可把久远月份的分区分离出来归档。其他数据库 (如测试用的SQLite) 保持普通表, 这里的函数不做任何事。
+
+回顾只读取一个月或一年的消息, 分区后的时间段查询只会扫描1~12个分区。
+"""
+
+from typing import List, Optional
+from datetime import datetime
+import logging
+import os
+import re
+
+from sqlalchemy import text
+
+from database import engine
+
+# 提前创建的未来月份分区数
+MESSAGE_PARTITION_MONTHS_AHEAD = int(os.getenv("MESSAGE_PARTITION_MONTHS_AHEAD", "3"))
+# 检查并补建分区的间隔 (秒), 为0时不启动
+MESSAGE_PARTITION_CHECK_INTERVAL = float(os.getenv("MESSAGE_PARTITION_CHECK_INTERVAL", "86400"))
+
+PARENT_TABLE = "messages"
+DEFAULT_PARTITION = "messages_default"
+_PARTITION_NAME = re.compile(r"^messages_p(\d{4})_(\d{2})$")
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def month_range(first: datetime, last: datetime) -> List[datetime]:
+    """从first所在月到last所在月 (含) 的每个月的第一天"""
+    months, month = [], month_start(first)
+    while month <= month_start(last):
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT_TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[datetime]:
+    """由分区名解析月份, 不是按月分区 (如默认分区) 时返回None"""
+    match = _PARTITION_NAME.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def create_partition_sql(month: datetime) -> str:
+    """创建一个月份分区的DDL, 范围为 [当月1日, 下月1日)"""
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT_TABLE} "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    )
+
+
+def partitioning_sql(months: List[datetime]) -> List[str]:
+    """
+    把普通messages表转换为分区表的语句
+
+    旧表改名后按原结构建分区父表 (主键需包含分区键, 改为(id, timestamp)),
+    建好覆盖已有数据的月份分区和默认分区后整体复制数据, 最后删除旧表。
+    id序列在删除旧表前转为归新表所有。
+    """
+    statements = [
+        f"ALTER TABLE {PARENT_TABLE} RENAME TO {PARENT_TABLE}_unpartitioned",
+        f"UPDATE {PARENT_TABLE}_unpartitioned SET \"timestamp\" = now() WHERE \"timestamp\" IS NULL",
+        f"CREATE TABLE {PARENT_TABLE} (LIKE {PARENT_TABLE}_unpartitioned INCLUDING DEFAULTS) "
+        f"PARTITION BY RANGE (\"timestamp\")",
+        f"ALTER TABLE {PARENT_TABLE} ALTER COLUMN \"timestamp\" SET NOT NULL",
+        f"ALTER TABLE {PARENT_TABLE} ADD PRIMARY KEY (id, \"timestamp\")",
+        f"ALTER TABLE {PARENT_TABLE} ADD FOREIGN KEY (conversation_id) REFERENCES conversations (id)",
+        f"ALTER TABLE {PARENT_TABLE} ADD FOREIGN KEY (user_id) REFERENCES users (id)",
+        f"ALTER SEQUENCE {PARENT_TABLE}_id_seq OWNED BY {PARENT_TABLE}.id",
+    ]
+    statements.extend(create_partition_sql(month) for month in months)
+    statements.extend([
+        # 分区范围之外的消息 (如时钟异常) 落入默认分区, 不会写入失败
+        f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT",
+        f"INSERT INTO {PARENT_TABLE} SELECT * FROM {PARENT_TABLE}_unpartitioned",
+        f"DROP TABLE {PARENT_TABLE}_unpartitioned",
+        # 索引名随旧表保留到删除为止, 之后在父表上重建, 会自动建到每个分区
+        f"CREATE INDEX ix_messages_conversation_timestamp ON {PARENT_TABLE} (conversation_id, \"timestamp\")",
+        f"CREATE INDEX ix_messages_user_timestamp ON {PARENT_TABLE} (user_id, \"timestamp\")",
+    ])
+    return statements
+
+
+def is_partitioned(connection) -> bool:
+    """messages是否已是PostgreSQL分区表"""
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :table"
+    ), {"table": PARENT_TABLE}).first() is not None
+
+
+def existing_partitions(connection) -> List[str]:
+    """当前挂在messages下的分区名"""
+    return [row[0] for row in connection.execute(text(
+        "SELECT child.relname FROM pg_inherits i "
+        "JOIN pg_class child ON child.oid = i.inhrelid "
+        "JOIN pg_class parent ON parent.oid = i.inhparent "
+        "WHERE parent.relname = :table ORDER BY child.relname"
+    ), {"table": PARENT_TABLE})]
+
+
+def partition_messages(connection, months_ahead: int = MESSAGE_PARTITION_MONTHS_AHEAD, now: Optional[datetime] = None):
+    """
+    把messages转换为按月分区表 (仅PostgreSQL, 已是分区表时跳过)
+
+    在一个事务中完成, 复制期间会锁住旧表, 数据量大时应在低峰期执行。
+
+    Args:
+        connection: 数据库连接 (处于事务中)
+        months_ahead: 额外创建的未来月份分区数
+        now: 当前时间, 用于决定创建到哪个月
+    """
+    if connection.dialect.name != "postgresql" or is_partitioned(connection):
+        return
+
+    now = now or datetime.utcnow()
+    earliest = connection.execute(text(f"SELECT min(\"timestamp\") FROM {PARENT_TABLE}")).scalar() or now
+    months = month_range(min(earliest, now), add_months(month_start(now), months_ahead))
+    for statement in partitioning_sql(months):
+        connection.execute(text(statement))
+    logger.info("messages已转换为按月分区表, 共%s个月份分区", len(months))
+
+
+def ensure_message_partitions(
+    bind=None,
+    months_ahead: int = MESSAGE_PARTITION_MONTHS_AHEAD,
+    now: Optional[datetime] = None
+) -> List[str]:
+    """
+    补建从当月到未来months_ahead个月的分区
+
+    Returns:
+        本次新建的分区名
+    """
+    bind = bind or engine
+    if bind.dialect.name != "postgresql":
+        return []
+    now = now or datetime.utcnow()
+    with bind.begin() as connection:
+        if not is_partitioned(connection):
+            return []
+        existing = set(existing_partitions(connection))
+        created = []
+        for month in month_range(now, add_months(month_start(now), months_ahead)):
+            if partition_name(month) not in existing:
+                connection.execute(text(create_partition_sql(month)))
+                created.append(partition_name(month))
+    if created:
+        logger.info("已创建消息分区: %s", created)
+    return created
+
+
+def detach_message_partitions(before: datetime, bind=None) -> List[str]:
+    """
+    分离整月早于before的分区, 分离后的表保留原名, 可导出归档后再删除
+
+    Args:
+        before: 分区的结束时间不晚于该时间时分离
+
+    Returns:
+        分离的分区名
+    """
+    bind = bind or engine
+    if bind.dialect.name != "postgresql":
+        return []
+    with bind.begin() as connection:
+        if not is_partitioned(connection):
+            return []
+        detached = []
+        for name in existing_partitions(connection):
+            month = partition_month(name)
+            if month is not None and add_months(month, 1) <= before:
+                connection.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+                detached.append(name)
+    if detached:
+        logger.info("已分离消息分区: %s", detached)
+    return detached
@@ -0,0 +1,198 @@
+"""
+数据库迁移 - 按版本号顺序把结构变更应用到已有数据库, 已应用的版本记录在schema_version表中
+
+新建的数据库由 create_all 直接得到最新结构, 迁移步骤需要可重复执行 (建索引前检查是否已存在等),
+这样在新库上运行迁移只会补写版本记录。
+
+用法:
+    python migrations.py            # 升级到最新版本
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+import json
+import logging
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+
+from database import Base, Conversation, DailyUserStats, Message, Review, StructuredMemory, engine
+from daily_stats import rebuild_daily_stats
+from message_partitions import partition_messages
+
+logger = logging.getLogger(__name__)
+
+# 版本表不属于业务模型, 单独放在一个MetaData中
+schema_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    schema_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = []
+
+
+def migration(version: int, description: str):
+    """注册一个迁移步骤, 版本号必须唯一且递增"""
+    def register(upgrade: Callable):
+        if any(existing == version for existing, _, _ in MIGRATIONS):
+            raise ValueError(f"迁移版本重复: {version}")
+        MIGRATIONS.append((version, description, upgrade))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return upgrade
+    return register
+
+
+def current_version(bind=None) -> int:
+    """
+    数据库当前的结构版本
+
+    Returns:
+        已应用的最高版本号, 尚未应用任何迁移时为0
+    """
+    bind = bind or engine
+    if not inspect(bind).has_table(schema_version.name):
+        return 0
+    with bind.connect() as connection:
+        return connection.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc())).scalar() or 0
+
+
+def migrate(bind=None, target: Optional[int] = None) -> List[int]:
+    """
+    应用尚未执行的迁移
+
+    每个版本在独立的事务中执行并写入版本记录; 多个进程同时迁移时,
+    后提交的一方会因版本号主键冲突而回滚。
+
+    Args:
+        bind: 数据库引擎, 默认使用 database.engine
+        target: 升级到的版本, 默认为最新
+
+    Returns:
+        本次应用的版本号列表
+    """
+    bind = bind or engine
+    schema_metadata.create_all(bind=bind)
+    version = current_version(bind)
+
+    applied = []
+    for migration_version, description, upgrade in MIGRATIONS:
+        if migration_version <= version or (target is not None and migration_version > target):
+            continue
+        with bind.begin() as connection:
+            upgrade(connection)
+            connection.execute(schema_version.insert().values(
+                version=migration_version, description=description, applied_at=datetime.utcnow()
+            ))
+        logger.info("已应用数据库迁移 %s: %s", migration_version, description)
+        applied.append(migration_version)
+    return applied
+
+
+def create_model_index(connection, table, name: str):
+    """按模型中定义的同名索引建索引, 已存在时跳过"""
+    index = next((index for index in table.indexes if index.name == name), None)
+    if index is None:
+        raise ValueError(f"模型中没有索引: {name}")
+    index.create(connection, checkfirst=True)
+
+
+def has_column(connection, table: str, column: str) -> bool:
+    """表上是否已有该列"""
+    return any(existing['name'] == column for existing in inspect(connection).get_columns(table))
+
+
+def has_unique_key(connection, table: str, name: str) -> bool:
+    """表上是否已有同名的唯一约束或唯一索引"""
+    inspector = inspect(connection)
+    return any(item['name'] == name for item in inspector.get_unique_constraints(table)) or \
+        any(item['name'] == name for item in inspector.get_indexes(table))
+
+
+@migration(1, "回顾查询的复合索引和回顾报告唯一键")
+def add_review_query_indexes(connection):
+    # 建唯一索引前清理重复的回顾报告, 每组只保留最新的一份; 被删除的报告id写入日志以便追查
+    duplicates = connection.execute(text(
+        "SELECT id FROM reviews WHERE id NOT IN ("
+        "SELECT MAX(id) FROM reviews GROUP BY user_id, review_type, period_start, period_end) "
+        "ORDER BY id"
+    )).scalars().all()
+    if duplicates:
+        logger.warning("删除%s份重复的回顾报告 (每组保留id最大的一份): %s", len(duplicates), duplicates)
+        connection.execute(text("DELETE FROM reviews WHERE id = :id"), [{"id": id_} for id_ in duplicates])
+    create_model_index(connection, Review.__table__, "uq_reviews_period")
+    create_model_index(connection, Conversation.__table__, "ix_conversations_user_created")
+    create_model_index(connection, Message.__table__, "ix_messages_conversation_timestamp")
+    create_model_index(connection, StructuredMemory.__table__, "ix_structured_memories_user_created")
+
+
+@migration(2, "消息表冗余user_id并建(user_id, timestamp)索引")
+def add_message_user_id(connection):
+    if not has_column(connection, "messages", "user_id"):
+        connection.execute(text("ALTER TABLE messages ADD COLUMN user_id INTEGER REFERENCES users(id)"))
+    # 已有消息按所属会话回填
+    connection.execute(text(
+        "UPDATE messages SET user_id = ("
+        "SELECT conversations.user_id FROM conversations WHERE conversations.id = messages.conversation_id) "
+        "WHERE user_id IS NULL AND conversation_id IS NOT NULL"
+    ))
+    create_model_index(connection, Message.__table__, "ix_messages_user_timestamp")
+
+
+@migration(3, "messages按月范围分区 (仅PostgreSQL)")
+def partition_messages_by_month(connection):
+    partition_messages(connection)
+
+
+@migration(4, "按用户按天的统计汇总表, 并用已有消息回填")
+def add_daily_user_stats(connection):
+    DailyUserStats.__table__.create(connection, checkfirst=True)
+    rebuild_daily_stats(connection)
+
+
+@migration(5, "合并重复的结构化记忆并建立 (user_id, entity_type, entity_name) 唯一键")
+def add_structured_memory_unique_key(connection):
+    if has_unique_key(connection, "structured_memories", "uq_structured_memory_entity"):
+        return
+
+    # 每组重复的实体保留最早的一行, 属性按写入顺序合并 (新值覆盖旧值)
+    rows = connection.execute(text(
+        "SELECT id, user_id, entity_type, entity_name, attributes FROM structured_memories "
+        "WHERE (user_id, entity_type, entity_name) IN ("
+        "SELECT user_id, entity_type, entity_name FROM structured_memories "
+        "GROUP BY user_id, entity_type, entity_name HAVING COUNT(*) > 1) "
+        "ORDER BY id"
+    )).all()
+    groups: Dict[tuple, list] = {}
+    for row in rows:
+        groups.setdefault((row.user_id, row.entity_type, row.entity_name), []).append(row)
+
+    for duplicates in groups.values():
+        attributes = {}
+        for row in duplicates:
+            try:
+                attributes.update(json.loads(row.attributes) if row.attributes else {})
+            except ValueError:
+                logger.warning("结构化记忆%s的属性不是有效的JSON, 合并时忽略", row.id)
+        connection.execute(
+            text("UPDATE structured_memories SET attributes = :attributes WHERE id = :id"),
+            {"attributes": json.dumps(attributes, ensure_ascii=False), "id": duplicates[0].id}
+        )
+        connection.execute(
+            text("DELETE FROM structured_memories WHERE id = :id"),
+            [{"id": row.id} for row in duplicates[1:]]
+        )
+
+    connection.execute(text(
+        "CREATE UNIQUE INDEX uq_structured_memory_entity "
+        "ON structured_memories (user_id, entity_type, entity_name)"
+    ))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    Base.metadata.create_all(bind=engine)
+    applied = migrate()
+    logger.info("数据库结构版本: %s, 本次应用: %s", current_version(), applied or '无')
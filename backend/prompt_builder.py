@@ -0,0 +1,222 @@
+"""
+提示词构建 - 在词元预算内按优先级组装提示词,并保持前缀稳定以命中模型服务端的提示词缓存
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import math
+import os
+import re
+
+# 提示词的总词元预算
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2000"))
+
+SYSTEM_PROMPT = "你是“记忆回响”的回忆录助手，陪伴用户回顾人生经历，帮助他们把回忆整理成故事。"
+CLOSING_INSTRUCTION = "请根据以上信息，以温暖、有同理心的方式回应用户。"
+
+# 每轮都可能变化的实体属性, 放进前缀会导致提示词缓存失效
+VOLATILE_ATTRIBUTES = {'context'}
+
+_TOKEN_PATTERN = re.compile(r'[a-zA-Z0-9]+|\S')
+_ELLIPSIS = '…'
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的词元数
+
+    与常见BPE分词器的量级一致: 每个汉字或标点计1个词元,英文和数字每4个字符计1个词元
+
+    Args:
+        text: 文本
+
+    Returns:
+        词元数
+    """
+    return sum(
+        math.ceil(len(token) / 4) if token.isascii() and token.isalnum() else 1
+        for token in _TOKEN_PATTERN.findall(text)
+    )
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    把文本截断到不超过max_tokens个词元, 截断时以省略号结尾
+
+    Args:
+        text: 文本
+        max_tokens: 词元上限 (包含省略号)
+
+    Returns:
+        截断后的文本
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ''
+
+    used = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        cost = math.ceil(len(token) / 4) if token.isascii() and token.isalnum() else 1
+        if used + cost > max_tokens - 1:
+            return text[:match.start()].rstrip() + _ELLIPSIS
+        used += cost
+    return text
+
+
+def format_core_facts(entities: Sequence[Tuple[str, str, Dict]], limit: int) -> List[str]:
+    """
+    把实体格式化为前缀中的事实行
+
+    实体按类型和名称排序,属性按键排序并去掉易变属性,保证相同的实体集合总是生成相同的文本
+
+    Args:
+        entities: (类型, 名称, 属性) 列表
+        limit: 最多保留的实体数
+
+    Returns:
+        事实行列表
+    """
+    facts = []
+    for entity_type, entity_name, attributes in sorted(entities, key=lambda e: (e[0], e[1]))[:limit]:
+        stable = {key: value for key, value in attributes.items() if key not in VOLATILE_ATTRIBUTES}
+        line = f"- {entity_type}: {entity_name}"
+        if stable:
+            line += f" {json.dumps(stable, ensure_ascii=False, sort_keys=True)}"
+        facts.append(line)
+    return facts
+
+
+class PromptBuilder:
+    """
+    按词元预算组装提示词
+
+    布局为 [系统提示 + 核心实体事实] [相关回忆] [对话历史] [用户输入 + 回复要求]。
+    第一段只依赖用户的实体集合, 在多轮对话中逐字节不变, 可被服务端的前缀缓存复用;
+    用户输入和回复要求总是保留, 其余预算按比例分给回忆和对话历史, 一方用不完的部分留给另一方。
+    放不下的条目整条丢弃, 只有各段中第一个放不下的条目会被截断。
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        system_prompt: str = SYSTEM_PROMPT,
+        max_core_facts: int = 20,
+        memory_share: float = 0.5,
+        max_history_turns: int = 20,
+        min_truncated_tokens: int = 8
+    ):
+        self.max_tokens = max_tokens or PROMPT_TOKEN_BUDGET
+        self.system_prompt = system_prompt
+        self.max_core_facts = max_core_facts
+        self.memory_share = memory_share
+        self.max_history_turns = max_history_turns
+        self.min_truncated_tokens = min_truncated_tokens
+
+    def build(
+        self,
+        user_input: str,
+        conversation_history: Sequence[Dict],
+        relevant_memories: Sequence[Dict],
+        core_entities: Sequence[Tuple[str, str, Dict]] = ()
+    ) -> Dict:
+        """
+        组装提示词
+
+        Args:
+            user_input: 用户输入
+            conversation_history: 按时间顺序的对话历史, 每项包含role和content
+            relevant_memories: 按相关度降序的检索结果, 每项包含document
+            core_entities: 用户的核心实体 (类型, 名称, 属性)
+
+        Returns:
+            包含 prompt、prefix、prefix_hash、sections (各段词元数)、total_tokens
+            和 dropped (被丢弃的回忆和历史条数) 的字典
+        """
+        prefix = self._build_prefix(core_entities)
+        tail = f"用户说: {user_input}\n\n{CLOSING_INSTRUCTION}"
+
+        remaining = self.max_tokens - estimate_tokens(prefix) - estimate_tokens(tail)
+        if remaining < 0:
+            # 用户输入过长时截断输入本身, 前缀保持不变
+            room = estimate_tokens(user_input) + remaining
+            tail = f"用户说: {truncate_to_tokens(user_input, room)}\n\n{CLOSING_INSTRUCTION}"
+            remaining = 0
+
+        memory_lines = [f"- {memory['document']}" for memory in relevant_memories]
+        history = list(conversation_history)[-self.max_history_turns:]
+        # 历史从最近的一轮开始装入, 输出时再恢复时间顺序
+        history_lines = [f"{msg['role']}: {msg['content']}" for msg in reversed(history)]
+
+        memory_budget = int(remaining * self.memory_share)
+        kept_memories = self._pack(memory_lines, memory_budget, '相关回忆:\n')
+        kept_history = self._pack(
+            history_lines, remaining - self._section_tokens(kept_memories, '相关回忆:\n'), '对话历史:\n'
+        )
+        # 历史用不完的预算回给回忆
+        kept_memories = self._pack(
+            memory_lines, remaining - self._section_tokens(kept_history, '对话历史:\n'), '相关回忆:\n'
+        )
+        kept_history.reverse()
+
+        memories_text = self._section('相关回忆:\n', kept_memories)
+        history_text = self._section('对话历史:\n', kept_history)
+        prompt = prefix + memories_text + history_text + tail
+
+        sections = {
+            'prefix': estimate_tokens(prefix),
+            'memories': estimate_tokens(memories_text),
+            'history': estimate_tokens(history_text),
+            'user_input': estimate_tokens(tail)
+        }
+        return {
+            'prompt': prompt,
+            'prefix': prefix,
+            'prefix_hash': hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16],
+            'sections': sections,
+            'total_tokens': sum(sections.values()),
+            'dropped': {
+                'memories': len(memory_lines) - len(kept_memories),
+                'history': len(history_lines) - len(kept_history)
+            }
+        }
+
+    def _build_prefix(self, core_entities: Sequence[Tuple[str, str, Dict]]) -> str:
+        facts = format_core_facts(core_entities, self.max_core_facts)
+        # 前缀最多占总预算的四分之一, 超出时从排序靠后的事实开始丢弃
+        while facts and estimate_tokens(self._prefix_text(facts)) > self.max_tokens // 4:
+            facts.pop()
+        return self._prefix_text(facts)
+
+    def _prefix_text(self, facts: List[str]) -> str:
+        prefix = f"{self.system_prompt}\n\n"
+        if facts:
+            prefix += "关于用户的已知信息:\n" + "\n".join(facts) + "\n\n"
+        return prefix
+
+    def _pack(self, lines: List[str], budget: int, heading: str) -> List[str]:
+        """按顺序装入条目, 第一个放不下的条目在剩余预算足够时截断后装入"""
+        kept = []
+        used = estimate_tokens(heading)
+        for line in lines:
+            cost = estimate_tokens(line)
+            if used + cost <= budget:
+                kept.append(line)
+                used += cost
+                continue
+            room = budget - used
+            if room >= self.min_truncated_tokens:
+                kept.append(truncate_to_tokens(line, room))
+            break
+        return kept
+
+    def _section_tokens(self, lines: List[str], heading: str) -> int:
+        return estimate_tokens(self._section(heading, lines))
+
+    @staticmethod
+    def _section(heading: str, lines: List[str]) -> str:
+        if not lines:
+            return ''
+        return heading + "\n".join(lines) + "\n\n"
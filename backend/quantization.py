@@ -0,0 +1,208 @@
+"""
+向量量化 - int8标量量化与乘积量化(PQ),用于压缩常驻内存的候选检索数据
+
+量化编码只负责粗筛候选,最终排序由全精度向量(可位于磁盘的内存映射文件中)重排完成
+"""
+
+from typing import Dict, Optional, Sequence
+import numpy as np
+
+from ann_index import evaluate_recall
+
+
+class ScalarQuantizer:
+    """int8标量量化 - 每个维度按训练数据的最大绝对值线性缩放到[-127, 127]"""
+
+    def __init__(self, dim: int, chunk_size: int = 8192):
+        self.dim = dim
+        self.chunk_size = chunk_size
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.scale is not None
+
+    @property
+    def code_size(self) -> int:
+        """每个向量的编码字节数"""
+        return self.dim
+
+    def train(self, vectors: np.ndarray):
+        max_abs = np.abs(vectors).max(axis=0) if len(vectors) else np.ones(self.dim)
+        max_abs[max_abs == 0] = 1.0
+        self.scale = (max_abs / 127.0).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint(vectors / self.scale)
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """
+        计算近似内积
+
+        缩放系数并入查询向量,编码分块转换为float32,避免一次性解码全部数据
+
+        Returns:
+            形状为(查询数, 编码数)的分数矩阵
+        """
+        scaled_queries = (queries * self.scale).T
+        result = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        for start in range(0, codes.shape[0], self.chunk_size):
+            block = codes[start:start + self.chunk_size].astype(np.float32)
+            result[:, start:start + self.chunk_size] = (block @ scaled_queries).T
+        return result
+
+
+class ProductQuantizer:
+    """
+    乘积量化
+
+    向量切分为n_subvectors段,每段用256个聚类中心之一的编号表示,
+    检索时为每个查询预先计算各段与所有中心的内积查找表(ADC)。
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        n_subvectors: Optional[int] = None,
+        n_centroids: int = 256,
+        iterations: int = 10,
+        max_train_samples: int = 20000,
+        seed: int = 0,
+        chunk_size: int = 4096
+    ):
+        n_subvectors = n_subvectors or max(1, dim // 16)
+        if dim % n_subvectors != 0:
+            raise ValueError(f"维度{dim}不能被子向量数{n_subvectors}整除")
+        if n_centroids > 256:
+            raise ValueError("每段的聚类中心数不能超过256")
+
+        self.dim = dim
+        self.n_subvectors = n_subvectors
+        self.sub_dim = dim // n_subvectors
+        self.n_centroids = n_centroids
+        self.iterations = iterations
+        self.max_train_samples = max_train_samples
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.codebooks: Optional[np.ndarray] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.codebooks is not None
+
+    @property
+    def code_size(self) -> int:
+        """每个向量的编码字节数"""
+        return self.n_subvectors
+
+    def train(self, vectors: np.ndarray):
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > self.max_train_samples:
+            vectors = vectors[rng.choice(len(vectors), self.max_train_samples, replace=False)]
+
+        n_centroids = min(self.n_centroids, len(vectors))
+        codebooks = np.zeros((self.n_subvectors, self.n_centroids, self.sub_dim), dtype=np.float32)
+        for j in range(self.n_subvectors):
+            sub = np.ascontiguousarray(vectors[:, j * self.sub_dim:(j + 1) * self.sub_dim])
+            codebooks[j, :n_centroids] = self._kmeans(sub, n_centroids, rng)
+            if n_centroids < self.n_centroids:
+                # 样本不足时重复已有中心,保证编码总是有效
+                codebooks[j, n_centroids:] = codebooks[j, 0]
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((vectors.shape[0], self.n_subvectors), dtype=np.uint8)
+        for j in range(self.n_subvectors):
+            sub = vectors[:, j * self.sub_dim:(j + 1) * self.sub_dim]
+            codes[:, j] = self._nearest(sub, self.codebooks[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.n_subvectors)]
+        return np.concatenate(parts, axis=1)
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """
+        通过查找表计算近似内积
+
+        Returns:
+            形状为(查询数, 编码数)的分数矩阵
+        """
+        sub_queries = queries.reshape(queries.shape[0], self.n_subvectors, self.sub_dim)
+        # tables[q, j, c] = 第q个查询第j段与第c个中心的内积
+        tables = np.einsum('qjd,jcd->qjc', sub_queries, self.codebooks)
+
+        subvector_ids = np.arange(self.n_subvectors)
+        result = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        for start in range(0, codes.shape[0], self.chunk_size):
+            block = codes[start:start + self.chunk_size]
+            result[:, start:start + self.chunk_size] = tables[:, subvector_ids, block].sum(axis=2)
+        return result
+
+    def _kmeans(self, vectors: np.ndarray, n_clusters: int, rng) -> np.ndarray:
+        """欧氏距离下的k-means"""
+        centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignments = self._nearest(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            counts = np.bincount(assignments, minlength=n_clusters)
+
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            empty = np.flatnonzero(~filled)
+            if len(empty) > 0:
+                centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        return centroids
+
+    def _nearest(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        centroid_norms = (centroids ** 2).sum(axis=1)
+        nearest = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], self.chunk_size):
+            block = vectors[start:start + self.chunk_size]
+            # ||x - c||^2 = ||x||^2 - 2x·c + ||c||^2, 其中||x||^2对选择无影响
+            distances = centroid_norms - 2 * block @ centroids.T
+            nearest[start:start + self.chunk_size] = np.argmin(distances, axis=1)
+        return nearest
+
+
+def create_quantizer(kind: str, dim: int):
+    """
+    按名称创建量化器
+
+    Args:
+        kind: 'int8' 或 'pq'
+        dim: 向量维度
+    """
+    if kind == 'int8':
+        return ScalarQuantizer(dim)
+    if kind == 'pq':
+        return ProductQuantizer(dim)
+    raise ValueError(f"不支持的量化方式: {kind}")
+
+
+def evaluate_quantization(store, queries: Sequence[Sequence[float]], k: int = 10) -> Dict:
+    """
+    评估量化存储的内存占用与召回率,用于按部署环境选择量化方式
+
+    Args:
+        store: 已挂载量化器的VectorStore
+        queries: 查询向量列表
+        k: Top-K
+
+    Returns:
+        内存占用与召回率报告
+    """
+    report = store.memory_footprint()
+    recall = evaluate_recall(store, queries, k)
+    report.update({
+        'k': k,
+        'recall': recall['recall'],
+        'exact_latency_ms': recall['exact_latency_ms'],
+        'quantized_latency_ms': recall['approx_latency_ms']
+    })
+    return report
@@ -0,0 +1,101 @@
+"""
+检索结果缓存 - 按用户、规范化查询和top_k缓存记忆检索结果,以集合代数失效
+"""
+
+from typing import Dict, Hashable
+from collections import OrderedDict
+import re
+import threading
+import time
+import unicodedata
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询文本: 全半角统一、转小写、合并空白"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', query)).strip().lower()
+
+
+class RetrievalCache:
+    """
+    有界的LRU + TTL检索缓存
+
+    每个条目记录写入时该用户集合的代数(generation)。集合每次变化代数加一,
+    读取时代数不一致的条目立即作废,因此只有发生变化的用户的缓存会失效。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key: Hashable, generation: int):
+        """
+        查询缓存
+
+        Args:
+            key: 缓存键
+            generation: 该用户集合的当前代数
+
+        Returns:
+            命中时返回缓存的结果,否则返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry_generation, expires_at, result, compute_seconds = entry
+            if entry_generation != generation or expires_at < time.monotonic():
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += compute_seconds
+            return result
+
+    def put(self, key: Hashable, generation: int, result, compute_seconds: float = 0.0):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            generation: 计算结果时该用户集合的代数
+            result: 检索结果
+            compute_seconds: 计算耗时,命中时计入节省的时间
+        """
+        with self._lock:
+            self._entries[key] = (generation, time.monotonic() + self.ttl_seconds, result, compute_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """命中率与节省的检索耗时"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+            'saved_latency_ms': round(self.saved_seconds * 1000, 3)
+        }
@@ -6,14 +6,20 @@ from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from database import Message, StructuredMemory, Conversation, get_db
+from ai_core import collection as memory_collection
+from daily_stats import load_daily_stats
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class DataAggregator:
     """数据聚合器 - 从多个数据源收集指定时间范围内的记忆数据"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, vector_collection=None):
         self.db = db
+        self.vector_collection = vector_collection if vector_collection is not None else memory_collection
     
     def aggregate_review_data(
         self, 
@@ -41,9 +47,16 @@ class DataAggregator:
         # 获取结构化记忆
         structured_memories = self._get_structured_memories(user_id, period_start, period_end)
         
-        # 获取向量记忆 (暂时模拟,实际需要从ChromaDB查询)
+        # 获取向量记忆
         vector_memories = self._get_vector_memories(user_id, period_start, period_end)
         
+        # 按天汇总的统计 (每天一行), 统计数据和情感时间线由此得到, 不逐条分析消息;
+        # 汇总与本期的原始记录对不上时 (缺行、批量导入或删除未计入) 退回逐条分析
+        daily_stats = load_daily_stats(self.db, user_id, period_start.date(), period_end.date())
+        if not self._rollup_covers(daily_stats, conversations, messages):
+            logger.info("用户%s的按天汇总与%s至%s的原始记录不一致, 逐条分析消息", user_id, period_start, period_end)
+            daily_stats = None
+        
         return {
             'user_id': user_id,
             'period_start': period_start,
@@ -52,8 +65,9 @@ class DataAggregator:
             'messages': messages,
             'structured_memories': structured_memories,
             'vector_memories': vector_memories,
+            'daily_stats': daily_stats,
             'statistics': self._calculate_basic_statistics(
-                conversations, messages, structured_memories
+                conversations, messages, structured_memories, vector_memories, daily_stats
             )
         }
     
@@ -86,16 +100,9 @@ class DataAggregator:
         period_start: datetime, 
         period_end: datetime
     ) -> List[Dict]:
-        """查询消息记录"""
-        # 首先获取该时间段内的所有对话ID
-        conversation_ids = self.db.query(Conversation.id).filter(
-            Conversation.user_id == user_id
-        ).all()
-        conversation_ids = [conv_id[0] for conv_id in conversation_ids]
-        
-        # 查询这些对话中在时间范围内的所有消息
+        """查询消息记录 (在(user_id, timestamp)索引上做一次范围查找)"""
         messages = self.db.query(Message).filter(
-            Message.conversation_id.in_(conversation_ids),
+            Message.user_id == user_id,
             Message.timestamp >= period_start,
             Message.timestamp <= period_end
         ).order_by(Message.timestamp.asc()).all()
@@ -143,20 +150,75 @@ class DataAggregator:
     ) -> List[Dict]:
         """
         查询向量记忆
-        实际实现需要从ChromaDB中根据元数据筛选
-        这里提供模拟实现
+        在用户分区的时间索引上做范围查找,不遍历整个集合
+        """
+        results = self.vector_collection.get_by_time_range(user_id, period_start, period_end)
+        
+        return [
+            {
+                'id': memory_id,
+                'content': document,
+                'metadata': metadata,
+                'timestamp': metadata['timestamp']
+            }
+            for memory_id, document, metadata in zip(
+                results['ids'], results['documents'], results['metadatas']
+            )
+        ]
+    
+    @staticmethod
+    def _rollup_covers(daily_stats: List[Dict], conversations: List[Dict], messages: List[Dict]) -> bool:
+        """
+        汇总行是否完整覆盖本期
+        
+        逐日比较汇总中的消息数和对话数与原始记录的计数, 
+        时间段不按整天划分时汇总会包含段外的记录, 同样视为不覆盖
         """
-        # TODO: 实际集成ChromaDB查询
-        # 根据元数据中的user_id和timestamp筛选
-        return []
+        expected: Dict[str, List[int]] = {}
+        for msg in messages:
+            counts = expected.setdefault(msg['timestamp'][:10], [0, 0, 0])
+            if msg['role'] == 'user':
+                counts[0] += 1
+            elif msg['role'] == 'assistant':
+                counts[1] += 1
+        for conv in conversations:
+            expected.setdefault(conv['created_at'][:10], [0, 0, 0])[2] += 1
+        
+        actual = {
+            day['date']: [day['user_messages'], day['assistant_messages'], day['conversations']]
+            for day in daily_stats
+        }
+        return {
+            day: counts for day, counts in actual.items() if any(counts)
+        } == {
+            day: counts for day, counts in expected.items() if any(counts)
+        }
     
     def _calculate_basic_statistics(
         self,
         conversations: List[Dict],
         messages: List[Dict],
-        structured_memories: List[Dict]
+        structured_memories: List[Dict],
+        vector_memories: Optional[List[Dict]] = None,
+        daily_stats: Optional[List[Dict]] = None
     ) -> Dict:
-        """计算基础统计数据"""
+        """计算基础统计数据, 提供按天汇总时由汇总行计算对话和消息的数量"""
+        if daily_stats is not None:
+            total_conversations = sum(day['conversations'] for day in daily_stats)
+            user_messages = sum(day['user_messages'] for day in daily_stats)
+            assistant_messages = sum(day['assistant_messages'] for day in daily_stats)
+            total_messages = user_messages + assistant_messages
+            return {
+                'total_conversations': total_conversations,
+                'total_messages': total_messages,
+                'user_messages': user_messages,
+                'assistant_messages': assistant_messages,
+                'active_days': sum(1 for day in daily_stats if day['active']),
+                'avg_conversation_length': round(total_messages / total_conversations, 2) if total_conversations else 0,
+                'total_structured_memories': len(structured_memories),
+                'total_vector_memories': len(vector_memories or [])
+            }
+        
         # 计算活跃天数
         message_dates = set()
         for msg in messages:
@@ -179,7 +241,8 @@ class DataAggregator:
             'assistant_messages': len(assistant_messages),
             'active_days': len(message_dates),
             'avg_conversation_length': round(avg_conversation_length, 2),
-            'total_structured_memories': len(structured_memories)
+            'total_structured_memories': len(structured_memories),
+            'total_vector_memories': len(vector_memories or [])
         }
 
 
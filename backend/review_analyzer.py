@@ -2,12 +2,14 @@
 AI分析引擎 - 执行内容分析、主题提取、情感分析、亮点识别
 """
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 from collections import Counter
 import re
 import json
 
+from vector_store import to_datetime
+
 
 class EmotionAnalyzer:
     """情感分析器"""
@@ -23,29 +25,36 @@ class EmotionAnalyzer:
         '愤怒', '生气', '失望', '沮丧', '孤独', '疲惫', '压力', '烦躁'
     ]
     
-    def analyze_emotion(self, messages: List[Dict]) -> Dict:
+    def analyze_emotion(self, messages: List[Dict], daily_stats: Optional[List[Dict]] = None) -> Dict:
         """
         分析情感曲线
         
         Args:
             messages: 消息列表
+            daily_stats: 按天汇总的统计行, 提供时与messages合并, 已汇总的消息不需要逐条传入
             
         Returns:
             情感分析结果
         """
-        # 按日期组织消息
-        messages_by_date = self._group_messages_by_date(messages)
+        # 按日期累计情感分数和各类情感的消息数
+        days = self._daily_sentiment(messages)
+        for row in daily_stats or []:
+            day = days.setdefault(row['date'], self._empty_day())
+            day['messages'] += row['user_messages']
+            day['sentiment_sum'] += row['sentiment_sum']
+            for emotion in ('positive', 'neutral', 'negative'):
+                day[emotion] += row[f'{emotion}_messages']
         
         # 生成情感时间线
         emotion_timeline = []
-        for date, msgs in sorted(messages_by_date.items()):
-            sentiment_score = self._calculate_sentiment_score(msgs)
-            dominant_emotion = self._get_dominant_emotion(msgs)
-            
+        for date, day in sorted(days.items()):
+            if day['messages'] == 0:
+                continue
             emotion_timeline.append({
                 'date': date,
-                'sentiment_score': sentiment_score,
-                'dominant_emotion': dominant_emotion
+                'sentiment_score': round(day['sentiment_sum'] / day['messages'], 2),
+                # 数量相同时依次取正面、中性、负面
+                'dominant_emotion': max(('positive', 'neutral', 'negative'), key=lambda emotion: day[emotion])
             })
         
         # 计算整体情感分布
@@ -60,6 +69,42 @@ class EmotionAnalyzer:
             'emotion_trends': emotion_trends
         }
     
+    def score_message(self, content: str) -> Tuple[float, str]:
+        """
+        计算单条消息的情感
+        
+        Returns:
+            (情感分数, 情感类别), 分数在-1到1之间, 类别为 positive / neutral / negative
+        """
+        positive_count = sum(1 for keyword in self.POSITIVE_KEYWORDS if keyword in content)
+        negative_count = sum(1 for keyword in self.NEGATIVE_KEYWORDS if keyword in content)
+        
+        score = 0.0
+        if positive_count + negative_count > 0:
+            score = (positive_count - negative_count) / (positive_count + negative_count)
+        
+        if positive_count > negative_count:
+            return score, 'positive'
+        if negative_count > positive_count:
+            return score, 'negative'
+        return score, 'neutral'
+    
+    @staticmethod
+    def _empty_day() -> Dict:
+        return {'messages': 0, 'sentiment_sum': 0.0, 'positive': 0, 'neutral': 0, 'negative': 0}
+    
+    def _daily_sentiment(self, messages: List[Dict]) -> Dict[str, Dict]:
+        """按日期累计用户消息的情感"""
+        days = {}
+        for date, msgs in self._group_messages_by_date(messages).items():
+            day = days[date] = self._empty_day()
+            for msg in msgs:
+                score, emotion = self.score_message(msg['content'])
+                day['messages'] += 1
+                day['sentiment_sum'] += score
+                day[emotion] += 1
+        return days
+    
     def _group_messages_by_date(self, messages: List[Dict]) -> Dict[str, List[Dict]]:
         """按日期组织消息"""
         messages_by_date = {}
@@ -80,19 +125,7 @@ class EmotionAnalyzer:
         Returns:
             -1到1之间的分数,-1表示非常负面,1表示非常正面
         """
-        total_score = 0
-        
-        for msg in messages:
-            content = msg['content']
-            
-            # 统计正面和负面关键词
-            positive_count = sum(1 for keyword in self.POSITIVE_KEYWORDS if keyword in content)
-            negative_count = sum(1 for keyword in self.NEGATIVE_KEYWORDS if keyword in content)
-            
-            # 计算该消息的情感分数
-            if positive_count + negative_count > 0:
-                score = (positive_count - negative_count) / (positive_count + negative_count)
-                total_score += score
+        total_score = sum(self.score_message(msg['content'])[0] for msg in messages)
         
         # 返回平均分数
         if len(messages) > 0:
@@ -104,17 +137,7 @@ class EmotionAnalyzer:
         emotion_counts = {'positive': 0, 'neutral': 0, 'negative': 0}
         
         for msg in messages:
-            content = msg['content']
-            
-            positive_count = sum(1 for keyword in self.POSITIVE_KEYWORDS if keyword in content)
-            negative_count = sum(1 for keyword in self.NEGATIVE_KEYWORDS if keyword in content)
-            
-            if positive_count > negative_count:
-                emotion_counts['positive'] += 1
-            elif negative_count > positive_count:
-                emotion_counts['negative'] += 1
-            else:
-                emotion_counts['neutral'] += 1
+            emotion_counts[self.score_message(msg['content'])[1]] += 1
         
         # 返回占比最高的情感
         return max(emotion_counts, key=emotion_counts.get)
@@ -175,12 +198,20 @@ class TopicExtractor:
         '个人成长': ['学习', '成长', '反思', '目标', '习惯', '改变', '进步']
     }
     
-    def extract_topics(self, messages: List[Dict]) -> List[Dict]:
+    def match_topics(self, content: str) -> List[str]:
+        """单条消息命中的主题"""
+        return [
+            topic for topic, keywords in self.TOPIC_LIBRARY.items()
+            if any(keyword in content for keyword in keywords)
+        ]
+    
+    def extract_topics(self, messages: List[Dict], daily_stats: Optional[List[Dict]] = None) -> List[Dict]:
         """
         提取主题标签
         
         Args:
             messages: 消息列表
+            daily_stats: 按天汇总的统计行, 提供时其中的主题命中数与messages合并
             
         Returns:
             主题列表,包含主题名称、权重、频次等信息
@@ -191,15 +222,17 @@ class TopicExtractor:
         
         for msg in messages:
             if msg['role'] == 'user':
-                content = msg['content']
                 date = datetime.fromisoformat(msg['timestamp']).date().isoformat()
                 
-                for topic, keywords in self.TOPIC_LIBRARY.items():
-                    for keyword in keywords:
-                        if keyword in content:
-                            topic_counts[topic] += 1
-                            topic_dates[topic].add(date)
-                            break
+                for topic in self.match_topics(msg['content']):
+                    topic_counts[topic] += 1
+                    topic_dates[topic].add(date)
+        
+        for row in daily_stats or []:
+            for topic, count in (row['topic_counts'] or {}).items():
+                if topic in topic_counts and count > 0:
+                    topic_counts[topic] += count
+                    topic_dates[topic].add(row['date'])
         
         # 计算总出现次数
         total_count = sum(topic_counts.values())
@@ -495,11 +528,19 @@ class ReviewAnalyzer:
         structured_memories = aggregated_data['structured_memories']
         statistics = aggregated_data['statistics']
         
+        # 消息已按天汇总时只需逐条分析向量记忆, 否则逐条分析消息
+        daily_stats = aggregated_data.get('daily_stats')
+        
+        # 向量记忆视为用户的表达, 与消息一起参与情感和主题分析
+        expressions = self._merge_vector_memories(
+            messages if daily_stats is None else [], aggregated_data.get('vector_memories', [])
+        )
+        
         # 情感分析
-        emotion_analysis = self.emotion_analyzer.analyze_emotion(messages)
+        emotion_analysis = self.emotion_analyzer.analyze_emotion(expressions, daily_stats)
         
         # 主题提取
-        topics = self.topic_extractor.extract_topics(messages)
+        topics = self.topic_extractor.extract_topics(expressions, daily_stats)
         
         # 关键事件提取
         max_events = 10 if review_type == 'annual' else 5
@@ -551,6 +592,36 @@ class ReviewAnalyzer:
             'visualization_data': visualization_data
         }
     
+    def _merge_vector_memories(self, messages: List[Dict], vector_memories: List[Dict]) -> List[Dict]:
+        """
+        将向量记忆转换为用户消息格式,按时间与消息合并
+        
+        向量记忆的时间戳可能带时区, 统一转换为与数据库消息一致的naive UTC时间后再排序
+        """
+        if not vector_memories:
+            return messages
+        
+        memory_messages = [
+            {
+                'id': memory['id'],
+                'role': 'user',
+                'content': memory['content'],
+                'timestamp': self._normalize_timestamp(memory['timestamp'])
+            }
+            for memory in vector_memories
+        ]
+        
+        return sorted(
+            messages + memory_messages,
+            key=lambda msg: to_datetime(msg['timestamp']) or datetime.min
+        )
+    
+    @staticmethod
+    def _normalize_timestamp(timestamp: str) -> str:
+        """将时间戳转换为naive UTC的ISO格式, 无法解析时原样返回"""
+        parsed = to_datetime(timestamp)
+        return parsed.isoformat() if parsed else timestamp
+    
     def _generate_summary(
         self, 
         review_type: str, 
@@ -4,7 +4,7 @@
 
 from typing import Optional
 from datetime import datetime
-from database import get_db
+from database import session_scope
 from review_service import ReviewService, ReviewExporter
 
 
@@ -77,10 +77,7 @@ class ReviewAPI:
                         'message': '只能为已结束的年份生成回顾'
                     }, 400
             
-            # 获取数据库会话
-            db = next(get_db())
-            
-            try:
+            with session_scope() as db:
                 # 创建服务实例
                 review_service = ReviewService(db)
                 
@@ -99,9 +96,6 @@ class ReviewAPI:
                     'status': 'completed',
                     'message': '回顾报告生成成功'
                 }, 200
-                
-            finally:
-                db.close()
         
         except ValueError as e:
             return {
@@ -125,10 +119,7 @@ class ReviewAPI:
         完整的回顾报告数据
         """
         try:
-            # 获取数据库会话
-            db = next(get_db())
-            
-            try:
+            with session_scope() as db:
                 # 创建服务实例
                 review_service = ReviewService(db)
                 
@@ -145,9 +136,6 @@ class ReviewAPI:
                     'success': True,
                     'data': review_data
                 }, 200
-                
-            finally:
-                db.close()
         
         except Exception as e:
             return {
@@ -186,10 +174,7 @@ class ReviewAPI:
             if page_size < 1 or page_size > 100:
                 page_size = 10
             
-            # 获取数据库会话
-            db = next(get_db())
-            
-            try:
+            with session_scope() as db:
                 # 创建服务实例
                 review_service = ReviewService(db)
                 
@@ -206,9 +191,6 @@ class ReviewAPI:
                     'success': True,
                     'data': result
                 }, 200
-                
-            finally:
-                db.close()
         
         except Exception as e:
             return {
@@ -227,10 +209,7 @@ class ReviewAPI:
         - message: str - 提示信息
         """
         try:
-            # 获取数据库会话
-            db = next(get_db())
-            
-            try:
+            with session_scope() as db:
                 # 创建服务实例
                 review_service = ReviewService(db)
                 
@@ -247,9 +226,6 @@ class ReviewAPI:
                         'success': False,
                         'message': '回顾报告不存在或无权删除'
                     }, 404
-                
-            finally:
-                db.close()
         
         except Exception as e:
             return {
@@ -279,10 +255,7 @@ class ReviewAPI:
                     'message': '不支持的导出格式'
                 }, 400
             
-            # 获取数据库会话
-            db = next(get_db())
-            
-            try:
+            with session_scope() as db:
                 # 创建服务实例
                 review_service = ReviewService(db)
                 
@@ -312,9 +285,6 @@ class ReviewAPI:
                         'success': False,
                         'message': f'{export_format}格式导出功能正在开发中'
                     }, 501
-                
-            finally:
-                db.close()
         
         except Exception as e:
             return {
@@ -4,6 +4,7 @@
 
 from typing import Optional, Dict
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from database import Review, get_db
 from review_aggregator import DataAggregator, TimeRangeCalculator
@@ -260,7 +261,15 @@ class ReviewService:
         )
         
         self.db.add(review)
-        self.db.commit()
+        try:
+            self.db.commit()
+        except IntegrityError:
+            # 并发生成同一时间段的报告时会触发唯一键冲突, 改为更新先写入的那一份
+            self.db.rollback()
+            existing_review = self._get_existing_review(user_id, review_type, period_start, period_end)
+            if existing_review is None:
+                raise
+            return self._update_review(existing_review, aggregated_data, analysis_result)
         self.db.refresh(review)
         
         return review
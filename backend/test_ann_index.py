@@ -0,0 +1,156 @@
+"""
+近似最近邻索引的单元测试
+"""
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from ann_index import IVFIndex, evaluate_recall, spherical_kmeans
+from vector_store import VectorStore
+from ai_core import ANN_CENTROIDS_FILE, ChromaCollection
+
+
+def _clustered_vectors(count, dim, centers=8, seed=0):
+    rng = np.random.default_rng(seed)
+    means = rng.normal(size=(centers, dim))
+    labels = rng.integers(0, centers, size=count)
+    return (means[labels] + 0.3 * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+class TestIVFIndex(unittest.TestCase):
+    """测试IVF索引"""
+    
+    def setUp(self):
+        self.dim = 16
+        self.store = VectorStore(dim=self.dim)
+        self._add(_clustered_vectors(600, self.dim))
+        self.store.attach_ann_index(IVFIndex(dim=self.dim, nprobe=4))
+    
+    def _add(self, vectors):
+        start = len(self.store)
+        self.store.add(
+            ids=[str(start + i) for i in range(len(vectors))],
+            embeddings=vectors,
+            documents=['' for _ in vectors],
+            metadatas=[{} for _ in vectors]
+        )
+    
+    def test_index_covers_all_rows(self):
+        """测试训练后所有向量都已写入索引"""
+        self.assertTrue(self.store.ann_index.is_trained)
+        self.assertEqual(len(self.store.ann_index), 600)
+    
+    def test_incremental_insert(self):
+        """测试训练后新增的向量无需重建即可被检索到"""
+        new_vector = np.full(self.dim, 5.0, dtype=np.float32)
+        self._add([new_vector])
+        
+        rows, _ = self.store.search([new_vector], k=1)
+        
+        self.assertEqual(len(self.store.ann_index), 601)
+        self.assertEqual(rows[0][0], 600)
+    
+    def test_recall_against_exact(self):
+        """测试近似检索的召回率"""
+        queries = _clustered_vectors(20, self.dim, seed=1)
+        
+        report = evaluate_recall(self.store, queries, k=10, nprobe=8)
+        
+        self.assertGreaterEqual(report['recall'], 0.9)
+        self.assertIn('approx_latency_ms', report)
+    
+    def test_exact_search_bypasses_index(self):
+        """测试exact参数强制精确检索"""
+        queries = _clustered_vectors(5, self.dim, seed=2)
+        
+        exact_rows, _ = self.store.search(queries, k=5, exact=True)
+        full_probe_rows, _ = self.store.search(
+            queries, k=5, nprobe=self.store.ann_index.centroids.shape[0]
+        )
+        
+        self.assertEqual(exact_rows.tolist(), full_probe_rows.tolist())
+
+
+class TestIVFRetrain(unittest.TestCase):
+    """测试ANN索引随分区增长重新训练, 以及聚类中心的持久化"""
+    
+    dim = 16
+    
+    def _add(self, collection, count, seed):
+        vectors = _clustered_vectors(count, self.dim, seed=seed)
+        collection.add_memories(1, ['' for _ in vectors], vectors, [{'user_id': 1} for _ in vectors])
+    
+    def test_large_training_set_is_sampled(self):
+        """测试大规模数据只抽样训练, 桶数仍按全部数据的规模决定"""
+        index = IVFIndex(dim=self.dim, train_samples_per_list=4)
+        vectors = _clustered_vectors(400, self.dim)
+        
+        with patch('ann_index.spherical_kmeans', wraps=spherical_kmeans) as kmeans:
+            index.train(vectors)
+        
+        self.assertEqual(kmeans.call_args[0][0].shape[0], 20 * 4)
+        self.assertEqual(index.centroids.shape[0], 20)
+        self.assertEqual(index.trained_size, 400)
+    
+    def test_retrains_in_background_after_growth(self):
+        """测试分区增长到训练时的倍数后在后台重新训练, 桶数随规模增加且不丢失向量"""
+        collection = ChromaCollection(dim=self.dim, ann_threshold=100, ann_retrain_growth=4)
+        self._add(collection, 100, seed=0)
+        store = collection.partition(1)
+        first = store.ann_index
+        self.assertEqual((first.trained_size, first.centroids.shape[0]), (100, 10))
+        
+        self._add(collection, 299, seed=1)
+        self.assertIs(store.ann_index, first)
+        self._add(collection, 1, seed=2)
+        for thread in list(collection._ann_rebuilds.values()):
+            thread.join()
+        
+        self.assertIsNot(store.ann_index, first)
+        self.assertEqual(store.ann_index.trained_size, 400)
+        self.assertEqual(store.ann_index.centroids.shape[0], 20)
+        self.assertEqual(len(store.ann_index), 400)
+    
+    def test_rebuild_discarded_after_compaction(self):
+        """测试重建期间分区被压缩时放弃替换"""
+        store = VectorStore(dim=self.dim)
+        vectors = _clustered_vectors(200, self.dim)
+        store.add([str(i) for i in range(200)], vectors, ['' for _ in vectors], [{} for _ in vectors])
+        store.attach_ann_index(IVFIndex(dim=self.dim))
+        
+        index = IVFIndex(dim=self.dim)
+        original_train = index.train
+        
+        def train_then_compact(data):
+            original_train(data)
+            store.delete(['0'])
+            store.compact()
+        
+        index.train = train_then_compact
+        
+        self.assertFalse(store.rebuild_ann_index(index))
+        # 压缩时已按新的行号重新训练了原索引
+        self.assertIsNot(store.ann_index, index)
+        self.assertEqual((store.ann_index.trained_size, len(store.ann_index)), (199, 199))
+    
+    def test_persisted_centroids_reused_on_open(self):
+        """测试持久化分区保存聚类中心, 重新打开时直接载入而不重新聚类"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            collection = ChromaCollection(dim=self.dim, ann_threshold=100, persist_directory=tmp_dir)
+            self._add(collection, 150, seed=0)
+            centroids = collection.partition(1).ann_index.centroids
+            
+            with patch('ann_index.spherical_kmeans') as kmeans:
+                reopened = ChromaCollection(dim=self.dim, ann_threshold=100, persist_directory=tmp_dir)
+                index = reopened.partition(1).ann_index
+            
+            kmeans.assert_not_called()
+            np.testing.assert_array_equal(index.centroids, centroids)
+            self.assertEqual(len(index), 150)
+            self.assertIn(ANN_CENTROIDS_FILE, os.listdir(collection.partition(1).path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+"""
+异步对话流水线的单元测试
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+import database
+from database import Base, Conversation, Message, to_async_url
+from conversation_context import ConversationAccessError, ConversationContextCache
+from entity_graph import EntityIndexRegistry
+from embedding_batcher import EmbeddingBatcher
+import ai_core
+from ai_core import AsyncDialogueManager, ChromaCollection, LocalStreamingModel
+
+
+class TestAsyncUrl(unittest.TestCase):
+    """测试异步驱动连接串转换"""
+    
+    def test_to_async_url(self):
+        self.assertEqual(to_async_url('postgresql://localhost/db'), 'postgresql+asyncpg://localhost/db')
+        self.assertEqual(to_async_url('postgresql+psycopg2://u@h/db'), 'postgresql+asyncpg://u@h/db')
+        self.assertEqual(to_async_url('sqlite:///./app.db'), 'sqlite+aiosqlite:///./app.db')
+        self.assertEqual(to_async_url('sqlite+aiosqlite:///x.db'), 'sqlite+aiosqlite:///x.db')
+
+
+class TestAsyncDialogueManager(unittest.TestCase):
+    """测试异步对话管理器"""
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'test.db')
+        
+        engine = create_engine(f'sqlite:///{path}')
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(bind=engine)
+        self.Session = sessionmaker(bind=engine)
+        session = self.Session()
+        session.add_all([Conversation(id=1, user_id=1), Conversation(id=2, user_id=2)])
+        session.add(Message(conversation_id=1, role='user', content='上次聊到外婆家的院子'))
+        session.commit()
+        session.close()
+        
+        self.async_engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+        self.AsyncSession = sessionmaker(bind=self.async_engine, class_=AsyncSession, expire_on_commit=False)
+        
+        for target, value in [
+            ('ai_core.SessionLocal', self.Session),
+            ('ai_core.entity_indexes', EntityIndexRegistry()),
+            ('ai_core.conversation_contexts', ConversationContextCache(session_factory=self.Session)),
+            ('ai_core.collection', ChromaCollection()),
+            ('ai_core.embedding_batcher', EmbeddingBatcher(ai_core.embedder, max_wait_ms=50)),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def _manager(self, **kwargs):
+        return AsyncDialogueManager(
+            1,
+            model=LocalStreamingModel(token_delay_ms=0),
+            async_session_factory=self.AsyncSession,
+            **kwargs
+        )
+    
+    def _run(self, coroutine):
+        async def run_and_dispose():
+            try:
+                return await coroutine
+            finally:
+                await self.async_engine.dispose()
+        return asyncio.run(run_and_dispose())
+    
+    def test_history_and_turn_use_async_session(self):
+        """测试通过异步会话读取会话历史并保存本轮消息"""
+        manager = self._manager()
+        response = self._run(manager.agenerate_response('外婆家的院子里有棵枣树', conversation_id=1))
+        
+        self.assertIn('外婆家的院子里有棵枣树', response)
+        self.assertIn('上次聊到外婆家的院子', manager.last_prompt_report['prompt'])
+        self.assertEqual({stage['status'] for stage in manager.last_stage_report.values()}, {'ok'})
+        
+        session = self.Session()
+        contents = [m.content for m in session.query(Message).order_by(Message.id)]
+        session.close()
+        self.assertEqual(contents, ['上次聊到外婆家的院子', '外婆家的院子里有棵枣树', response])
+        self.assertIsNotNone(manager.memory_system.get_entity('family_member', '外婆'))
+    
+    def test_concurrent_turns_share_embedding_batch(self):
+        """测试并发对话写入的向量记忆经过微批处理器合并为一批"""
+        managers = [self._manager() for _ in range(3)]
+        
+        async def run_turns():
+            await asyncio.gather(*(
+                manager.agenerate_response(f'第{i}段回忆', []) for i, manager in enumerate(managers)
+            ))
+            await ai_core.embedding_batcher.stop()
+        
+        self._run(run_turns())
+        
+        self.assertEqual(ai_core.embedding_batcher.metrics.snapshot()['batch_size_histogram'], {3: 1})
+        self.assertEqual(
+            sorted(ai_core.collection.get(where={'user_id': 1})['documents']),
+            ['第0段回忆', '第1段回忆', '第2段回忆']
+        )
+    
+    def test_rejects_foreign_conversation(self):
+        """测试会话不属于当前用户时拒绝本轮, 不会降级为空历史后继续写入"""
+        manager = self._manager()
+        with self.assertRaises(ConversationAccessError):
+            self._run(manager.agenerate_response('你好', conversation_id=2))
+        
+        session = self.Session()
+        self.assertEqual(session.query(Message).count(), 1)
+        session.close()
+    
+    def test_stage_timeout_degrades(self):
+        """测试超时的阶段以空结果降级, 仍然生成回复"""
+        manager = self._manager(stage_timeouts={'retrieval': 0.05})
+        
+        def slow_retrieval(query):
+            time.sleep(0.3)
+            return [{'document': '不应出现的回忆'}]
+        
+        with patch.object(manager.memory_system, 'retrieve_relevant_memories', slow_retrieval):
+            response = self._run(manager.agenerate_response('你好', []))
+        
+        self.assertTrue(response)
+        self.assertEqual(manager.last_stage_report['retrieval']['status'], 'timeout')
+        self.assertNotIn('不应出现的回忆', manager.last_prompt_report['prompt'])
+    
+    def test_stages_run_concurrently(self):
+        """测试各阶段并发执行, 总耗时接近最慢的阶段而不是各阶段之和"""
+        manager = self._manager()
+        
+        def slow_retrieval(query):
+            time.sleep(0.2)
+            return []
+        
+        def slow_extract(text):
+            time.sleep(0.2)
+            return []
+        
+        with patch.object(manager.memory_system, 'retrieve_relevant_memories', slow_retrieval), \
+                patch.object(manager, 'extract_entities', slow_extract), \
+                patch.dict(manager.stage_timeouts, {'entities': 1.0}):
+            started = time.perf_counter()
+            self._run(manager._aprepare('你好', [], None))
+            elapsed = time.perf_counter() - started
+        
+        self.assertLess(elapsed, 0.35)
+    
+    def test_sync_wrapper_uses_isolated_resources(self):
+        """测试同步接口使用独占的异步引擎和微批处理器, 不触碰全局连接池和全局批处理器"""
+        manager = AsyncDialogueManager(1, model=LocalStreamingModel(token_delay_ms=0))
+        
+        with patch('database.DATABASE_URL', str(self.Session.kw['bind'].url)), \
+                patch('database._async_engine', None):
+            response = manager.generate_response('外婆家的院子里有棵枣树', conversation_id=1)
+            self.assertIsNone(database._async_engine)
+        
+        self.assertIsNone(ai_core.embedding_batcher._worker)
+        self.assertIsNone(manager.async_session_factory)
+        self.assertIsNone(manager.embedding_batcher)
+        self.assertIn('上次聊到外婆家的院子', manager.last_prompt_report['prompt'])
+        session = self.Session()
+        self.assertEqual(session.query(Message).filter(Message.content == response).count(), 1)
+        session.close()
+        self.assertEqual(ai_core.collection.get(where={'user_id': 1})['documents'], ['外婆家的院子里有棵枣树'])
+    
+    def test_sync_wrapper(self):
+        """测试同步接口与异步接口结果一致"""
+        manager = self._manager()
+        self.assertEqual(
+            manager.generate_response('今天去了公园', []),
+            self._run(manager.agenerate_response('今天去了公园', []))
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""
+会话上下文缓存的单元测试
+"""
+
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base, Conversation, Message
+from conversation_context import ConversationAccessError, ConversationContextCache
+from entity_graph import EntityIndexRegistry
+from ai_core import DialogueManager, LocalStreamingModel
+
+
+class TestConversationContextCache(unittest.TestCase):
+    """测试会话上下文环形缓冲"""
+    
+    def setUp(self):
+        self.engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=self.engine)
+        self.addCleanup(self.engine.dispose)
+        self.Session = sessionmaker(bind=self.engine)
+        
+        start = datetime(2024, 1, 1)
+        session = self.Session()
+        session.add_all([Conversation(id=1, user_id=1), Conversation(id=2, user_id=2)])
+        session.add_all([
+            Message(conversation_id=1, role='user', content=f'消息{i}', timestamp=start + timedelta(minutes=i))
+            for i in range(10)
+        ])
+        session.commit()
+        session.close()
+        
+        self.queries = 0
+        event.listen(self.engine, 'before_cursor_execute', self._count_select)
+        self.cache = ConversationContextCache(window=4, max_conversations=2, session_factory=self.Session)
+    
+    def _count_select(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.queries += 1
+    
+    def test_miss_loads_recent_window(self):
+        """测试未命中时只加载最近的窗口, 按时间顺序返回"""
+        history = self.cache.get(1)
+        
+        self.assertEqual([m['content'] for m in history], ['消息6', '消息7', '消息8', '消息9'])
+        self.assertEqual(self.queries, 1)
+    
+    def test_hit_does_not_query(self):
+        """测试命中时不访问数据库"""
+        self.cache.get(1)
+        self.cache.get(1)
+        
+        self.assertEqual(self.queries, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+    
+    def test_append_persists_and_rolls_window(self):
+        """测试追加消息写入数据库, 缓冲中丢弃最早的消息"""
+        self.cache.get(1)
+        self.cache.append(1, [{'role': 'user', 'content': '新消息'}, {'role': 'assistant', 'content': '回复'}])
+        
+        self.assertEqual([m['content'] for m in self.cache.get(1)], ['消息8', '消息9', '新消息', '回复'])
+        
+        session = self.Session()
+        self.assertEqual(session.query(Message).filter(Message.conversation_id == 1).count(), 12)
+        session.close()
+        
+        # 重新加载的结果与缓冲一致
+        self.cache.invalidate(1)
+        self.assertEqual([m['content'] for m in self.cache.get(1)], ['消息8', '消息9', '新消息', '回复'])
+    
+    def test_lru_eviction(self):
+        """测试超过会话数上限时淘汰最久未使用的会话"""
+        self.cache.get(1)
+        self.cache.get(2)
+        self.cache.get(1)
+        self.cache.get(3)
+        
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.cache.get(1)
+        self.assertEqual(self.cache.stats()['hits'], 2)
+    
+    def test_dialogue_uses_server_side_context(self):
+        """测试对话管理器按会话ID读取上下文并保存本轮消息"""
+        with patch('ai_core.conversation_contexts', self.cache), \
+                patch('ai_core.SessionLocal', self.Session), \
+                patch('ai_core.entity_indexes', EntityIndexRegistry()):
+            manager = DialogueManager(1, model=LocalStreamingModel(token_delay_ms=0))
+            response = manager.generate_response('今天想起了外婆', conversation_id=1)
+            
+            self.assertIn('消息9', manager.last_prompt_report['prompt'])
+            self.assertEqual(self.cache.get(1)[-2:], [
+                {'role': 'user', 'content': '今天想起了外婆'},
+                {'role': 'assistant', 'content': response}
+            ])
+    
+    def test_rejects_other_users_conversation(self):
+        """测试读取或写入其他用户的会话时拒绝, 且不写入任何消息"""
+        with self.assertRaises(ConversationAccessError):
+            self.cache.get(1, user_id=2)
+        with self.assertRaises(ConversationAccessError):
+            self.cache.append(1, [{'role': 'user', 'content': '越权消息'}], user_id=2)
+        with self.assertRaises(ConversationAccessError):
+            self.cache.append(99, [{'role': 'user', 'content': '不存在的会话'}], user_id=1)
+        
+        session = self.Session()
+        self.assertEqual(session.query(Message).count(), 10)
+        session.close()
+        
+        # 归属校验通过后缓存所属用户, 再次校验不访问数据库
+        self.cache.get(1, user_id=1)
+        queries = self.queries
+        self.cache.get(1, user_id=1)
+        self.assertEqual(self.queries, queries)
+    
+    def test_dialogue_rejects_foreign_conversation(self):
+        """测试对话管理器拒绝其他用户的会话ID, 即使客户端自带历史"""
+        with patch('ai_core.conversation_contexts', self.cache), \
+                patch('ai_core.SessionLocal', self.Session), \
+                patch('ai_core.entity_indexes', EntityIndexRegistry()):
+            manager = DialogueManager(1, model=LocalStreamingModel(token_delay_ms=0))
+            with self.assertRaises(ConversationAccessError):
+                manager.generate_response('你好', [], conversation_id=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
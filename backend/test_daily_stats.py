@@ -0,0 +1,210 @@
+"""
+按天统计汇总的单元测试
+"""
+
+import unittest
+from datetime import date, datetime
+from unittest.mock import patch
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base, Conversation, DailyUserStats, Message, User
+from daily_stats import catch_up, load_daily_stats, rebuild_daily_stats
+from migrations import migrate
+from review_aggregator import DataAggregator, TimeRangeCalculator
+from review_analyzer import EmotionAnalyzer, TopicExtractor
+from ai_core import ChromaCollection
+
+
+MESSAGES = [
+    # (对话序号, 时间, 角色, 内容)
+    (0, datetime(2024, 3, 1, 9), 'user', '今天和妈妈一起做饭很开心'),
+    (0, datetime(2024, 3, 1, 9, 1), 'assistant', '听起来很温暖'),
+    (0, datetime(2024, 3, 1, 21), 'user', '工作压力有点大, 很焦虑'),
+    (1, datetime(2024, 3, 5, 8), 'user', '和朋友去旅行, 感觉幸福又感动'),
+    (1, datetime(2024, 3, 5, 8, 2), 'assistant', '真好'),
+    (1, datetime(2024, 3, 9, 23), 'user', '普通的一天'),
+    (2, datetime(2024, 4, 2, 10), 'user', '四月的消息不在三月的回顾里'),
+]
+
+
+class DailyStatsTestCase(unittest.TestCase):
+    """使用内存SQLite数据库的测试基类"""
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(bind=self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+
+    def write_messages(self):
+        session = self.Session()
+        user = User(username='daily', email='daily@example.com')
+        session.add(user)
+        session.flush()
+        user_id = user.id
+        conversations = [
+            Conversation(user_id=user_id, title=f'对话{i}', created_at=created_at)
+            for i, created_at in enumerate([datetime(2024, 3, 1), datetime(2024, 3, 5), datetime(2024, 4, 2)])
+        ]
+        session.add_all(conversations)
+        session.flush()
+        for index, timestamp, role, content in MESSAGES:
+            session.add(Message(conversation_id=conversations[index].id, timestamp=timestamp, role=role, content=content))
+            # 逐条flush, 模拟每轮对话分别写入
+            session.flush()
+        session.commit()
+        session.close()
+        return user_id
+
+    def stats_rows(self):
+        session = self.Session()
+        try:
+            return {row.day: row for row in session.execute(select(DailyUserStats)).scalars()}
+        finally:
+            session.close()
+
+
+class TestIncrementalUpdate(DailyStatsTestCase):
+    """测试写入消息时同步更新汇总"""
+
+    def test_rows_follow_message_writes(self):
+        self.write_messages()
+
+        rows = self.stats_rows()
+        self.assertEqual(sorted(rows), [date(2024, 3, 1), date(2024, 3, 5), date(2024, 3, 9), date(2024, 4, 2)])
+
+        first = rows[date(2024, 3, 1)]
+        self.assertEqual((first.user_messages, first.assistant_messages, first.conversations), (2, 1, 1))
+        self.assertEqual((first.positive_messages, first.negative_messages), (1, 1))
+        self.assertAlmostEqual(first.sentiment_sum, 0.0)
+        self.assertEqual(first.topic_counts, {'家庭关系': 1, '职业发展': 1})
+        self.assertTrue(first.active)
+
+    def test_deletes_and_edits_are_retracted(self):
+        self.write_messages()
+        session = self.Session()
+        anxious = session.query(Message).filter(Message.content.contains('焦虑')).one()
+        session.delete(anxious)
+        happy = session.query(Message).filter(Message.content.contains('做饭')).one()
+        happy.content = '今天一个人在家'
+        session.commit()
+        session.close()
+
+        first = self.stats_rows()[date(2024, 3, 1)]
+        self.assertEqual((first.user_messages, first.assistant_messages), (1, 1))
+        self.assertEqual((first.positive_messages, first.neutral_messages, first.negative_messages), (0, 1, 0))
+        self.assertEqual(first.topic_counts, {})
+
+        incremental = {day: (row.user_messages, row.sentiment_sum, row.topic_counts) for day, row in self.stats_rows().items()}
+        with self.engine.begin() as connection:
+            rebuild_daily_stats(connection)
+        rebuilt = {day: (row.user_messages, row.sentiment_sum, row.topic_counts) for day, row in self.stats_rows().items()}
+        self.assertEqual(rebuilt, incremental)
+
+    def test_disabled_on_write(self):
+        with patch('daily_stats.DAILY_STATS_ON_WRITE', False):
+            self.write_messages()
+        self.assertEqual(self.stats_rows(), {})
+
+
+class TestRebuild(DailyStatsTestCase):
+    """测试追赶任务和迁移回填"""
+
+    def test_rebuild_matches_incremental(self):
+        self.write_messages()
+        incremental = {day: (row.user_messages, row.conversations, row.topic_counts) for day, row in self.stats_rows().items()}
+
+        with self.engine.begin() as connection:
+            self.assertEqual(rebuild_daily_stats(connection), 4)
+        with self.engine.begin() as connection:
+            rebuild_daily_stats(connection)
+
+        rebuilt = {day: (row.user_messages, row.conversations, row.topic_counts) for day, row in self.stats_rows().items()}
+        self.assertEqual(rebuilt, incremental)
+
+    def test_catch_up_only_touches_recent_days(self):
+        with patch('daily_stats.DAILY_STATS_ON_WRITE', False):
+            self.write_messages()
+
+        catch_up(days=2, bind=self.engine, today=date(2024, 3, 5))
+
+        self.assertEqual(sorted(self.stats_rows()), [date(2024, 3, 5)])
+
+    def test_migration_backfills_existing_messages(self):
+        with patch('daily_stats.DAILY_STATS_ON_WRITE', False):
+            self.write_messages()
+
+        migrate(self.engine)
+
+        self.assertEqual(len(self.stats_rows()), 4)
+
+
+class TestReviewFromRollup(DailyStatsTestCase):
+    """测试回顾的统计、情感时间线和主题由汇总得到, 且与逐条分析的结果一致"""
+
+    def test_matches_raw_message_analysis(self):
+        user_id = self.write_messages()
+        start, end = TimeRangeCalculator.get_monthly_range(2024, 3)
+        session = self.Session()
+        self.addCleanup(session.close)
+
+        aggregator = DataAggregator(session, vector_collection=ChromaCollection(dim=3))
+        data = aggregator.aggregate_review_data(user_id, start, end)
+
+        self.assertEqual(len(data['daily_stats']), 3)
+        self.assertEqual(data['statistics'], aggregator._calculate_basic_statistics(
+            data['conversations'], data['messages'], data['structured_memories'], data['vector_memories']
+        ))
+        self.assertEqual(data['statistics']['total_messages'], 6)
+        self.assertEqual(data['statistics']['active_days'], 3)
+
+        emotion = EmotionAnalyzer()
+        self.assertEqual(
+            emotion.analyze_emotion([], data['daily_stats']),
+            emotion.analyze_emotion(data['messages'])
+        )
+        topics = TopicExtractor()
+        self.assertEqual(topics.extract_topics([], data['daily_stats']), topics.extract_topics(data['messages']))
+
+    def test_falls_back_when_rollup_is_stale(self):
+        user_id = self.write_messages()
+        start, end = TimeRangeCalculator.get_monthly_range(2024, 3)
+        session = self.Session()
+        self.addCleanup(session.close)
+        # 批量删除不经过after_flush钩子, 汇总仍计入被删除的消息
+        session.query(Message).filter(Message.content.contains('焦虑')).delete(synchronize_session=False)
+        session.commit()
+
+        aggregator = DataAggregator(session, vector_collection=ChromaCollection(dim=3))
+        data = aggregator.aggregate_review_data(user_id, start, end)
+
+        self.assertIsNone(data['daily_stats'])
+        self.assertEqual(data['statistics']['total_messages'], 5)
+        self.assertEqual(data['statistics']['user_messages'], 3)
+
+    def test_falls_back_without_rollup(self):
+        with patch('daily_stats.DAILY_STATS_ON_WRITE', False):
+            user_id = self.write_messages()
+        start, end = TimeRangeCalculator.get_monthly_range(2024, 3)
+        session = self.Session()
+        self.addCleanup(session.close)
+
+        data = DataAggregator(session, vector_collection=ChromaCollection(dim=3)).aggregate_review_data(user_id, start, end)
+
+        self.assertIsNone(data['daily_stats'])
+        self.assertEqual(data['statistics']['total_messages'], 6)
+        self.assertEqual(data['statistics']['active_days'], 3)
+
+    def test_load_daily_stats_range(self):
+        user_id = self.write_messages()
+        session = self.Session()
+        self.addCleanup(session.close)
+
+        rows = load_daily_stats(session, user_id, date(2024, 3, 2), date(2024, 3, 31))
+
+        self.assertEqual([row['date'] for row in rows], ['2024-03-05', '2024-03-09'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+数据库连接池配置与统计的单元测试
+"""
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import sessionmaker
+from fastapi.testclient import TestClient
+import database
+from database import InstrumentedQueuePool, create_db_engine, engine_options, pool_stats, session_scope
+from review_api import ReviewAPI
+import main
+
+
+class TestEngineOptions(unittest.TestCase):
+    """测试按连接串生成的连接池参数"""
+
+    def test_server_database_gets_pool_settings(self):
+        """测试服务端数据库使用环境变量配置的连接池, 并开启探活和回收"""
+        engine = create_db_engine('postgresql://localhost/echoes_test')
+        self.addCleanup(engine.dispose)
+
+        self.assertIsInstance(engine.pool, InstrumentedQueuePool)
+        self.assertEqual(engine.pool.size(), database.DB_POOL_SIZE)
+        self.assertEqual(engine.pool._max_overflow, database.DB_MAX_OVERFLOW)
+        self.assertEqual(engine.pool._recycle, database.DB_POOL_RECYCLE)
+        self.assertEqual(engine.pool._pre_ping, database.DB_POOL_PRE_PING)
+
+    def test_sqlite_keeps_driver_pool(self):
+        """测试SQLite不设置池大小参数"""
+        self.assertNotIn('pool_size', engine_options('sqlite://'))
+        self.assertNotIn('pool_size', engine_options('sqlite+aiosqlite:///memory.db'))
+
+
+class TestPoolStats(unittest.TestCase):
+    """测试连接池统计"""
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.engine = create_engine(
+            f'sqlite:///{path}', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=1, pool_timeout=0.05
+        )
+        self.addCleanup(self.engine.dispose)
+
+    def test_checked_out_overflow_and_timeouts(self):
+        """测试借出、溢出连接数以及等待超时的统计"""
+        first = self.engine.connect()
+        second = self.engine.connect()
+
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats['checked_out'], 2)
+        self.assertEqual(stats['overflow'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+
+        with self.assertRaises(PoolTimeoutError):
+            self.engine.connect()
+
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertGreaterEqual(stats['max_wait_ms'], 50)
+
+        first.close()
+        second.close()
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(stats['checked_in'], 1)
+
+    def test_session_scope_returns_connection(self):
+        """测试session_scope在出错时回滚并归还连接"""
+        factory = sessionmaker(bind=self.engine)
+
+        with self.assertRaises(RuntimeError):
+            with session_scope(factory) as session:
+                session.execute(text('SELECT 1'))
+                self.assertEqual(pool_stats(self.engine)['checked_out'], 1)
+                raise RuntimeError('失败')
+
+        self.assertEqual(pool_stats(self.engine)['checked_out'], 0)
+
+
+class TestReviewAPISessions(unittest.TestCase):
+    """测试回顾接口通过session_scope使用会话"""
+
+    def test_sessions_are_released_after_requests(self):
+        engine = create_engine(
+            'sqlite://', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05
+        )
+        self.addCleanup(engine.dispose)
+        database.Base.metadata.create_all(bind=engine)
+
+        with patch('database.SessionLocal', sessionmaker(bind=engine)):
+            api = ReviewAPI()
+            # 池中只有一个连接, 会话未归还时第二次请求会等待超时
+            for _ in range(3):
+                result, status = api.list_reviews({}, user_id=1)
+                self.assertEqual(status, 200, result)
+            result, status = api.get_review(404, user_id=1)
+            self.assertEqual(status, 404)
+
+        self.assertEqual(pool_stats(engine)['checked_out'], 0)
+        self.assertEqual(pool_stats(engine)['timeouts'], 0)
+
+    def test_pool_metrics_endpoint(self):
+        response = TestClient(main.app).get('/metrics/db-pool')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pool', response.json())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+文本向量化与缓存的单元测试
+"""
+
+import os
+import unittest
+import tempfile
+import numpy as np
+from embedding import EmbeddingProvider, HashingEmbedder, EmbeddingCache, CachedEmbedder
+
+
+class CountingEmbedder(EmbeddingProvider):
+    """记录调用次数的向量化服务"""
+    
+    name = 'counting'
+    dim = 4
+    
+    def __init__(self):
+        self.embedded = []
+    
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return np.ones((len(texts), self.dim), dtype=np.float32)
+
+
+class TestHashingEmbedder(unittest.TestCase):
+    """测试本地哈希向量化"""
+    
+    def setUp(self):
+        self.embedder = HashingEmbedder(dim=256)
+    
+    def test_deterministic_and_normalized(self):
+        """测试结果确定且已归一化"""
+        first = self.embedder.embed(['今天和外婆一起包饺子'])
+        second = self.embedder.embed(['今天和外婆一起包饺子'])
+        
+        np.testing.assert_array_equal(first, second)
+        self.assertAlmostEqual(float(np.linalg.norm(first[0])), 1.0, places=5)
+    
+    def test_similar_texts_score_higher(self):
+        """测试字面相近的文本相似度更高"""
+        query, related, unrelated = self.embedder.embed(['外婆做的饺子', '外婆包的饺子很好吃', '公司项目上线'])
+        
+        self.assertGreater(float(query @ related), float(query @ unrelated))
+    
+    def test_empty_text(self):
+        """测试空文本返回零向量"""
+        result = self.embedder.embed([''])
+        
+        self.assertEqual(result.shape, (1, 256))
+        self.assertEqual(float(np.abs(result).sum()), 0.0)
+
+
+class TestCachedEmbedder(unittest.TestCase):
+    """测试带缓存的向量化服务"""
+    
+    def test_memory_cache_hits(self):
+        """测试重复文本只向量化一次"""
+        provider = CountingEmbedder()
+        embedder = CachedEmbedder(provider)
+        
+        embedder.embed(['a', 'b', 'a'])
+        embedder.embed(['a'])
+        
+        self.assertEqual(provider.embedded, ['a', 'b'])
+        stats = embedder.stats()
+        self.assertEqual(stats['memory_hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+    
+    def test_disk_cache_survives_restart(self):
+        """测试磁盘缓存在新进程中仍可命中, 缓存文件所在的目录不存在时自动创建"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'data', 'embeddings.db')
+            CachedEmbedder(CountingEmbedder(), EmbeddingCache(path=path)).embed(['外婆'])
+            
+            provider = CountingEmbedder()
+            embedder = CachedEmbedder(provider, EmbeddingCache(path=path))
+            result = embedder.embed(['外婆'])
+            
+            self.assertEqual(provider.embedded, [])
+            self.assertEqual(embedder.stats()['disk_hits'], 1)
+            self.assertEqual(result.shape, (1, 4))
+    
+    def test_lru_eviction(self):
+        """测试两级缓存按容量淘汰最久未使用的条目"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = EmbeddingCache(
+                max_memory_entries=2,
+                path=os.path.join(tmp_dir, 'embeddings.db'),
+                max_disk_entries=2
+            )
+            provider = CountingEmbedder()
+            embedder = CachedEmbedder(provider, cache)
+            
+            embedder.embed(['a'])
+            embedder.embed(['b'])
+            embedder.embed(['c'])
+            
+            self.assertEqual(cache.stats()['memory_entries'], 2)
+            embedder.embed(['a'])
+            self.assertEqual(provider.embedded, ['a', 'b', 'c', 'a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+向量化微批处理的单元测试
+"""
+
+import asyncio
+import unittest
+import numpy as np
+from embedding import EmbeddingProvider
+from embedding_batcher import EmbeddingBatcher, QueueFullError
+
+
+class RecordingEmbedder(EmbeddingProvider):
+    """记录每次批量调用的向量化服务"""
+    
+    name = 'recording'
+    dim = 2
+    
+    def __init__(self):
+        self.batches = []
+    
+    def embed(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[len(text), 1] for text in texts], dtype=np.float32)
+
+
+class TestEmbeddingBatcher(unittest.TestCase):
+    """测试向量化微批处理器"""
+    
+    def test_concurrent_requests_coalesce(self):
+        """测试并发请求合并为一次调用且结果按调用方分发"""
+        provider = RecordingEmbedder()
+        batcher = EmbeddingBatcher(provider, max_batch_size=8, max_wait_ms=50)
+        
+        async def run():
+            results = await asyncio.gather(*(batcher.embed('x' * n) for n in range(1, 6)))
+            await batcher.stop()
+            return results
+        
+        results = asyncio.run(run())
+        
+        self.assertEqual(len(provider.batches), 1)
+        self.assertEqual([int(vector[0]) for vector in results], [1, 2, 3, 4, 5])
+        self.assertEqual(batcher.metrics.snapshot()['batch_size_histogram'], {5: 1})
+    
+    def test_max_batch_size(self):
+        """测试批大小不超过上限"""
+        provider = RecordingEmbedder()
+        batcher = EmbeddingBatcher(provider, max_batch_size=2, max_wait_ms=50)
+        
+        async def run():
+            await batcher.embed_many(['a', 'b', 'c', 'd', 'e'])
+            await batcher.stop()
+        
+        asyncio.run(run())
+        
+        self.assertTrue(all(len(batch) <= 2 for batch in provider.batches))
+        self.assertEqual(sum(len(batch) for batch in provider.batches), 5)
+    
+    def test_queue_full_rejects(self):
+        """测试队列已满时不等待的请求被拒绝"""
+        batcher = EmbeddingBatcher(RecordingEmbedder(), max_batch_size=1, max_queue_size=1)
+        
+        async def run():
+            await batcher.start()
+            # 在批处理任务取走之前塞满队列
+            first = asyncio.ensure_future(batcher.embed('a', wait=False))
+            await asyncio.sleep(0)
+            with self.assertRaises(QueueFullError):
+                await batcher.embed('b', wait=False)
+            await first
+            await batcher.stop()
+        
+        asyncio.run(run())
+        
+        self.assertEqual(batcher.metrics.rejected, 1)
+    
+    def test_errors_propagate(self):
+        """测试底层服务异常传递给所有调用方"""
+        class FailingEmbedder(RecordingEmbedder):
+            def embed(self, texts):
+                raise RuntimeError('服务不可用')
+        
+        batcher = EmbeddingBatcher(FailingEmbedder(), max_wait_ms=5)
+        
+        async def run():
+            with self.assertRaises(RuntimeError):
+                await batcher.embed('a')
+            await batcher.stop()
+        
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
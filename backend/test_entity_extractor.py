@@ -0,0 +1,91 @@
+"""
+实体抽取的单元测试
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from entity_extractor import AhoCorasickAutomaton, EntityExtractor
+
+
+class TestAhoCorasickAutomaton(unittest.TestCase):
+    """测试多模式匹配自动机"""
+    
+    def test_overlapping_matches(self):
+        """测试失败指针能找到后缀和重叠的词条"""
+        automaton = AhoCorasickAutomaton(['he', 'she', 'his', 'hers'])
+        matches = {(start, end, automaton.patterns[i]) for start, end, i in automaton.iter_matches('ushers')}
+        
+        self.assertEqual(matches, {(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')})
+    
+    def test_matches_brute_force(self):
+        """测试与逐个词条查找的结果一致"""
+        patterns = ['外婆', '外孙', '孙女', '外孙女', '婆婆', '婆']
+        text = '外婆的外孙女叫婆婆外婆'
+        automaton = AhoCorasickAutomaton(patterns)
+        
+        found = sorted((s, e, automaton.patterns[i]) for s, e, i in automaton.iter_matches(text))
+        expected = sorted(
+            (i, i + len(p), p) for p in patterns for i in range(len(text)) if text.startswith(p, i)
+        )
+        self.assertEqual(found, expected)
+
+
+class TestEntityExtractor(unittest.TestCase):
+    """测试词典实体抽取"""
+    
+    def setUp(self):
+        self.extractor = EntityExtractor()
+    
+    def test_offsets_and_types(self):
+        """测试返回每次出现的位置和类型"""
+        text = '妈妈在北京大学工作。后来妈妈去了上海'
+        entities = self.extractor.extract(text)
+        
+        self.assertEqual(
+            [(e['type'], e['name']) for e in entities],
+            [('family_member', '妈妈'), ('school', '北京大学'), ('family_member', '妈妈'), ('place', '上海')]
+        )
+        for entity in entities:
+            self.assertEqual(text[entity['start']:entity['end']], entity['name'])
+    
+    def test_longest_match_wins(self):
+        """测试默认取最长匹配, 需要时可保留重叠匹配"""
+        names = [e['name'] for e in self.extractor.extract('北京大学')]
+        self.assertEqual(names, ['北京大学'])
+        
+        names = [e['name'] for e in self.extractor.extract('北京大学', overlapping=True)]
+        self.assertEqual(names, ['北京大学', '北京', '大学'])
+    
+    def test_sentence_context(self):
+        """测试上下文是匹配所在的句子"""
+        text = '今天天气很好。外婆给我讲了她小时候的故事！我们一起去了公园'
+        entity = self.extractor.extract(text)[0]
+        
+        self.assertEqual(entity['context'], '外婆给我讲了她小时候的故事！')
+    
+    def test_long_sentence_context_centered(self):
+        """测试过长的句子截取以匹配为中心的窗口"""
+        extractor = EntityExtractor(max_context=10)
+        text = '很' * 50 + '外婆' + '好' * 50
+        entity = extractor.extract(text)[0]
+        
+        self.assertEqual(len(entity['context']), 10)
+        self.assertIn('外婆', entity['context'])
+    
+    def test_lexicon_file(self):
+        """测试合并词典文件中的词条"""
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8') as f:
+            json.dump({'employer': ['红星机械厂'], 'place': ['黄山']}, f, ensure_ascii=False)
+        self.addCleanup(os.remove, f.name)
+        
+        extractor = EntityExtractor.from_file(f.name)
+        entities = extractor.extract('爸爸在红星机械厂上班, 周末去黄山')
+        
+        self.assertEqual([e['name'] for e in entities], ['爸爸', '红星机械厂', '黄山'])
+        self.assertEqual(extractor.lexicon_size, EntityExtractor().lexicon_size + 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
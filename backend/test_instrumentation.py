@@ -0,0 +1,184 @@
+"""
+对话耗时埋点的单元测试
+"""
+
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from ai_core import AsyncDialogueManager, DialogueManager, LocalStreamingModel
+from entity_graph import EntityIndexRegistry
+from instrumentation import LatencyHistogram, TurnInstrumentation, activate, span
+import main
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    """测试延迟直方图"""
+
+    def test_buckets_and_quantiles(self):
+        """测试分桶计数和分位数"""
+        histogram = LatencyHistogram(buckets_ms=(10, 100))
+        for milliseconds in range(1, 101):
+            histogram.observe(float(milliseconds))
+        histogram.observe(500.0)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 101)
+        self.assertEqual(snapshot['buckets'], {'le_10': 10, 'le_100': 90, 'le_inf': 1})
+        self.assertEqual(snapshot['max_ms'], 500.0)
+        self.assertAlmostEqual(snapshot['p50_ms'], 51.0)
+        self.assertEqual(snapshot['p99_ms'], 100.0)
+
+    def test_empty_histogram(self):
+        """测试没有样本时分位数为0"""
+        snapshot = LatencyHistogram().snapshot()
+        self.assertEqual(snapshot['count'], 0)
+        self.assertEqual(snapshot['p99_ms'], 0.0)
+
+
+class TestTurnInstrumentation(unittest.TestCase):
+    """测试阶段计时和慢对话记录"""
+
+    def test_span_without_active_turn_is_noop(self):
+        """测试没有进行中的对话时span不报错也不记录"""
+        metrics = TurnInstrumentation()
+        with span('embedding'):
+            pass
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_turn_records_stage_histograms(self):
+        """测试一轮对话的各阶段分别计入直方图, 同名阶段累加"""
+        metrics = TurnInstrumentation(slow_turn_ms=10000)
+        with metrics.turn() as trace:
+            with span('embedding'):
+                time.sleep(0.001)
+            with span('embedding'):
+                time.sleep(0.001)
+            with span('generation'):
+                pass
+            # 直接累加一段确定的耗时, 不依赖sleep的精度
+            trace.add('generation', 1.0)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(set(snapshot), {'embedding', 'generation', 'turn'})
+        self.assertEqual(snapshot['embedding']['count'], 1)
+        self.assertGreaterEqual(trace.spans['embedding'], 0.002)
+        self.assertGreaterEqual(snapshot['generation']['p99_ms'], 1000.0)
+        self.assertEqual(metrics.dominant_stage(0.99), 'generation')
+        self.assertEqual(metrics.slow_turns(), [])
+
+    def test_dominant_stage_uses_self_time(self):
+        """测试父阶段扣除子阶段后计算独占耗时, 主导阶段是真正耗时的子阶段"""
+        metrics = TurnInstrumentation(slow_turn_ms=10000)
+        with metrics.turn() as trace:
+            with span('retrieval'):
+                with span('embedding'):
+                    time.sleep(0.02)
+                with span('vector_search'):
+                    time.sleep(0.005)
+
+        self.assertGreaterEqual(trace.spans['retrieval'], trace.spans['embedding'] + trace.spans['vector_search'])
+        self.assertLess(trace.self_spans['retrieval'], trace.self_spans['embedding'])
+        self.assertEqual(trace.self_spans['embedding'], trace.spans['embedding'])
+        self.assertEqual(metrics.dominant_stage(0.99), 'embedding')
+
+    def test_slow_turn_logged_with_breakdown(self):
+        """测试超过阈值的对话连同阶段明细写入日志"""
+        metrics = TurnInstrumentation(slow_turn_ms=0)
+        with self.assertLogs('instrumentation', level='WARNING') as logs:
+            with metrics.turn(user_id=7):
+                with span('vector_search'):
+                    pass
+
+        slow = metrics.slow_turns()
+        self.assertEqual(len(slow), 1)
+        self.assertIn('vector_search', slow[0]['stages'])
+        self.assertEqual(slow[0]['labels'], {'user_id': 7})
+        self.assertIn('vector_search', logs.output[0])
+
+    def test_trace_follows_executor_threads(self):
+        """测试线程池中执行的阶段也计入本轮"""
+        import instrumentation
+        metrics = TurnInstrumentation()
+        trace = metrics.start()
+
+        def work():
+            with span('retrieval'):
+                return 1
+
+        async def run():
+            with activate(trace):
+                return await instrumentation.run_in_executor(asyncio.get_running_loop(), work)
+
+        self.assertEqual(asyncio.run(run()), 1)
+        self.assertIn('retrieval', trace.spans)
+
+
+class TestDialogueInstrumentation(unittest.TestCase):
+    """测试对话管理器的阶段埋点"""
+
+    STAGES = {'retrieval', 'embedding', 'vector_search', 'prompt_build', 'generation', 'entity_extraction', 'persistence'}
+
+    def setUp(self):
+        engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        self.addCleanup(engine.dispose)
+
+        self.metrics = TurnInstrumentation(slow_turn_ms=10000)
+        for target, value in [
+            ('ai_core.SessionLocal', sessionmaker(bind=engine)),
+            ('ai_core.STREAM_TOKEN_DELAY_MS', 0),
+            ('ai_core.turn_metrics', self.metrics),
+            ('main.turn_metrics', self.metrics),
+            ('ai_core.entity_indexes', EntityIndexRegistry()),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_generate_response_records_stages(self):
+        """测试同步生成记录检索、向量化、构建、生成、抽取和写库各阶段"""
+        # 使用不会命中检索缓存的输入, 保证走到向量化和向量检索
+        DialogueManager(8101).generate_response('外婆家门口的老槐树 instrumentation-sync', [])
+
+        snapshot = self.metrics.snapshot()
+        self.assertTrue(self.STAGES <= set(snapshot), snapshot.keys())
+        self.assertEqual(snapshot['turn']['count'], 1)
+
+    def test_stream_and_async_manager_record_stages(self):
+        """测试流式和异步对话管理器同样记录各阶段"""
+        model = LocalStreamingModel(token_delay_ms=0)
+
+        async def run():
+            manager = DialogueManager(8102, model=model)
+            [token async for token in manager.stream_response('我想起了外婆 instrumentation-stream', [])]
+            await AsyncDialogueManager(8103, model=model).agenerate_response('我想起了外婆 instrumentation-async', [])
+
+        asyncio.run(run())
+
+        snapshot = self.metrics.snapshot()
+        self.assertTrue(self.STAGES <= set(snapshot), snapshot.keys())
+        self.assertEqual(snapshot['turn']['count'], 2)
+        self.assertEqual(snapshot['generation']['count'], 2)
+
+    def test_latency_endpoint(self):
+        """测试延迟指标接口"""
+        DialogueManager(8104).generate_response('小时候的学校 instrumentation-endpoint', [])
+
+        response = TestClient(main.app).get('/metrics/latency')
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertIn('generation', body['stages'])
+        self.assertIn('p99_ms', body['stages']['turn'])
+        self.assertIn(body['p99_dominant_stage'], self.STAGES)
+        self.assertEqual(body['slow_turns'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+词法检索的单元测试
+"""
+
+import unittest
+import numpy as np
+from lexical_index import tokenize, NgramInvertedIndex, reciprocal_rank_fusion
+
+
+class TestTokenize(unittest.TestCase):
+    """测试词项切分"""
+    
+    def test_chinese_ngrams(self):
+        """测试中文切分为二元和三元组"""
+        self.assertEqual(tokenize('外婆家'), ['外婆', '婆家', '外婆家'])
+    
+    def test_mixed_text(self):
+        """测试中英文混合文本"""
+        self.assertEqual(tokenize('去Beijing看外婆'), ['去', 'beijing', '看外', '外婆', '看外婆'])
+
+
+class TestNgramInvertedIndex(unittest.TestCase):
+    """测试n-gram倒排索引"""
+    
+    def setUp(self):
+        self.index = NgramInvertedIndex()
+        documents = [
+            '今天在公司加班到很晚',
+            '小时候外婆教我织毛衣',
+            '周末去公园散步',
+            '外婆做的红烧肉最好吃,外婆总是笑着看我们吃'
+        ]
+        for row, document in enumerate(documents):
+            self.index.add(row, document)
+    
+    def test_exact_name_match(self):
+        """测试精确的人名能被检索到"""
+        rows, scores = self.index.search('外婆', k=5)
+        
+        self.assertEqual(sorted(rows.tolist()), [1, 3])
+        self.assertTrue(np.all(scores > 0))
+    
+    def test_term_frequency_ranking(self):
+        """测试词频更高的文档排在前面"""
+        rows, _ = self.index.search('外婆', k=1)
+        
+        self.assertEqual(rows.tolist(), [3])
+    
+    def test_restricted_rows(self):
+        """测试只在候选行中打分"""
+        rows, _ = self.index.search('外婆', k=5, rows=np.array([0, 1]))
+        
+        self.assertEqual(rows.tolist(), [1])
+    
+    def test_no_match(self):
+        """测试没有命中时返回空结果"""
+        rows, _ = self.index.search('火星', k=5)
+        
+        self.assertEqual(len(rows), 0)
+
+
+class TestReciprocalRankFusion(unittest.TestCase):
+    """测试倒数排名融合"""
+    
+    def test_items_in_both_rankings_win(self):
+        """测试两路都靠前的条目融合后排第一"""
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'd']])
+        
+        self.assertEqual(fused[0][0], 'b')
+        self.assertEqual({item for item, _ in fused}, {'a', 'b', 'c', 'd'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+记忆整理任务的单元测试
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+import numpy as np
+from ai_core import ChromaCollection
+from embedding import HashingEmbedder
+from memory_consolidation import ConsolidationJob, RateLimiter, find_duplicate_groups, memory_importance
+
+
+class TestConsolidationJob(unittest.TestCase):
+    """测试重复合并、久远记忆汇总与断点续跑"""
+    
+    def setUp(self):
+        self.embedder = HashingEmbedder(dim=64)
+        self.collection = ChromaCollection(dim=64)
+        self.now = datetime(2024, 12, 1)
+        
+        self._add(1, [
+            ('我小时候每年暑假都去外婆家，外婆会做红烧肉给我吃，那是我最喜欢的味道。', '2024-11-01T10:00:00'),
+            ('我小时候每年暑假都去外婆家，外婆会做红烧肉给我吃，那是我最喜欢的味道', '2024-11-20T10:00:00'),
+            ('今天和同事开会讨论了新项目的排期，大家意见不太一致，会议开了很久。', '2024-11-21T10:00:00'),
+            ('下雨了', '2023-03-02T10:00:00'),
+            ('吃了面条', '2023-03-15T10:00:00'),
+        ])
+        self._add(2, [('旅行日记：第一次去海边看日出', '2024-10-01T10:00:00')])
+        self.sleeps = []
+    
+    def _add(self, user_id, items):
+        documents = [document for document, _ in items]
+        return self.collection.add_memories(
+            user_id,
+            documents,
+            self.embedder.embed(documents),
+            [{'user_id': user_id, 'timestamp': timestamp} for _, timestamp in items]
+        )
+    
+    def _job(self, **kwargs):
+        return ConsolidationJob(self.collection, self.embedder.embed, sleep=self.sleeps.append, **kwargs)
+    
+    def test_find_duplicate_groups(self):
+        """测试只把近似重复的记忆分为一组"""
+        groups = find_duplicate_groups(self.collection.partition(1), threshold=0.9)
+        self.assertEqual(groups, [[0, 1]])
+    
+    def test_duplicate_groups_do_not_chain(self):
+        """测试A与B、B与C相似而A与C不相似时, C不会因为B被并入A的组"""
+        collection = ChromaCollection(dim=3)
+        angles = np.radians([0, 20, 40])
+        collection.add_memories(
+            1,
+            ['外婆家的院子里种满了花', '外婆家的院子', '院子'],
+            [[np.cos(angle), np.sin(angle), 0] for angle in angles],
+            [{'user_id': 1}] * 3
+        )
+        
+        self.assertEqual(find_duplicate_groups(collection.partition(1), threshold=0.9), [[0, 1]])
+    
+    def test_consolidate_user(self):
+        """测试合并重复、汇总久远记忆并回收空间"""
+        report = self._job().consolidate_user(1, self.now)
+        
+        self.assertEqual(report['duplicates_merged'], 1)
+        self.assertEqual(report['memories_summarized'], 2)
+        self.assertEqual(report['summaries_created'], 1)
+        self.assertGreater(report['bytes_reclaimed'], 0)
+        
+        memories = self.collection.get(where={'user_id': 1})
+        self.assertEqual(len(memories['ids']), 3)
+        
+        merged = next(m for m in memories['metadatas'] if 'merged_from' in m)
+        self.assertEqual(merged['merged_from'], ['1_0', '1_1'])
+        self.assertEqual([entry['id'] for entry in merged['archived_documents']], ['1_1'])
+        self.assertEqual(merged['mention_count'], 2)
+        self.assertEqual(merged['timestamp'], '2024-11-01T10:00:00')
+        self.assertEqual(merged['last_mentioned'], '2024-11-20T10:00:00')
+        
+        summary = next(d for d in memories['documents'] if d.startswith('2023年3月'))
+        self.assertIn('下雨了', summary)
+        self.assertIn('吃了面条', summary)
+    
+    def test_truncated_summary_archives_originals(self):
+        """测试摘要原文被截断时, 被汇总的记忆原文完整保存在存档中"""
+        self._job(max_summary_chars=12).consolidate_user(1, self.now)
+        
+        memories = self.collection.get(where={'user_id': 1, 'type': 'summary'})
+        self.assertEqual(len(memories['documents'][0]), 12)
+        archived = memories['metadatas'][0]['archived_documents']
+        self.assertEqual([entry['document'] for entry in archived], ['下雨了', '吃了面条'])
+        
+        # 新记忆的ID不会与已删除的记忆重复
+        self.assertNotIn('1_0', memories['ids'])
+        self.assertEqual(self._add(1, [('新的一天', '2024-12-01T10:00:00')]), ['1_7'])
+    
+    def test_resumable_with_checkpoint(self):
+        """测试中断后从断点继续, 全部完成后清除断点, 并按速率限流"""
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'checkpoint.json')
+            
+            first = self._job(checkpoint_path=checkpoint, users_per_second=1000).run(max_users=1, now=self.now)
+            self.assertEqual(first['users_processed'], 1)
+            self.assertFalse(first['finished'])
+            self.assertTrue(os.path.exists(checkpoint))
+            
+            second = self._job(checkpoint_path=checkpoint, users_per_second=1000).run(now=self.now)
+            self.assertEqual(second['users_skipped'], 1)
+            self.assertEqual(second['users_processed'], 1)
+            self.assertTrue(second['finished'])
+            self.assertFalse(os.path.exists(checkpoint))
+    
+    def test_queries_during_consolidation(self):
+        """测试整理 (删除和压缩) 与其他线程的检索并发执行时, 检索不会读到错位的行号"""
+        documents = [f'第{i % 20}段回忆' for i in range(100)]
+        query = self.embedder.embed(['第3段回忆'])
+        errors = []
+        stop = threading.Event()
+        
+        def search():
+            while not stop.is_set():
+                try:
+                    self.collection.query(query_embeddings=query, n_results=5, where={'user_id': 3}, query_texts=['第3段回忆'])
+                    self.collection.get(where={'user_id': 3, 'timestamp': {'$gte': '2024-01-01T00:00:00'}})
+                except Exception as e:
+                    errors.append(e)
+                    return
+        
+        reader = threading.Thread(target=search)
+        reader.start()
+        try:
+            for _ in range(5):
+                self._add(3, [(document, '2024-11-01T10:00:00') for document in documents])
+                self._job(users_per_second=0).consolidate_user(3, self.now)
+        finally:
+            stop.set()
+            reader.join()
+        
+        self.assertEqual(errors, [])
+        remaining = self.collection.get(where={'user_id': 3})['documents']
+        self.assertEqual(len(remaining), len(set(remaining)))
+    
+    def test_rate_limiter(self):
+        """测试连续获取时按间隔等待"""
+        sleeps = []
+        limiter = RateLimiter(rate_per_second=10, sleep=sleeps.append)
+        limiter.acquire()
+        limiter.acquire()
+        
+        self.assertEqual(len(sleeps), 1)
+        self.assertAlmostEqual(sleeps[0], 0.1, places=2)
+    
+    def test_memory_importance(self):
+        """测试重要度优先使用元数据"""
+        self.assertEqual(memory_importance('短', {'importance': 0.9}), 0.9)
+        self.assertLess(memory_importance('短', {}), 0.3)
+        self.assertGreater(memory_importance('短', {'mention_count': 3}), 0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+"""
+记忆系统的单元测试
+"""
+
+import asyncio
+import threading
+import time
+import unittest
+import tempfile
+from unittest.mock import patch
+from ai_core import ChromaCollection, MemorySystem
+from vector_store import VectorStore
+from retrieval_cache import RetrievalCache
+
+
+class TestChromaCollection(unittest.TestCase):
+    """测试向量记忆集合"""
+    
+    def setUp(self):
+        self.collection = ChromaCollection(dim=3)
+        self.collection.add(
+            documents=['外婆织毛衣', '公司开会', '外婆做饭', '旅行日记'],
+            embeddings=[[1, 0, 0], [0, 1, 0], [0.9, 0.1, 0], [1, 0, 0]],
+            metadatas=[
+                {'user_id': 1, 'topic': '家庭', 'date': '2024-01-05'},
+                {'user_id': 1, 'topic': '工作', 'date': '2024-02-10'},
+                {'user_id': 1, 'topic': '家庭', 'date': '2024-03-15'},
+                {'user_id': 2, 'topic': '旅行', 'date': '2024-01-20'}
+            ],
+            ids=['1_0', '1_1', '1_2', '2_0']
+        )
+    
+    def test_partitioned_by_user(self):
+        """测试向量按用户分区存放"""
+        self.assertEqual(len(self.collection.partitions[1]), 3)
+        self.assertEqual(len(self.collection.partitions[2]), 1)
+        self.assertEqual(self.collection.count(), 4)
+    
+    def test_concurrent_writes_to_new_user(self):
+        """测试多个线程同时写入新用户时只创建一个分区, 写入都不丢失"""
+        barrier = threading.Barrier(8)
+        
+        class SlowVectorStore(VectorStore):
+            def __init__(self, *args, **kwargs):
+                # 放大创建分区的耗时, 让并发写入都落在检查与创建之间
+                time.sleep(0.01)
+                super().__init__(*args, **kwargs)
+        
+        def write(i):
+            barrier.wait()
+            self.collection.add_memories(9, [f'记忆{i}'], [[1, 0, 0]], [{'user_id': 9}])
+        
+        with patch('ai_core.VectorStore', SlowVectorStore):
+            threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(len(self.collection.partitions[9]), 8)
+    
+    def test_query_does_not_leak_other_users(self):
+        """测试带user_id的查询不会返回其他用户的数据"""
+        results = self.collection.query([[1, 0, 0]], n_results=10, where={'user_id': 1})
+        
+        self.assertEqual(results['ids'][0], ['1_0', '1_2', '1_1'])
+        self.assertNotIn('2_0', results['ids'][0])
+    
+    def test_query_unknown_user(self):
+        """测试没有数据的用户返回空结果"""
+        results = self.collection.query([[1, 0, 0]], n_results=5, where={'user_id': 3})
+        
+        self.assertEqual(results['ids'], [[]])
+    
+    def test_metadata_filters(self):
+        """测试主题和日期范围过滤在打分前生效"""
+        results = self.collection.query(
+            [[0, 1, 0]],
+            n_results=5,
+            where={'user_id': 1, 'topic': '家庭', 'date': {'$gte': '2024-02-01'}}
+        )
+        
+        self.assertEqual(results['ids'][0], ['1_2'])
+    
+    def test_query_across_partitions(self):
+        """测试不指定用户时合并所有分区的结果"""
+        results = self.collection.query([[1, 0, 0]], n_results=2)
+        
+        self.assertEqual(sorted(results['ids'][0]), ['1_0', '2_0'])
+    
+    def test_hybrid_query_finds_exact_names(self):
+        """测试混合检索能找回向量相似度不高但字面命中的记忆"""
+        results = self.collection.query(
+            [[0, 1, 0]],
+            n_results=2,
+            where={'user_id': 1},
+            query_texts=['外婆做饭']
+        )
+        
+        self.assertEqual(results['ids'][0], ['1_2', '1_0'])
+    
+    def test_get_with_where(self):
+        """测试按条件获取记录"""
+        results = self.collection.get(where={'$or': [{'topic': '旅行'}, {'topic': '工作'}]})
+        
+        self.assertEqual(sorted(results['ids']), ['1_1', '2_0'])
+    
+    def test_add_memories_continues_sequence(self):
+        """测试ID序号从已有数据续接且单调递增"""
+        self.assertEqual(
+            self.collection.add_memories(1, ['a', 'b'], [[1, 0, 0], [0, 1, 0]], [{'user_id': 1}, {'user_id': 1}]),
+            ['1_3', '1_4']
+        )
+        self.assertEqual(self.collection.add_memories(1, ['c'], [[0, 0, 1]], [{'user_id': 1}]), ['1_5'])
+        self.assertEqual(self.collection.add_memories(3, ['d'], [[0, 0, 1]], [{'user_id': 3}]), ['3_0'])
+    
+    def test_persistent_collection_reload(self):
+        """测试持久化集合重新打开后保留分区并续接ID序号"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            collection = ChromaCollection(dim=3, persist_directory=tmp_dir)
+            collection.add_memories(1, ['外婆织毛衣'], [[1, 0, 0]], [{'user_id': 1}])
+            
+            reopened = ChromaCollection(dim=3, persist_directory=tmp_dir)
+            
+            self.assertEqual(reopened.get(where={'user_id': 1})['documents'], ['外婆织毛衣'])
+            self.assertEqual(reopened.add_memories(1, ['公司开会'], [[0, 1, 0]], [{'user_id': 1}]), ['1_1'])
+    
+    def test_shared_directory_ids_are_unique(self):
+        """测试两个进程 (两个集合) 交替写入同一目录时ID不重复, 删除只影响一条记忆"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            first = ChromaCollection(dim=3, persist_directory=tmp_dir)
+            second = ChromaCollection(dim=3, persist_directory=tmp_dir)
+            
+            ids = []
+            for collection in (first, second, first, second):
+                ids += collection.add_memories(1, ['记忆'], [[1, 0, 0]], [{'user_id': 1}])
+            
+            self.assertEqual(ids, ['1_0', '1_1', '1_2', '1_3'])
+            self.assertEqual(first.delete(1, ['1_1']), 1)
+            self.assertEqual(second.count(where={'user_id': 1}), 3)
+    
+    def test_ids_not_reused_after_compaction(self):
+        """测试压缩删除了序号最大的记忆后, 重新打开的集合也不会复用它的ID"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            collection = ChromaCollection(dim=3, persist_directory=tmp_dir)
+            collection.add_memories(1, ['a', 'b'], [[1, 0, 0], [0, 1, 0]], [{'user_id': 1}, {'user_id': 1}])
+            collection.delete(1, ['1_1'])
+            collection.compact(1)
+            
+            reopened = ChromaCollection(dim=3, persist_directory=tmp_dir)
+            
+            self.assertEqual(reopened.add_memories(1, ['c'], [[0, 0, 1]], [{'user_id': 1}]), ['1_2'])
+
+
+class TestMemorySystemBulk(unittest.TestCase):
+    """测试非结构化记忆的批量写入"""
+    
+    def setUp(self):
+        self.collection = ChromaCollection()
+        self.cache = RetrievalCache()
+        for target, value in [('ai_core.collection', self.collection), ('ai_core.retrieval_cache', self.cache)]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        
+        self.memory_system = MemorySystem.__new__(MemorySystem)
+        self.memory_system.user_id = 7
+    
+    def test_bulk_insert(self):
+        """测试批量写入生成连续ID并标记用户"""
+        ids = self.memory_system.store_unstructured_memories_bulk(
+            ['第一篇日记', '第二篇日记'],
+            [{'date': '2020-01-01'}, None]
+        )
+        
+        self.assertEqual(ids, ['7_0', '7_1'])
+        records = self.collection.get(where={'user_id': 7})
+        self.assertEqual(records['documents'], ['第一篇日记', '第二篇日记'])
+        self.assertEqual(records['metadatas'][0]['date'], '2020-01-01')
+        self.assertEqual(records['metadatas'][0]['user_id'], 7)
+        self.assertIn('timestamp', records['metadatas'][1])
+    
+    def test_single_insert_uses_sequence(self):
+        """测试单条写入与批量写入共用序号"""
+        self.memory_system.store_unstructured_memories_bulk(['a', 'b'])
+        
+        memory_id = self.memory_system.store_unstructured_memory('c')
+        
+        self.assertEqual(memory_id, '7_2')
+    
+    def test_async_store_through_batcher(self):
+        """测试异步写入经过微批处理器"""
+        memory_id = asyncio.run(self.memory_system.astore_unstructured_memory('外婆的故事'))
+        
+        self.assertEqual(memory_id, '7_0')
+        self.assertEqual(self.collection.get(where={'user_id': 7})['documents'], ['外婆的故事'])
+    
+    def test_retrieval_cache_invalidated_by_writes(self):
+        """测试重复检索命中缓存, 写入新记忆后缓存失效"""
+        self.memory_system.store_unstructured_memory('外婆教我织毛衣')
+        
+        first = self.memory_system.retrieve_relevant_memories('外婆')
+        second = self.memory_system.retrieve_relevant_memories(' 外婆 ')
+        self.assertEqual(first, second)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        
+        self.memory_system.store_unstructured_memory('外婆做的红烧肉')
+        third = self.memory_system.retrieve_relevant_memories('外婆')
+        
+        self.assertEqual(len(third), 2)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+    
+    def test_length_mismatch(self):
+        """测试文本与元数据数量不一致时报错"""
+        with self.assertRaises(ValueError):
+            self.memory_system.store_unstructured_memories_bulk(['a'], [{}, {}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+消息表按月分区的单元测试
+
+分区本身只在PostgreSQL上生效; 这里验证分区的月份计算、生成的DDL,
+以及在SQLite上保持普通表、维护函数不做任何事。
+"""
+
+import unittest
+from datetime import datetime
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.pool import StaticPool
+from database import Base
+from migrations import migrate
+from message_partitions import (
+    add_months,
+    create_partition_sql,
+    detach_message_partitions,
+    ensure_message_partitions,
+    month_range,
+    partition_month,
+    partition_name,
+    partitioning_sql
+)
+
+
+class TestPartitionMonths(unittest.TestCase):
+    """测试分区月份的计算"""
+
+    def test_month_range_crosses_year(self):
+        months = month_range(datetime(2023, 11, 15), datetime(2024, 2, 3))
+        self.assertEqual(months, [
+            datetime(2023, 11, 1), datetime(2023, 12, 1), datetime(2024, 1, 1), datetime(2024, 2, 1)
+        ])
+
+    def test_add_months(self):
+        self.assertEqual(add_months(datetime(2024, 12, 1), 1), datetime(2025, 1, 1))
+        self.assertEqual(add_months(datetime(2024, 1, 1), -1), datetime(2023, 12, 1))
+
+    def test_partition_name_round_trip(self):
+        name = partition_name(datetime(2024, 3, 1))
+        self.assertEqual(name, 'messages_p2024_03')
+        self.assertEqual(partition_month(name), datetime(2024, 3, 1))
+        self.assertIsNone(partition_month('messages_default'))
+
+
+class TestPartitionDDL(unittest.TestCase):
+    """测试生成的分区DDL"""
+
+    def test_partition_bounds_are_half_open_months(self):
+        sql = create_partition_sql(datetime(2024, 12, 1))
+        self.assertIn('messages_p2024_12 PARTITION OF messages', sql)
+        self.assertIn("FROM ('2024-12-01') TO ('2025-01-01')", sql)
+
+    def test_conversion_keeps_data_and_indexes(self):
+        """测试转换语句: 主键包含分区键, 先建分区再复制数据, 删除旧表后重建索引"""
+        statements = partitioning_sql([datetime(2024, 1, 1), datetime(2024, 2, 1)])
+        joined = '\n'.join(statements)
+
+        self.assertIn('PARTITION BY RANGE ("timestamp")', joined)
+        self.assertIn('ADD PRIMARY KEY (id, "timestamp")', joined)
+        self.assertIn('PARTITION OF messages DEFAULT', joined)
+
+        position = {key: next(i for i, s in enumerate(statements) if key in s) for key in (
+            'messages_p2024_02', 'INSERT INTO messages', 'DROP TABLE', 'ix_messages_user_timestamp'
+        )}
+        self.assertLess(position['messages_p2024_02'], position['INSERT INTO messages'])
+        self.assertLess(position['INSERT INTO messages'], position['DROP TABLE'])
+        self.assertLess(position['DROP TABLE'], position['ix_messages_user_timestamp'])
+
+
+class TestSqliteFallback(unittest.TestCase):
+    """测试SQLite上保持普通表"""
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(bind=self.engine)
+
+    def test_migration_leaves_plain_table(self):
+        self.assertIn(3, migrate(self.engine))
+        self.assertIn('messages', inspect(self.engine).get_table_names())
+        self.assertNotIn('messages_p2024_01', inspect(self.engine).get_table_names())
+
+    def test_maintenance_is_noop(self):
+        self.assertEqual(ensure_message_partitions(self.engine), [])
+        self.assertEqual(detach_message_partitions(datetime(2030, 1, 1), self.engine), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+"""
+数据库迁移与回顾查询索引的单元测试
+"""
+
+import json
+import re
+import unittest
+from datetime import datetime
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base, Conversation, Message, Review, StructuredMemory, User
+from migrations import MIGRATIONS, current_version, migrate
+from review_aggregator import DataAggregator
+from review_service import ReviewService
+from ai_core import ChromaCollection, MemorySystem
+
+
+def sqlite_engine():
+    return create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+
+
+def index_names(engine, table: str) -> set:
+    return {index['name'] for index in inspect(engine).get_indexes(table)}
+
+
+class TestMigrate(unittest.TestCase):
+    """测试版本化迁移"""
+
+    def setUp(self):
+        self.engine = sqlite_engine()
+        self.addCleanup(self.engine.dispose)
+
+    def test_fresh_database_only_records_versions(self):
+        """测试新库上运行迁移只补写版本记录, 重复运行不做任何事"""
+        Base.metadata.create_all(bind=self.engine)
+
+        applied = migrate(self.engine)
+
+        self.assertEqual(applied, [version for version, _, _ in MIGRATIONS])
+        self.assertEqual(current_version(self.engine), MIGRATIONS[-1][0])
+        self.assertEqual(migrate(self.engine), [])
+
+    def test_existing_database_gets_indexes_and_deduplicated_reviews(self):
+        """测试旧库升级时清理重复报告并建立复合索引和唯一键"""
+        Base.metadata.create_all(bind=self.engine)
+        # 模拟没有这些索引的旧库
+        with self.engine.begin() as connection:
+            for name in (
+                'uq_reviews_period', 'ix_conversations_user_created',
+                'ix_messages_conversation_timestamp', 'ix_structured_memories_user_created'
+            ):
+                connection.exec_driver_sql(f'DROP INDEX {name}')
+
+        Session = sessionmaker(bind=self.engine)
+        session = Session()
+        period = {'period_start': datetime(2024, 1, 1), 'period_end': datetime(2024, 1, 31, 23, 59, 59)}
+        session.add_all([
+            Review(user_id=1, review_type='monthly', summary='旧的', **period),
+            Review(user_id=1, review_type='monthly', summary='新的', **period),
+            Review(user_id=2, review_type='monthly', summary='其他用户', **period),
+        ])
+        session.commit()
+        self.assertNotIn('uq_reviews_period', index_names(self.engine, 'reviews'))
+
+        with self.assertLogs('migrations', level='WARNING') as logs:
+            migrate(self.engine, target=1)
+
+        self.assertIn('[1]', logs.output[0])
+        self.assertEqual(current_version(self.engine), 1)
+        self.assertIn('uq_reviews_period', index_names(self.engine, 'reviews'))
+        self.assertIn('ix_conversations_user_created', index_names(self.engine, 'conversations'))
+        self.assertIn('ix_messages_conversation_timestamp', index_names(self.engine, 'messages'))
+        summaries = sorted(review.summary for review in session.query(Review).all())
+        self.assertEqual(summaries, ['其他用户', '新的'])
+
+        session.add(Review(user_id=2, review_type='monthly', **period))
+        with self.assertRaises(IntegrityError):
+            session.commit()
+        session.close()
+
+    def test_backfills_message_user_id(self):
+        """测试旧库升级时为消息补上user_id列并按所属会话回填"""
+        Base.metadata.create_all(bind=self.engine)
+        # 模拟没有user_id列的旧消息表
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE messages')
+            connection.exec_driver_sql(
+                'CREATE TABLE messages (id INTEGER PRIMARY KEY, conversation_id INTEGER REFERENCES conversations(id), '
+                'content TEXT, role VARCHAR, timestamp DATETIME)'
+            )
+            connection.exec_driver_sql("INSERT INTO users (id, username, email) VALUES (5, 'old', 'old@example.com')")
+            connection.exec_driver_sql("INSERT INTO conversations (id, user_id, title) VALUES (9, 5, '旧会话')")
+            connection.exec_driver_sql(
+                "INSERT INTO messages (conversation_id, content, role, timestamp) "
+                "VALUES (9, '你好', 'user', '2024-01-02 10:00:00.000000')"
+            )
+        migrate(self.engine, target=1)
+
+        self.assertEqual(migrate(self.engine, target=2), [2])
+
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql('SELECT user_id FROM messages').scalar(), 5)
+        self.assertIn('ix_messages_user_timestamp', index_names(self.engine, 'messages'))
+
+    def test_merges_duplicate_structured_memories(self):
+        """测试旧库升级时合并重复实体并建立唯一键, 之后实体upsert可以正常执行"""
+        Base.metadata.create_all(bind=self.engine)
+        # 模拟没有唯一键的旧结构化记忆表
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE structured_memories')
+            connection.exec_driver_sql(
+                'CREATE TABLE structured_memories (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users(id), '
+                'entity_type VARCHAR, entity_name VARCHAR, attributes TEXT, created_at DATETIME)'
+            )
+            connection.exec_driver_sql(
+                "INSERT INTO structured_memories (user_id, entity_type, entity_name, attributes) VALUES "
+                "(1, 'person', '外婆', '{\"城市\": \"苏州\"}'), "
+                "(1, 'person', '外婆', '{\"城市\": \"杭州\", \"爱好\": \"养花\"}'), "
+                "(1, 'place', '苏州', '{}'), "
+                "(2, 'person', '外婆', '{}')"
+            )
+        migrate(self.engine, target=4)
+
+        self.assertEqual(migrate(self.engine, target=5), [5])
+
+        Session = sessionmaker(bind=self.engine)
+        session = Session()
+        self.addCleanup(session.close)
+        rows = session.query(StructuredMemory).order_by(StructuredMemory.id).all()
+        self.assertEqual([(row.id, row.user_id, row.entity_name) for row in rows], [(1, 1, '外婆'), (3, 1, '苏州'), (4, 2, '外婆')])
+        self.assertEqual(json.loads(rows[0].attributes), {'城市': '杭州', '爱好': '养花'})
+
+        memory = MemorySystem(1, session_factory=Session).store_structured_memory('person', '外婆', {'年龄': 80})
+        self.assertEqual(memory.id, 1)
+        self.assertEqual(json.loads(memory.attributes), {'城市': '杭州', '爱好': '养花', '年龄': 80})
+
+
+class TestMessageUserId(unittest.TestCase):
+    """测试写入消息时自动填充user_id"""
+
+    def test_user_id_filled_from_conversation(self):
+        engine = sqlite_engine()
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+        self.addCleanup(session.close)
+        conversation = Conversation(user_id=3, title='会话')
+        session.add(conversation)
+        session.flush()
+
+        inferred = Message(conversation_id=conversation.id, role='user', content='自动填充')
+        explicit = Message(conversation_id=conversation.id, user_id=3, role='assistant', content='调用方指定')
+        session.add_all([inferred, explicit])
+        session.commit()
+
+        self.assertEqual(inferred.user_id, 3)
+        self.assertEqual(explicit.user_id, 3)
+
+        # 与会话不一致的user_id拒绝写入
+        session.add(Message(conversation_id=conversation.id, user_id=4, role='user', content='不一致'))
+        with self.assertRaises(ValueError):
+            session.flush()
+        session.rollback()
+
+        # 消息移到其他会话时user_id随之更新
+        other = Conversation(user_id=5, title='另一个会话')
+        session.add(other)
+        session.flush()
+        inferred.conversation_id = other.id
+        session.commit()
+        self.assertEqual(inferred.user_id, 5)
+
+
+class TestReviewQueryPlans(unittest.TestCase):
+    """用 EXPLAIN QUERY PLAN 确认回顾的热点查询走索引"""
+
+    def setUp(self):
+        self.engine = sqlite_engine()
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(bind=self.engine)
+        migrate(self.engine)
+
+        self.session = sessionmaker(bind=self.engine)()
+        self.addCleanup(self.session.close)
+        user = User(username='plan', email='plan@example.com')
+        self.session.add(user)
+        self.session.flush()
+        conversation = Conversation(user_id=user.id, title='童年', created_at=datetime(2024, 3, 2))
+        self.session.add(conversation)
+        self.session.flush()
+        self.session.add(Message(
+            conversation_id=conversation.id, role='user', content='我想起了外婆', timestamp=datetime(2024, 3, 2)
+        ))
+        self.session.commit()
+        self.user_id = user.id
+
+        self.statements = []
+
+        def capture(connection, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                self.statements.append((statement, parameters))
+
+        event.listen(self.engine, 'before_cursor_execute', capture)
+        self.addCleanup(event.remove, self.engine, 'before_cursor_execute', capture)
+
+    def query_plans(self) -> dict:
+        """每条捕获的查询按主表分组, 返回查询计划文本"""
+        captured, self.statements = self.statements, []
+        plans = {}
+        with self.engine.connect() as connection:
+            for statement, parameters in captured:
+                rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+                table = re.search(r'\sFROM\s+(\w+)', statement).group(1)
+                plans.setdefault(table, []).append(' | '.join(row[-1] for row in rows))
+        return plans
+
+    def test_aggregator_queries_use_composite_indexes(self):
+        """测试对话和消息的时间段查询使用复合索引"""
+        aggregator = DataAggregator(self.session, vector_collection=ChromaCollection(dim=3))
+        data = aggregator.aggregate_review_data(self.user_id, datetime(2024, 3, 1), datetime(2024, 3, 31, 23, 59, 59))
+        self.assertEqual(len(data['messages']), 1)
+
+        plans = self.query_plans()
+
+        self.assertTrue(all('ix_conversations_user_created' in plan for plan in plans['conversations']), plans)
+        # 消息按(user_id, timestamp)做一次范围查找, 不再先列出用户的全部会话
+        self.assertEqual(len(plans['messages']), 1)
+        self.assertIn('ix_messages_user_timestamp', plans['messages'][0])
+        self.assertEqual(len(plans['conversations']), 1)
+        self.assertTrue(
+            all('ix_structured_memories_user_created' in plan for plan in plans['structured_memories']), plans
+        )
+
+    def test_existing_review_lookup_uses_unique_index(self):
+        """测试查询已有报告使用唯一键索引"""
+        service = ReviewService(self.session)
+        service._get_existing_review(self.user_id, 'monthly', datetime(2024, 3, 1), datetime(2024, 3, 31, 23, 59, 59))
+
+        plans = self.query_plans()
+
+        self.assertIn('uq_reviews_period', plans['reviews'][0])
+        self.assertNotIn('SCAN reviews', plans['reviews'][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
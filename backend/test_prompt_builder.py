@@ -0,0 +1,104 @@
+"""
+提示词构建的单元测试
+"""
+
+import unittest
+from prompt_builder import PromptBuilder, estimate_tokens, truncate_to_tokens, format_core_facts
+
+
+class TestTokenEstimate(unittest.TestCase):
+    """测试词元估算与截断"""
+    
+    def test_estimate_tokens(self):
+        """测试汉字、标点和英文单词的计数"""
+        self.assertEqual(estimate_tokens('外婆，你好'), 5)
+        self.assertEqual(estimate_tokens('hello world'), 4)
+        self.assertEqual(estimate_tokens(''), 0)
+    
+    def test_truncate_to_tokens(self):
+        """测试截断结果不超过上限且以省略号结尾"""
+        text = '我小时候每年暑假都去外婆家'
+        truncated = truncate_to_tokens(text, 6)
+        
+        self.assertEqual(truncated, '我小时候每…')
+        self.assertLessEqual(estimate_tokens(truncated), 6)
+        self.assertEqual(truncate_to_tokens(text, 100), text)
+
+
+class TestPromptBuilder(unittest.TestCase):
+    """测试提示词构建"""
+    
+    def setUp(self):
+        self.entities = [
+            ('family_member', '外婆', {'context': '第一轮', 'hometown': '苏州'}),
+            ('family_member', '妈妈', {'context': '第一轮'})
+        ]
+        self.memories = [{'document': f'第{i}条回忆：和外婆一起包饺子的下午'} for i in range(50)]
+        self.history = [{'role': 'user', 'content': f'第{i}轮对话内容'} for i in range(50)]
+    
+    def test_respects_budget(self):
+        """测试总词元数不超过预算, 且报告各段词元数"""
+        builder = PromptBuilder(max_tokens=300)
+        report = builder.build('我想起了外婆', self.history, self.memories, self.entities)
+        
+        self.assertLessEqual(report['total_tokens'], 300)
+        self.assertEqual(report['total_tokens'], estimate_tokens(report['prompt']))
+        self.assertEqual(set(report['sections']), {'prefix', 'memories', 'history', 'user_input'})
+        self.assertGreater(report['dropped']['memories'], 0)
+        self.assertGreater(report['dropped']['history'], 0)
+        self.assertTrue(report['prompt'].endswith('以温暖、有同理心的方式回应用户。'))
+    
+    def test_keeps_most_relevant_and_most_recent(self):
+        """测试优先保留最相关的回忆和最近的对话, 历史按时间顺序输出"""
+        builder = PromptBuilder(max_tokens=300)
+        prompt = builder.build('你好', self.history, self.memories, [])['prompt']
+        
+        self.assertIn('第0条回忆', prompt)
+        self.assertNotIn('第49条回忆', prompt)
+        self.assertIn('第49轮', prompt)
+        self.assertNotIn('第0轮', prompt)
+        self.assertLess(prompt.index('第48轮'), prompt.index('第49轮'))
+    
+    def test_prefix_stable_across_turns(self):
+        """测试易变属性和输入顺序不影响前缀, 前缀位于提示词开头"""
+        builder = PromptBuilder()
+        first = builder.build('第一轮', [], self.memories[:2], self.entities)
+        
+        changed = [
+            ('family_member', '妈妈', {'context': '第二轮'}),
+            ('family_member', '外婆', {'hometown': '苏州', 'context': '第二轮'})
+        ]
+        second = builder.build('第二轮', self.history[:3], self.memories[5:9], changed)
+        
+        self.assertEqual(first['prefix'], second['prefix'])
+        self.assertEqual(first['prefix_hash'], second['prefix_hash'])
+        self.assertTrue(second['prompt'].startswith(second['prefix']))
+        self.assertIn('苏州', first['prefix'])
+        self.assertNotIn('第一轮', first['prefix'])
+    
+    def test_unused_history_budget_goes_to_memories(self):
+        """测试没有对话历史时回忆可以使用全部剩余预算"""
+        builder = PromptBuilder(max_tokens=300)
+        with_history = builder.build('你好', self.history, self.memories, [])
+        without_history = builder.build('你好', [], self.memories, [])
+        
+        self.assertGreater(without_history['sections']['memories'], with_history['sections']['memories'])
+        self.assertLessEqual(without_history['total_tokens'], 300)
+    
+    def test_overlong_input_truncated(self):
+        """测试超长输入被截断到预算内"""
+        builder = PromptBuilder(max_tokens=100)
+        report = builder.build('外婆' * 200, self.history, self.memories, [])
+        
+        self.assertLessEqual(report['total_tokens'], 100)
+        self.assertEqual(report['sections']['memories'], 0)
+        self.assertIn('…', report['prompt'])
+    
+    def test_format_core_facts_limit(self):
+        """测试事实行排序稳定并受数量限制"""
+        facts = format_core_facts(self.entities, limit=1)
+        self.assertEqual(facts, ['- family_member: 外婆 {"hometown": "苏州"}'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+向量量化的单元测试
+"""
+
+import unittest
+import tempfile
+import numpy as np
+from quantization import ScalarQuantizer, ProductQuantizer, evaluate_quantization
+from vector_store import VectorStore
+from ai_core import ChromaCollection
+
+
+def _random_store(count, dim, path=None, seed=0):
+    rng = np.random.default_rng(seed)
+    store = VectorStore(dim=dim, path=path)
+    vectors = rng.normal(size=(count, dim)).astype(np.float32)
+    store.add(
+        ids=[str(i) for i in range(count)],
+        embeddings=vectors,
+        documents=['' for _ in range(count)],
+        metadatas=[{} for _ in range(count)]
+    )
+    return store
+
+
+class TestScalarQuantizer(unittest.TestCase):
+    """测试int8标量量化"""
+    
+    def test_round_trip_error(self):
+        """测试编码解码误差在量化步长以内"""
+        vectors = np.random.default_rng(0).normal(size=(100, 8)).astype(np.float32)
+        quantizer = ScalarQuantizer(8)
+        quantizer.train(vectors)
+        
+        codes = quantizer.encode(vectors)
+        
+        self.assertEqual(codes.dtype, np.int8)
+        error = np.abs(quantizer.decode(codes) - vectors)
+        self.assertTrue(np.all(error <= quantizer.scale / 2 + 1e-6))
+    
+    def test_quantized_search_recall(self):
+        """测试粗筛加重排后的召回率"""
+        store = _random_store(500, 32)
+        store.attach_quantizer(ScalarQuantizer(32))
+        queries = np.random.default_rng(1).normal(size=(10, 32))
+        
+        report = evaluate_quantization(store, queries, k=10)
+        
+        self.assertGreaterEqual(report['recall'], 0.95)
+        self.assertEqual(report['compression_ratio'], 4.0)
+
+
+class TestProductQuantizer(unittest.TestCase):
+    """测试乘积量化"""
+    
+    def test_code_size(self):
+        """测试编码大小等于子向量数"""
+        store = _random_store(300, 32)
+        quantizer = ProductQuantizer(32, n_subvectors=8, iterations=5)
+        store.attach_quantizer(quantizer, rerank_factor=10)
+        
+        footprint = store.memory_footprint()
+        
+        self.assertEqual(footprint['bytes_per_vector'], 8)
+        self.assertEqual(footprint['compression_ratio'], 16.0)
+    
+    def test_new_vectors_are_encoded(self):
+        """测试挂载后新增的向量同步编码并可被检索"""
+        store = _random_store(300, 32)
+        store.attach_quantizer(ProductQuantizer(32, n_subvectors=8, iterations=5), rerank_factor=10)
+        target = np.full(32, 3.0, dtype=np.float32)
+        
+        store.add(ids=['new'], embeddings=[target], documents=[''], metadatas=[{}])
+        rows, _ = store.search([target], k=1)
+        
+        self.assertEqual(rows.tolist(), [[300]])
+    
+    def test_rerank_against_disk_vectors(self):
+        """测试全精度向量位于内存映射文件时的重排"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = _random_store(300, 32, path=tmp_dir + '/store')
+            store.attach_quantizer(ProductQuantizer(32, n_subvectors=8, iterations=5), rerank_factor=10)
+            queries = np.random.default_rng(2).normal(size=(10, 32))
+            
+            report = evaluate_quantization(store, queries, k=5)
+            
+            self.assertTrue(report['full_precision_on_disk'])
+            self.assertGreaterEqual(report['recall'], 0.8)
+    
+    def test_resident_bytes(self):
+        """测试仅内存模式下常驻占用包含全精度矩阵, 持久化时只有量化编码"""
+        in_memory = _random_store(300, 32)
+        in_memory.attach_quantizer(ProductQuantizer(32, n_subvectors=8, iterations=5))
+        self.assertEqual(in_memory.memory_footprint()['resident_bytes'], 300 * 32 * 4 + 300 * 8)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            on_disk = _random_store(300, 32, path=tmp_dir + '/store')
+            on_disk.attach_quantizer(ProductQuantizer(32, n_subvectors=8, iterations=5))
+            self.assertEqual(on_disk.memory_footprint()['resident_bytes'], 300 * 8)
+    
+    def test_collection_quantizes_persistent_partitions_only(self):
+        """测试集合只为持久化分区挂载量化器"""
+        vectors = np.random.default_rng(3).normal(size=(20, 8)).astype(np.float32)
+        documents = ['' for _ in range(20)]
+        metadatas = [{} for _ in range(20)]
+        
+        in_memory = ChromaCollection(dim=8, quantization='int8', quantization_threshold=10)
+        in_memory.add_memories(1, documents, vectors, metadatas)
+        self.assertIsNone(in_memory.partitions[1].quantizer)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            persistent = ChromaCollection(
+                dim=8, quantization='int8', quantization_threshold=10, persist_directory=tmp_dir
+            )
+            persistent.add_memories(1, documents, vectors, metadatas)
+            self.assertIsNotNone(persistent.partitions[1].quantizer)
+    
+    def test_invalid_subvectors(self):
+        """测试维度不能整除子向量数时报错"""
+        with self.assertRaises(ValueError):
+            ProductQuantizer(30, n_subvectors=8)
+
+
+if __name__ == '__main__':
+    unittest.main()
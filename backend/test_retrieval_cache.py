@@ -0,0 +1,58 @@
+"""
+检索结果缓存的单元测试
+"""
+
+import unittest
+from unittest.mock import patch
+from retrieval_cache import RetrievalCache, normalize_query
+
+
+class TestRetrievalCache(unittest.TestCase):
+    """测试检索结果缓存"""
+    
+    def test_normalize_query(self):
+        """测试查询规范化"""
+        self.assertEqual(normalize_query('  外婆  的ＡＢＣ\n'), '外婆 的abc')
+    
+    def test_hit_and_saved_latency(self):
+        """测试命中时累计节省的耗时"""
+        cache = RetrievalCache()
+        cache.put('k', 1, ['result'], compute_seconds=0.02)
+        
+        self.assertEqual(cache.get('k', 1), ['result'])
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['saved_latency_ms'], 20.0)
+    
+    def test_generation_change_invalidates(self):
+        """测试集合代数变化后条目失效"""
+        cache = RetrievalCache()
+        cache.put('k', 1, ['old'])
+        
+        self.assertIsNone(cache.get('k', 2))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+        self.assertEqual(cache.stats()['entries'], 0)
+    
+    def test_ttl_expiry(self):
+        """测试超过有效期的条目失效"""
+        cache = RetrievalCache(ttl_seconds=10)
+        with patch('retrieval_cache.time.monotonic', return_value=100.0):
+            cache.put('k', 1, ['result'])
+        
+        with patch('retrieval_cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('k', 1))
+    
+    def test_lru_eviction(self):
+        """测试超过容量时淘汰最久未使用的条目"""
+        cache = RetrievalCache(max_entries=2)
+        cache.put('a', 1, [])
+        cache.put('b', 1, [])
+        cache.get('a', 1)
+        cache.put('c', 1, [])
+        
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('a', 1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,8 +10,10 @@ from review_analyzer import (
     TopicExtractor, 
     EventExtractor,
     HighlightSelector,
-    GrowthInsightGenerator
+    GrowthInsightGenerator,
+    ReviewAnalyzer
 )
+from ai_core import ChromaCollection
 
 
 class TestTimeRangeCalculator(unittest.TestCase):
@@ -65,6 +67,63 @@ class TestTimeRangeCalculator(unittest.TestCase):
         self.assertEqual(annual_label, '2024年')
 
 
+class TestVectorMemoryAggregation(unittest.TestCase):
+    """测试向量记忆的时间范围聚合"""
+    
+    def setUp(self):
+        self.collection = ChromaCollection(dim=3)
+        self.collection.add(
+            documents=['一月和家人聚餐很开心', '二月工作压力很大', '一月的旅行'],
+            embeddings=[[1, 0, 0], [0, 1, 0], [0, 0, 1]],
+            metadatas=[
+                {'user_id': 1, 'timestamp': '2024-01-10T10:00:00'},
+                {'user_id': 1, 'timestamp': '2024-02-05T10:00:00'},
+                {'user_id': 2, 'timestamp': '2024-01-20T10:00:00'}
+            ],
+            ids=['1_0', '1_1', '2_0']
+        )
+        self.aggregator = DataAggregator(db=None, vector_collection=self.collection)
+    
+    def test_get_vector_memories_for_month(self):
+        """测试只返回该用户在时间段内的向量记忆"""
+        start, end = TimeRangeCalculator.get_monthly_range(2024, 1)
+        
+        memories = self.aggregator._get_vector_memories(1, start, end)
+        
+        self.assertEqual([m['id'] for m in memories], ['1_0'])
+        self.assertEqual(memories[0]['content'], '一月和家人聚餐很开心')
+    
+    def test_analyzer_consumes_vector_memories(self):
+        """测试向量记忆参与情感和主题分析"""
+        start, end = TimeRangeCalculator.get_monthly_range(2024, 1)
+        aggregated_data = {
+            'messages': [],
+            'structured_memories': [],
+            'vector_memories': self.aggregator._get_vector_memories(1, start, end),
+            'statistics': {'total_conversations': 0, 'total_messages': 0}
+        }
+        
+        result = ReviewAnalyzer().analyze(aggregated_data, 'monthly')
+        
+        self.assertEqual(len(result['emotion_analysis']['emotion_timeline']), 1)
+        self.assertIn('家庭关系', [t['topic_name'] for t in result['topics']])
+
+    def test_merge_mixed_timezone_timestamps(self):
+        """测试带时区的向量记忆与naive的数据库消息按UTC时间合并"""
+        messages = [
+            {'id': 1, 'role': 'user', 'content': '早上', 'timestamp': '2024-01-10T01:00:00'},
+            {'id': 2, 'role': 'user', 'content': '晚上', 'timestamp': '2024-01-10T12:00:00'}
+        ]
+        vector_memories = [
+            {'id': '1_0', 'content': '中午', 'timestamp': '2024-01-10T10:00:00+08:00'}
+        ]
+
+        merged = ReviewAnalyzer()._merge_vector_memories(messages, vector_memories)
+
+        self.assertEqual([m['content'] for m in merged], ['早上', '中午', '晚上'])
+        self.assertEqual(merged[1]['timestamp'], '2024-01-10T02:00:00')
+
+
 class TestEmotionAnalyzer(unittest.TestCase):
     """测试情感分析器"""
     
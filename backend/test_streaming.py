@@ -0,0 +1,168 @@
+"""
+流式生成与WebSocket接口的单元测试
+"""
+
+import asyncio
+import unittest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from embedding_batcher import EmbeddingBatcher
+import ai_core
+from ai_core import ChromaCollection, DialogueManager, GenerationMetrics, LocalStreamingModel
+from entity_graph import EntityIndexRegistry
+import main
+
+
+class StreamingTestCase(unittest.TestCase):
+    """使用内存SQLite数据库和无延迟替身模型的测试基类"""
+    
+    def setUp(self):
+        engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        self.addCleanup(engine.dispose)
+        
+        self.metrics = GenerationMetrics()
+        for target, value in [
+            ('ai_core.SessionLocal', sessionmaker(bind=engine)),
+            ('ai_core.STREAM_TOKEN_DELAY_MS', 0),
+            ('ai_core.generation_metrics', self.metrics),
+            ('main.generation_metrics', self.metrics),
+            ('ai_core.entity_indexes', EntityIndexRegistry()),
+            ('ai_core.collection', ChromaCollection()),
+            ('ai_core.embedding_batcher', EmbeddingBatcher(ai_core.embedder)),
+        ]:
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestStreamResponse(StreamingTestCase):
+    """测试DialogueManager的流式生成"""
+    
+    def test_stream_matches_complete_response(self):
+        """测试流式输出拼接后与完整回复一致, 并记录指标"""
+        manager = DialogueManager(1, model=LocalStreamingModel(token_delay_ms=0))
+        
+        async def collect():
+            return [token async for token in manager.stream_response('我想起了外婆', [])]
+        
+        tokens = asyncio.run(collect())
+        
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual(''.join(tokens), manager.generate_response('我想起了外婆', []))
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['streams'], 1)
+        self.assertEqual(snapshot['tokens'], len(tokens))
+        self.assertGreater(snapshot['tokens_per_second'], 0)
+        self.assertIsNotNone(manager.memory_system.get_entity('family_member', '外婆'))
+
+
+class SlowWebSocket:
+    """发送较慢的WebSocket替身, 记录每次发送时生成任务领先的词元数"""
+    
+    def __init__(self, produced):
+        self.produced = produced
+        self.sent = 0
+        self.max_lead = 0
+        self.messages = []
+    
+    async def send_json(self, data):
+        await asyncio.sleep(0.001)
+        if data['type'] == 'token':
+            self.sent += 1
+            self.max_lead = max(self.max_lead, self.produced[0] - self.sent)
+        self.messages.append(data)
+
+
+class TestWebSocketStreaming(StreamingTestCase):
+    """测试WebSocket流式接口"""
+    
+    def test_websocket_dialogue(self):
+        """测试逐词元推送并以done消息结束"""
+        client = TestClient(main.app)
+        with client.websocket_connect('/ws/dialogue/1') as websocket:
+            websocket.send_json({'message': ''})
+            self.assertEqual(websocket.receive_json()['type'], 'error')
+            
+            websocket.send_json({'message': '妈妈今天做了饺子', 'history': []})
+            tokens = []
+            while True:
+                data = websocket.receive_json()
+                if data['type'] == 'done':
+                    break
+                tokens.append(data['content'])
+        
+        self.assertIn('妈妈今天做了饺子', ''.join(tokens))
+        self.assertEqual(data['tokens'], len(tokens))
+        self.assertIn('ttft_ms', data)
+        self.assertEqual(client.get('/metrics/generation').json()['streams'], 1)
+    
+    def test_shutdown_stops_embedding_batcher(self):
+        """测试应用关闭时停止向量化微批处理器"""
+        with TestClient(main.app) as client:
+            with client.websocket_connect('/ws/dialogue/1') as websocket:
+                websocket.send_json({'message': '想起了小时候', 'history': []})
+                while websocket.receive_json()['type'] != 'done':
+                    pass
+            self.assertIsNotNone(main.ai_core.embedding_batcher._worker)
+        
+        self.assertIsNone(main.ai_core.embedding_batcher._worker)
+    
+    def test_backpressure_bounds_producer_lead(self):
+        """测试客户端变慢时生成任务最多领先队列容量个词元"""
+        produced = [0]
+        
+        class CountingModel(LocalStreamingModel):
+            async def stream(self, prompt, user_input):
+                for i in range(100):
+                    produced[0] += 1
+                    yield str(i)
+        
+        manager = DialogueManager(1, model=CountingModel())
+        websocket = SlowWebSocket(produced)
+        
+        with patch('main.STREAM_QUEUE_SIZE', 4):
+            asyncio.run(main._stream_reply(websocket, manager, '你好', []))
+        
+        self.assertEqual(websocket.sent, 100)
+        self.assertLessEqual(websocket.max_lead, 4 + 1)
+        self.assertEqual(websocket.messages[-1]['type'], 'done')
+
+    
+    def test_disconnect_with_full_queue_stops_producer(self):
+        """测试队列已满时客户端断开, 生成任务和模型的流都会退出"""
+        closed = []
+        
+        class EndlessModel(LocalStreamingModel):
+            async def stream(self, prompt, user_input):
+                try:
+                    while True:
+                        yield '字'
+                finally:
+                    closed.append(True)
+        
+        class DisconnectingWebSocket:
+            async def send_json(self, data):
+                # 等生成任务把队列填满后再断开
+                await asyncio.sleep(0.01)
+                raise main.WebSocketDisconnect()
+        
+        manager = DialogueManager(1, model=EndlessModel())
+        
+        async def run():
+            with self.assertRaises(main.WebSocketDisconnect):
+                await main._stream_reply(DisconnectingWebSocket(), manager, '你好', [])
+            await asyncio.sleep(0.01)
+            return [task for task in asyncio.all_tasks() if not task.done() and task is not asyncio.current_task()]
+        
+        with patch('main.STREAM_QUEUE_SIZE', 2):
+            self.assertEqual(asyncio.run(run()), [])
+        self.assertEqual(closed, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
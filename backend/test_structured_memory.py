@@ -0,0 +1,180 @@
+"""
+结构化记忆批量写入的单元测试
+"""
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from unittest.mock import patch
+from database import Base, StructuredMemory
+from ai_core import MemorySystem
+from entity_graph import EntityIndexRegistry, cooccurrence_pairs
+
+
+class StructuredMemoryTestCase(unittest.TestCase):
+    """使用内存SQLite数据库的测试基类"""
+    
+    def setUp(self):
+        self.engine = create_engine(
+            'sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool
+        )
+        Base.metadata.create_all(bind=self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self.memory_system = MemorySystem(1, session_factory=self.Session)
+        
+        patcher = patch('ai_core.entity_indexes', EntityIndexRegistry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._record_statement)
+    
+    def tearDown(self):
+        self.engine.dispose()
+    
+    def _record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(' '.join(statement.split()[:3]).upper())
+    
+    def _rows(self):
+        session = self.Session()
+        try:
+            return session.query(StructuredMemory).order_by(StructuredMemory.entity_name).all()
+        finally:
+            session.close()
+
+
+class TestStructuredMemoryUpsert(StructuredMemoryTestCase):
+    """测试结构化记忆的批量upsert"""
+    
+    def test_repeated_mentions_merge_into_one_row(self):
+        """测试重复提及同一实体时合并属性而不产生重复行"""
+        self.memory_system.store_structured_memory('family_member', '妈妈', {'context': '妈妈做饭'})
+        memory = self.memory_system.store_structured_memory('family_member', '妈妈', {'age': 60})
+        
+        rows = self._rows()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(json.loads(rows[0].attributes), {'context': '妈妈做饭', 'age': 60})
+        self.assertEqual(json.loads(memory.attributes), {'context': '妈妈做饭', 'age': 60})
+    
+    def test_concurrent_writers_keep_all_attributes(self):
+        """测试多个线程同时写入同一实体的不同属性时, 合并在upsert语句中完成, 不丢失属性"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        engine = create_engine(f"sqlite:///{os.path.join(directory.name, 'memories.db')}", connect_args={'timeout': 30})
+        self.addCleanup(engine.dispose)
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        
+        barrier = threading.Barrier(8)
+        
+        def write(i):
+            barrier.wait()
+            MemorySystem(1, session_factory=Session).store_structured_memory('family_member', '妈妈', {f'key{i}': i})
+        
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        session = Session()
+        self.addCleanup(session.close)
+        self.assertEqual(
+            json.loads(session.query(StructuredMemory).one().attributes),
+            {f'key{i}': i for i in range(8)}
+        )
+    
+    def test_turn_flushed_in_one_transaction(self):
+        """测试一轮对话暂存的实体在一个事务中写入"""
+        self.memory_system.remember_entity('family_member', '妈妈', {'context': 'a'})
+        self.memory_system.remember_entity('family_member', '爸爸', {'context': 'b'})
+        self.memory_system.remember_entity('family_member', '妈妈', {'mood': '开心'})
+        
+        memories = self.memory_system.flush_structured_memories()
+        
+        self.assertEqual([m.entity_name for m in memories], ['妈妈', '爸爸'])
+        self.assertEqual(json.loads(memories[0].attributes), {'context': 'a', 'mood': '开心'})
+        self.assertEqual(self.statements.count('INSERT INTO STRUCTURED_MEMORIES'), 1)
+        self.assertEqual(self.memory_system.flush_structured_memories(), [])
+    
+    def test_users_are_isolated(self):
+        """测试不同用户的同名实体互不影响"""
+        self.memory_system.store_structured_memory('family_member', '妈妈', {'a': 1})
+        MemorySystem(2, session_factory=self.Session).store_structured_memory('family_member', '妈妈', {'b': 2})
+        
+        self.assertEqual(len(self._rows()), 2)
+
+
+class TestEntityIndex(StructuredMemoryTestCase):
+    """测试实体索引与共现关系图"""
+    
+    def _turn(self, memory_system, names):
+        for name in names:
+            memory_system.remember_entity('family_member', name, {'context': name})
+        memory_system.flush_structured_memories()
+    
+    def test_cooccurrence_pairs(self):
+        """测试实体对去重且有序"""
+        pairs = cooccurrence_pairs([('p', '妈妈'), ('p', '爸爸'), ('p', '妈妈')])
+        self.assertEqual(pairs, [(('p', '妈妈'), ('p', '爸爸'))])
+    
+    def test_lazy_load_from_database(self):
+        """测试首次访问时从数据库加载实体和关系"""
+        self._turn(self.memory_system, ['妈妈', '外婆'])
+        self._turn(self.memory_system, ['妈妈', '外婆', '爸爸'])
+        self.assertIsNone(self.registry.loaded(1))
+        
+        entity = self.memory_system.get_entity('family_member', '外婆')
+        
+        self.assertEqual(entity['attributes'], {'context': '外婆'})
+        self.assertEqual(entity['neighbours'][0], {'type': 'family_member', 'name': '妈妈', 'weight': 2})
+        self.assertEqual(len(entity['neighbours']), 2)
+    
+    def test_loaded_index_synced_on_write(self):
+        """测试已加载的索引随写入增量更新, 无需再次查询数据库"""
+        index = self.memory_system.entity_index
+        self.assertEqual(len(index), 0)
+        
+        self._turn(self.memory_system, ['妈妈', '爸爸'])
+        self.memory_system.store_structured_memory('family_member', '妈妈', {'age': 60})
+        
+        self.statements.clear()
+        self.assertEqual(index.get('family_member', '妈妈'), {'context': '妈妈', 'age': 60})
+        self.assertEqual(index.neighbours('family_member', '爸爸')[0]['name'], '妈妈')
+        self.assertEqual(self.statements, [])
+        
+        # 与重新加载的结果一致
+        self.registry.invalidate(1)
+        reloaded = self.memory_system.entity_index
+        self.assertEqual(reloaded.get('family_member', '妈妈'), index.get('family_member', '妈妈'))
+        self.assertEqual(reloaded.neighbours('family_member', '爸爸'), index.neighbours('family_member', '爸爸'))
+    
+    def test_lru_eviction(self):
+        """测试超过用户数上限时淘汰最久未访问的索引, 被淘汰的用户重新加载后与数据库一致"""
+        registry = EntityIndexRegistry(max_users=2)
+        self._turn(self.memory_system, ['妈妈'])
+        
+        registry.get(1, self.Session)
+        registry.get(2, self.Session)
+        registry.get(1, self.Session)
+        registry.get(3, self.Session)
+        
+        self.assertIsNone(registry.loaded(2))
+        self.assertIsNotNone(registry.loaded(1))
+        self.assertEqual(registry.evictions, 1)
+        
+        self._turn(MemorySystem(2, session_factory=self.Session), ['外婆'])
+        self.assertEqual(registry.get(2, self.Session).get('family_member', '外婆'), {'context': '外婆'})
+    
+    def test_unknown_entity(self):
+        """测试查询不存在的实体"""
+        self.assertIsNone(self.memory_system.get_entity('family_member', '舅舅'))
+
+
+if __name__ == '__main__':
+    unittest.main()
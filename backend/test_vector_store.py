@@ -0,0 +1,264 @@
+"""
+向量存储的单元测试
+"""
+
+import unittest
+import tempfile
+import numpy as np
+from vector_store import VectorStore, top_k_indices
+
+
+class TestTopKIndices(unittest.TestCase):
+    """测试Top-K下标选择"""
+    
+    def test_descending_order(self):
+        """测试结果按分数降序排列"""
+        scores = np.array([[0.1, 0.9, 0.5, 0.7]])
+        
+        result = top_k_indices(scores, 3)
+        
+        self.assertEqual(result.tolist(), [[1, 3, 2]])
+    
+    def test_k_equals_n(self):
+        """测试k等于候选数量"""
+        scores = np.array([[0.3, 0.1], [0.2, 0.4]])
+        
+        result = top_k_indices(scores, 2)
+        
+        self.assertEqual(result.tolist(), [[0, 1], [1, 0]])
+
+
+class TestVectorStore(unittest.TestCase):
+    """测试向量存储"""
+    
+    def setUp(self):
+        self.store = VectorStore(dim=4, initial_capacity=2)
+    
+    def _add(self, vectors):
+        start = len(self.store)
+        count = len(vectors)
+        self.store.add(
+            ids=[f"id_{start + i}" for i in range(count)],
+            embeddings=vectors,
+            documents=[f"doc_{start + i}" for i in range(count)],
+            metadatas=[{} for _ in range(count)]
+        )
+    
+    def test_geometric_growth(self):
+        """测试容量按倍数增长"""
+        self._add(np.eye(4).tolist())
+        self._add([[1, 1, 0, 0]])
+        
+        self.assertEqual(len(self.store), 5)
+        self.assertEqual(self.store.capacity, 8)
+        self.assertEqual(self.store.vectors.dtype, np.float32)
+    
+    def test_search_returns_most_similar(self):
+        """测试返回最相似的向量而不是最早写入的向量"""
+        self._add([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0.1, 0, 0.9, 0]])
+        
+        rows, scores = self.store.search([[0, 0, 1, 0]], k=2)
+        
+        self.assertEqual(rows.tolist(), [[2, 3]])
+        self.assertAlmostEqual(float(scores[0][0]), 1.0, places=5)
+    
+    def test_batched_search(self):
+        """测试多个查询一次完成检索"""
+        self._add(np.eye(4).tolist())
+        
+        rows, _ = self.store.search([[0, 1, 0, 0], [0, 0, 0, 1]], k=1)
+        
+        self.assertEqual(rows.tolist(), [[1], [3]])
+    
+    def test_search_restricted_rows(self):
+        """测试只在指定行中检索"""
+        self._add(np.eye(4).tolist())
+        
+        rows, _ = self.store.search([[1, 0, 0, 0]], k=1, rows=np.array([2, 3]))
+        
+        self.assertIn(rows[0][0], [2, 3])
+    
+    def test_search_empty_store(self):
+        """测试空存储检索"""
+        rows, scores = self.store.search([[1, 0, 0, 0]], k=5)
+        
+        self.assertEqual(rows.shape, (1, 0))
+        self.assertEqual(scores.shape, (1, 0))
+    
+    def test_time_range_index(self):
+        """测试乱序写入后按时间范围二分查找"""
+        timestamps = ['2024-03-01T00:00:00', '2024-01-15T08:00:00', '2024-02-10T12:00:00', None]
+        self.store.add(
+            ids=['c', 'a', 'b', 'x'],
+            embeddings=np.eye(4).tolist(),
+            documents=['', '', '', ''],
+            metadatas=[{'timestamp': ts} if ts else {} for ts in timestamps]
+        )
+        
+        rows = self.store.rows_in_time_range('2024-01-01', '2024-02-28T23:59:59')
+        
+        self.assertEqual([self.store.ids[i] for i in rows], ['a', 'b'])
+        self.assertEqual(len(self.store.rows_in_time_range()), 3)
+    
+    def test_time_range_where_uses_index(self):
+        """测试where中的时间范围与其他条件组合"""
+        self.store.add(
+            ids=['a', 'b', 'c'],
+            embeddings=np.eye(4)[:3].tolist(),
+            documents=['', '', ''],
+            metadatas=[
+                {'timestamp': '2024-01-01T00:00:00', 'topic': '家庭'},
+                {'timestamp': '2024-01-02T00:00:00', 'topic': '工作'},
+                {'timestamp': '2024-01-03T00:00:00', 'topic': '家庭'}
+            ]
+        )
+        
+        rows = self.store.filter_rows({
+            'timestamp': {'$gt': '2024-01-01T00:00:00'},
+            'topic': '家庭'
+        })
+        
+        self.assertEqual(rows.tolist(), [2])
+    
+    def test_dimension_mismatch(self):
+        """测试维度不匹配时报错"""
+        with self.assertRaises(ValueError):
+            self._add([[1, 0, 0]])
+
+
+class TestPersistentVectorStore(unittest.TestCase):
+    """测试内存映射的持久化向量存储"""
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = self.tmp_dir.name + '/store'
+    
+    def _add(self, store, vectors):
+        start = len(store)
+        store.add(
+            ids=[f"id_{start + i}" for i in range(len(vectors))],
+            embeddings=vectors,
+            documents=[f"doc_{start + i}" for i in range(len(vectors))],
+            metadatas=[{'n': start + i} for i in range(len(vectors))]
+        )
+    
+    def test_reopen(self):
+        """测试重启后数据仍然存在"""
+        writer = VectorStore(dim=4, initial_capacity=2, path=self.path)
+        self._add(writer, np.eye(4).tolist())
+        
+        reopened = VectorStore(dim=4, path=self.path, read_only=True)
+        
+        self.assertEqual(len(reopened), 4)
+        self.assertIsInstance(reopened.vectors, np.memmap)
+        self.assertEqual(reopened.metadatas[3], {'n': 3})
+        rows, _ = reopened.search([[0, 0, 1, 0]], k=1)
+        self.assertEqual(rows.tolist(), [[2]])
+    
+    def test_reader_sees_appends(self):
+        """测试其他进程的追加在刷新后对读者可见"""
+        writer = VectorStore(dim=4, initial_capacity=1, path=self.path)
+        reader = VectorStore(dim=4, path=self.path, read_only=True)
+        
+        self._add(writer, np.eye(4).tolist())
+        
+        self.assertEqual(reader.refresh(), 4)
+        self.assertEqual(reader.ids, ['id_0', 'id_1', 'id_2', 'id_3'])
+        rows, _ = reader.search([[0, 0, 0, 1]], k=1)
+        self.assertEqual(rows.tolist(), [[3]])
+    
+    def test_read_only_rejects_writes(self):
+        """测试只读存储不能写入"""
+        VectorStore(dim=4, path=self.path)
+        reader = VectorStore(dim=4, path=self.path, read_only=True)
+        
+        with self.assertRaises(RuntimeError):
+            self._add(reader, [[1, 0, 0, 0]])
+    
+    def test_dimension_mismatch_on_open(self):
+        """测试以不同维度打开已有存储时报错"""
+        VectorStore(dim=4, path=self.path)
+        
+        with self.assertRaises(ValueError):
+            VectorStore(dim=8, path=self.path)
+
+
+class TestDeleteAndCompact(unittest.TestCase):
+    """测试删除标记与压缩"""
+    
+    def _fill(self, store):
+        store.add(
+            ids=['a', 'b', 'c', 'd'],
+            embeddings=[[1, 0, 0], [0.9, 0.1, 0], [0, 1, 0], [0, 0, 1]],
+            documents=['外婆织毛衣', '外婆做饭', '公司开会', '旅行日记'],
+            metadatas=[{'timestamp': f'2024-01-0{i + 1}T00:00:00'} for i in range(4)]
+        )
+    
+    def test_deleted_rows_hidden(self):
+        """测试删除后检索、过滤和时间范围查询立即跳过该记录"""
+        from lexical_index import NgramInvertedIndex
+        store = VectorStore(dim=3)
+        store.attach_lexical_index(NgramInvertedIndex())
+        self._fill(store)
+        version = store.version
+        
+        self.assertEqual(store.delete(['a', 'missing']), 1)
+        
+        rows, _ = store.search([[1, 0, 0]], k=2)
+        self.assertNotIn(0, rows[0].tolist())
+        self.assertEqual(store.rows_in_time_range().tolist(), [1, 2, 3])
+        self.assertEqual(store.filter_rows({}).tolist(), [1, 2, 3])
+        self.assertEqual(store.live_count, 3)
+        self.assertGreater(store.version, version)
+        self.assertEqual(store.delete(['a']), 0)
+    
+    def test_compact_in_memory(self):
+        """测试压缩后行号连续、索引重建并回收空间"""
+        from lexical_index import NgramInvertedIndex
+        store = VectorStore(dim=3, initial_capacity=64)
+        store.attach_lexical_index(NgramInvertedIndex())
+        self._fill(store)
+        store.delete(['a', 'c'])
+        
+        report = store.compact()
+        
+        self.assertEqual(report['removed'], 2)
+        self.assertGreater(report['bytes_reclaimed'], 0)
+        self.assertEqual(store.ids, ['b', 'd'])
+        self.assertEqual(len(store), 2)
+        rows, _ = store.search([[1, 0, 0]], k=1)
+        self.assertEqual(store.ids[rows[0][0]], 'b')
+        matched, _ = store.lexical_index.search('外婆', k=5)
+        self.assertEqual(matched.tolist(), [0])
+        self.assertEqual(store.rows_in_time_range(start='2024-01-02').tolist(), [0, 1])
+    
+    def test_compact_shared_between_processes(self):
+        """测试删除和压缩对打开同一目录的其他实例可见"""
+        with tempfile.TemporaryDirectory() as path:
+            writer = VectorStore(dim=3, path=path, initial_capacity=64)
+            reader = VectorStore(dim=3, path=path)
+            self._fill(writer)
+            reader.refresh()
+            
+            writer.delete(['b'])
+            reader.refresh()
+            self.assertEqual(reader.live_count, 3)
+            
+            report = writer.compact()
+            self.assertGreater(report['bytes_reclaimed'], 0)
+            
+            reader.refresh()
+            self.assertEqual(reader.ids, ['a', 'c', 'd'])
+            rows, _ = reader.search([[0, 1, 0]], k=1)
+            self.assertEqual(reader.ids[rows[0][0]], 'c')
+            
+            # 压缩后继续追加, 行号从压缩后的末尾开始
+            writer.add(['e'], [[1, 1, 0]], ['新记忆'], [{}])
+            reader.refresh()
+            self.assertEqual(reader.ids, ['a', 'c', 'd', 'e'])
+            np.testing.assert_allclose(reader.vectors[3], writer.vectors[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,955 @@
+"""
+向量存储引擎 - 以连续的float32矩阵保存向量,提供向量化的Top-K相似度检索
+
+指定path时向量持久化在磁盘上:
+- vectors.f32: float32向量矩阵,通过内存映射打开,多个进程经由页缓存共享
+- records.jsonl: 只追加的ID/原文/元数据记录,行数即已提交的向量数
+- meta.json: 维度和相似度度量, 压缩时记录ID序号的高水位
+- tombstones.txt: 只追加的已删除行号, 压缩(compact)时清空
+
+压缩会重写向量和记录文件并原子替换, 其他进程刷新时发现记录文件已被替换即整体重新加载
+
+同一进程内的检索、写入和压缩由每个存储的可重入锁(lock)互斥, 行号与向量、记录和索引始终对应;
+调用方需要在检索后按行号读取ids/documents/metadatas时, 应在同一个 with store.lock 内完成
+"""
+
+from typing import List, Dict, Optional, Sequence, Tuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import bisect
+import functools
+import json
+import os
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl, 退化为不加锁
+    fcntl = None
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    按行选出分数最高的k个下标(降序)
+
+    先用argpartition在O(n)内选出候选,再只对这k个候选排序
+
+    Args:
+        scores: 形状为(q, n)的分数矩阵
+        k: 每行返回的数量 (需满足 0 < k <= n)
+
+    Returns:
+        形状为(q, k)的下标矩阵
+    """
+    n = scores.shape[1]
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n), (scores.shape[0], 1))
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+_COMPARISONS = {
+    '$eq': lambda value, target: value == target,
+    '$ne': lambda value, target: value != target,
+    '$gt': lambda value, target: value is not None and value > target,
+    '$gte': lambda value, target: value is not None and value >= target,
+    '$lt': lambda value, target: value is not None and value < target,
+    '$lte': lambda value, target: value is not None and value <= target,
+    '$in': lambda value, target: value in target,
+    '$nin': lambda value, target: value not in target,
+}
+
+
+def matches_where(metadata: Dict, where: Optional[Dict]) -> bool:
+    """
+    判断元数据是否满足过滤条件 (兼容ChromaDB的where语法)
+
+    支持字段等值、$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin比较以及$and/$or组合,
+    同一层的多个字段之间为"与"关系。
+
+    Args:
+        metadata: 记录的元数据
+        where: 过滤条件,为空时总是满足
+
+    Returns:
+        是否满足条件
+    """
+    if not where:
+        return True
+
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(matches_where(metadata, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, target in condition.items():
+                if operator not in _COMPARISONS:
+                    raise ValueError(f"不支持的过滤操作符: {operator}")
+                if not _COMPARISONS[operator](value, target):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+
+    return True
+
+
+_RANGE_OPERATORS = {'$gt', '$gte', '$lt', '$lte'}
+
+
+def to_datetime(value) -> Optional[datetime]:
+    """将datetime或ISO格式字符串统一转换为naive UTC时间,无法解析时返回None"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def synchronized(method):
+    """在存储的线程锁内执行方法"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class VectorStore:
+    """向量存储 - 向量保存在一块按几何级数扩容的连续内存(或内存映射文件)中"""
+
+    METRICS = ('cosine', 'dot')
+
+    VECTORS_FILE = 'vectors.f32'
+    RECORDS_FILE = 'records.jsonl'
+    META_FILE = 'meta.json'
+    LOCK_FILE = '.lock'
+    TOMBSTONES_FILE = 'tombstones.txt'
+
+    def __init__(
+        self,
+        dim: int = 1536,
+        initial_capacity: int = 64,
+        metric: str = 'cosine',
+        path: Optional[str] = None,
+        read_only: bool = False,
+        time_field: str = 'timestamp'
+    ):
+        if metric not in self.METRICS:
+            raise ValueError(f"不支持的相似度度量: {metric}")
+
+        self.dim = dim
+        self.metric = metric
+        self.path = path
+        self.read_only = read_only
+        self._size = 0
+
+        # 进程内的读写锁: 压缩会改变行号, 检索与写入、删除、压缩不能交错执行
+        self.lock = threading.RLock()
+
+        # 数据每次变化时加一, 供上层缓存判断是否失效
+        self.version = 0
+        # 行号重新排列 (压缩、整体重新加载) 时加一, 后台重建的索引据此判断是否作废
+        self._layout_version = 0
+
+        # 已删除但尚未压缩的行号, 检索和过滤时跳过
+        self._tombstones: set = set()
+
+        # 按ID前缀记录的下一个可用序号 (只增不减, 压缩删除记录后也不会复用), 见 add_with_sequence_ids
+        self._sequences: Dict[str, int] = {}
+
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict] = []
+
+        # 按元数据中time_field排序的二级索引: 时间与行号两个平行的有序列表
+        self.time_field = time_field
+        self._time_keys: List[datetime] = []
+        self._time_rows: List[int] = []
+
+        # 可选的近似最近邻索引,见 attach_ann_index
+        self.ann_index = None
+
+        # 可选的原文倒排索引,见 attach_lexical_index
+        self.lexical_index = None
+
+        # 可选的量化编码,见 attach_quantizer
+        self.quantizer = None
+        self.rerank_factor = 4
+        self._codes: Optional[np.ndarray] = None
+
+        if path is None:
+            self._vectors = np.zeros((max(initial_capacity, 1), dim), dtype=np.float32)
+        else:
+            self._records_offset = 0
+            self._tombstones_offset = 0
+            self._records_inode = None
+            self._open(max(initial_capacity, 1))
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return self._vectors.shape[0]
+
+    @property
+    def live_count(self) -> int:
+        """未删除的记录数"""
+        return self._size - len(self._tombstones)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """已写入的向量视图 (不复制数据)"""
+        return self._vectors[:self._size]
+
+    def add(
+        self,
+        ids: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        documents: Sequence[str],
+        metadatas: Sequence[Dict]
+    ) -> np.ndarray:
+        """
+        追加一批向量
+
+        持久化模式下先写入并刷新向量文件,再追加记录行,
+        因此其他进程读到的记录总有对应的向量。
+
+        Args:
+            ids: 记录ID列表
+            embeddings: 向量列表
+            documents: 原文列表
+            metadatas: 元数据列表
+
+        Returns:
+            新写入记录所在的行号
+        """
+        if not (len(ids) == len(embeddings) == len(documents) == len(metadatas)):
+            raise ValueError("ids、embeddings、documents、metadatas 的长度必须一致")
+        if self.read_only:
+            raise RuntimeError("只读向量存储不能写入")
+
+        matrix = self._prepare(embeddings)
+
+        with self._write_lock():
+            # 先同步其他进程追加的数据,保证行号连续
+            self.refresh()
+            return self._append(ids, matrix, documents, metadatas)
+
+    def add_with_sequence_ids(
+        self,
+        prefix: str,
+        embeddings: Sequence[Sequence[float]],
+        documents: Sequence[str],
+        metadatas: Sequence[Dict]
+    ) -> List[str]:
+        """
+        追加一批向量, 并分配单调递增的ID, 格式为 "{prefix}_{序号}"
+
+        序号在写锁内、同步其他进程的数据之后分配, 多个进程共享同一目录时也不会重复
+
+        Returns:
+            新记录的ID列表
+        """
+        if not (len(embeddings) == len(documents) == len(metadatas)):
+            raise ValueError("embeddings、documents、metadatas 的长度必须一致")
+        if self.read_only:
+            raise RuntimeError("只读向量存储不能写入")
+
+        matrix = self._prepare(embeddings)
+
+        with self._write_lock():
+            self.refresh()
+            start = self._sequences.get(prefix, 0)
+            ids = [f"{prefix}_{seq}" for seq in range(start, start + len(documents))]
+            self._append(ids, matrix, documents, metadatas)
+        return ids
+
+    def _append(
+        self,
+        ids: Sequence[str],
+        matrix: np.ndarray,
+        documents: Sequence[str],
+        metadatas: Sequence[Dict]
+    ) -> np.ndarray:
+        """在写锁内追加记录并同步挂载的索引"""
+        count = matrix.shape[0]
+        self._reserve(self._size + count)
+        rows = np.arange(self._size, self._size + count)
+        self._vectors[self._size:self._size + count] = matrix
+
+        if self.path is not None:
+            self._vectors.flush()
+            self._append_records(ids, documents, metadatas)
+
+        self._size += count
+        self.ids.extend(ids)
+        self.documents.extend(documents)
+        self.metadatas.extend(metadatas)
+        self._track_sequences(ids)
+        self._index_times(rows, metadatas)
+
+        if self.ann_index is not None:
+            self.ann_index.add(rows, matrix)
+        if self.quantizer is not None:
+            self._append_codes(self.quantizer.encode(matrix))
+        if self.lexical_index is not None:
+            for row, document in zip(rows, documents):
+                self.lexical_index.add(int(row), document)
+        self.version += 1
+
+        return rows
+
+    @synchronized
+    def refresh(self) -> int:
+        """
+        加载其他进程追加到磁盘上的记录和删除标记 (内存模式下无操作)
+
+        Returns:
+            新加载的记录数
+        """
+        if self.path is None:
+            return 0
+
+        stat = os.stat(os.path.join(self.path, self.RECORDS_FILE))
+        if stat.st_ino != self._records_inode:
+            # 记录文件被其他进程压缩替换, 整体重新加载
+            return self._reload()
+
+        loaded = self._load_records() if stat.st_size != self._records_offset else 0
+        self._load_tombstones()
+        return loaded
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """
+        删除记录
+
+        只写入删除标记, 检索和过滤立即跳过这些行; 存储空间在 compact() 时回收
+
+        Args:
+            ids: 要删除的记录ID
+
+        Returns:
+            实际删除的记录数
+        """
+        if self.read_only:
+            raise RuntimeError("只读向量存储不能删除")
+
+        targets = set(ids)
+        with self._write_lock():
+            self.refresh()
+            rows = [
+                row for row, id_val in enumerate(self.ids)
+                if id_val in targets and row not in self._tombstones
+            ]
+            if not rows:
+                return 0
+
+            if self.path is not None:
+                with open(os.path.join(self.path, self.TOMBSTONES_FILE), 'ab') as f:
+                    f.write(''.join(f"{row}\n" for row in rows).encode('utf-8'))
+                    f.flush()
+                    self._tombstones_offset = f.tell()
+
+            self._tombstones.update(rows)
+            self.version += 1
+        return len(rows)
+
+    def compact(self) -> Dict:
+        """
+        压缩存储: 去掉已删除的行, 重建时间索引和挂载的ANN/量化/倒排索引
+
+        持久化模式下先写临时文件再原子替换, 容量收缩到实际记录数
+
+        Returns:
+            删除的行数和压缩前后占用的字节数
+        """
+        if self.read_only:
+            raise RuntimeError("只读向量存储不能压缩")
+
+        with self._write_lock():
+            self.refresh()
+            bytes_before = self.storage_bytes()
+            removed = len(self._tombstones)
+
+            if removed:
+                keep = self.live_rows()
+                vectors = np.array(self._vectors[keep])
+                ids = [self.ids[row] for row in keep]
+                documents = [self.documents[row] for row in keep]
+                metadatas = [self.metadatas[row] for row in keep]
+
+                if self.path is None:
+                    indexes = self._detach_indexes()
+                    self._vectors = np.zeros((max(len(keep), 1), self.dim), dtype=np.float32)
+                    self._vectors[:len(keep)] = vectors
+                    self._size = len(keep)
+                    self.ids, self.documents, self.metadatas = ids, documents, metadatas
+                    self._tombstones = set()
+                    self._time_keys, self._time_rows = [], []
+                    self._index_times(np.arange(self._size), self.metadatas)
+                    self._attach_indexes(*indexes)
+                    self._layout_version += 1
+                    self.version += 1
+                else:
+                    self._rewrite_files(vectors, ids, documents, metadatas)
+                    self._reload()
+
+            bytes_after = self.storage_bytes()
+
+        return {
+            'removed': removed,
+            'bytes_before': bytes_before,
+            'bytes_after': bytes_after,
+            'bytes_reclaimed': bytes_before - bytes_after
+        }
+
+    def storage_bytes(self) -> int:
+        """存储占用的字节数: 持久化模式为数据文件大小, 内存模式为向量和量化编码数组的大小"""
+        if self.path is None:
+            return int(self._vectors.nbytes + (self._codes.nbytes if self._codes is not None else 0))
+        return sum(
+            os.path.getsize(os.path.join(self.path, name))
+            for name in (self.VECTORS_FILE, self.RECORDS_FILE, self.TOMBSTONES_FILE)
+            if os.path.exists(os.path.join(self.path, name))
+        )
+
+    @synchronized
+    def live_rows(self) -> np.ndarray:
+        """未删除的行号"""
+        return self._exclude_deleted(np.arange(self._size))
+
+    @synchronized
+    def attach_ann_index(self, index, train: bool = True):
+        """
+        挂载近似最近邻索引
+
+        用当前全部向量训练索引并写入,之后的追加会增量同步到索引中
+
+        Args:
+            index: 提供 train/add/search 接口的索引 (如 ann_index.IVFIndex)
+            train: 是否训练; 索引已载入训练好的聚类中心时为False, 只写入向量
+        """
+        if train:
+            index.train(self.vectors)
+        index.add(np.arange(self._size), self.vectors)
+        self.ann_index = index
+
+    def rebuild_ann_index(self, index, train: bool = True) -> bool:
+        """
+        在后台重建近似最近邻索引并替换当前索引
+
+        训练和写入在锁外基于当时的向量快照进行, 检索和写入不受影响;
+        替换时在锁内补写快照之后追加的向量。期间发生压缩 (行号改变) 时放弃本次重建。
+
+        Args:
+            index: 新的索引
+            train: 是否训练 (索引已载入聚类中心时为False)
+
+        Returns:
+            是否已替换
+        """
+        with self.lock:
+            size = self._size
+            vectors = self._vectors[:size]
+            layout_version = self._layout_version
+
+        # 扩容和压缩都会换用新的数组或文件, 快照中已写入的行不会再被修改
+        if train:
+            index.train(vectors)
+        index.add(np.arange(size), vectors)
+
+        with self.lock:
+            if self._layout_version != layout_version or self.ann_index is None:
+                return False
+            if self._size > size:
+                index.add(np.arange(size, self._size), self.vectors[size:])
+            self.ann_index = index
+            self.version += 1
+            return True
+
+    @synchronized
+    def attach_lexical_index(self, index):
+        """
+        挂载原文倒排索引,写入已有文档,之后的追加会增量同步
+
+        Args:
+            index: 提供 add/search 接口的索引 (如 lexical_index.NgramInvertedIndex)
+        """
+        for row, document in enumerate(self.documents):
+            index.add(row, document)
+        self.lexical_index = index
+
+    @synchronized
+    def attach_quantizer(self, quantizer, rerank_factor: int = 4):
+        """
+        挂载量化器
+
+        用当前全部向量训练并编码,之后检索先在量化编码上粗筛
+        k * rerank_factor 个候选,再用全精度向量重排
+
+        仅内存模式 (未指定path) 下全精度矩阵仍常驻内存, 量化编码是额外开销,
+        只能加速粗筛而不能节省内存, 实际占用见 memory_footprint 的 resident_bytes
+
+        Args:
+            quantizer: 提供 train/encode/scores 接口的量化器 (见 quantization.py)
+            rerank_factor: 候选数相对k的倍数
+        """
+        quantizer.train(self.vectors)
+        self.quantizer = quantizer
+        self.rerank_factor = rerank_factor
+        self._codes = None
+        self._append_codes(quantizer.encode(self.vectors))
+
+    def memory_footprint(self) -> Dict:
+        """
+        统计向量数据的内存占用
+
+        compression_ratio 只比较全精度向量与量化编码的大小; resident_bytes 是实际常驻内存的字节数,
+        仅内存模式下包含全精度矩阵, 此时挂载量化器反而增加内存占用
+
+        Returns:
+            全精度向量与量化编码的字节数、常驻内存的字节数,以及全精度向量是否位于磁盘
+        """
+        float32_bytes = self._size * self.dim * 4
+        code_bytes = self._size * self.quantizer.code_size if self.quantizer is not None else 0
+        resident_bytes = code_bytes + (float32_bytes if self.path is None else 0)
+
+        return {
+            'vectors': self._size,
+            'float32_bytes': float32_bytes,
+            'code_bytes': code_bytes,
+            'bytes_per_vector': self.quantizer.code_size if self.quantizer is not None else self.dim * 4,
+            'compression_ratio': round(float32_bytes / code_bytes, 2) if code_bytes else 1.0,
+            'resident_bytes': resident_bytes,
+            'full_precision_on_disk': self.path is not None
+        }
+
+    @synchronized
+    def filter_rows(self, where: Optional[Dict]) -> Optional[np.ndarray]:
+        """
+        按元数据过滤出候选行号
+
+        Args:
+            where: 过滤条件,为空时返回None表示不过滤
+
+        Returns:
+            满足条件的行号数组
+        """
+        if not where:
+            return self.live_rows() if self._tombstones else None
+
+        # 时间范围条件走有序索引, 其余条件只在范围内的行上判断
+        condition = where.get(self.time_field)
+        if isinstance(condition, dict) and condition and set(condition) <= _RANGE_OPERATORS:
+            rows = self.rows_in_time_range(
+                start=condition.get('$gte', condition.get('$gt')),
+                end=condition.get('$lte', condition.get('$lt')),
+                include_start='$gt' not in condition,
+                include_end='$lt' not in condition
+            )
+            remaining = {key: value for key, value in where.items() if key != self.time_field}
+            if not remaining:
+                return rows
+            return np.fromiter(
+                (row for row in rows if matches_where(self.metadatas[row], remaining)),
+                dtype=np.int64
+            )
+
+        return self._exclude_deleted(np.fromiter(
+            (row for row, metadata in enumerate(self.metadatas) if matches_where(metadata, where)),
+            dtype=np.int64
+        ))
+
+    @synchronized
+    def rows_in_time_range(
+        self,
+        start=None,
+        end=None,
+        include_start: bool = True,
+        include_end: bool = True
+    ) -> np.ndarray:
+        """
+        通过二分查找取出时间范围内的行号
+
+        Args:
+            start: 起始时间 (datetime或ISO字符串),为空表示不限
+            end: 结束时间,为空表示不限
+            include_start: 是否包含起始时间
+            include_end: 是否包含结束时间
+
+        Returns:
+            按时间升序排列的行号数组
+        """
+        start, end = to_datetime(start), to_datetime(end)
+
+        low = 0
+        if start is not None:
+            low = (bisect.bisect_left if include_start else bisect.bisect_right)(self._time_keys, start)
+
+        high = len(self._time_keys)
+        if end is not None:
+            high = (bisect.bisect_right if include_end else bisect.bisect_left)(self._time_keys, end)
+
+        return self._exclude_deleted(np.asarray(self._time_rows[low:high], dtype=np.int64))
+
+    @synchronized
+    def search(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        k: int,
+        rows: Optional[np.ndarray] = None,
+        exact: bool = False,
+        nprobe: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量Top-K检索
+
+        多个查询向量合并为一次矩阵乘法完成打分。挂载了ANN索引且未限定候选行时,
+        默认走近似检索,此时候选不足的位置以行号-1补齐。
+
+        Args:
+            query_embeddings: 查询向量列表
+            k: 每个查询返回的数量
+            rows: 可选的候选行号,只在这些行中检索
+            exact: 是否强制精确检索
+            nprobe: 近似检索扫描的桶数
+
+        Returns:
+            (行号矩阵, 分数矩阵),形状均为(查询数, 实际返回数)
+        """
+        queries = self._prepare(query_embeddings)
+
+        if self._tombstones:
+            rows = self.live_rows() if rows is None else self._exclude_deleted(np.asarray(rows))
+
+        if rows is None and not exact and self.ann_index is not None and k > 0:
+            return self.ann_index.search(self.vectors, queries, min(k, self._size), nprobe)
+
+        if self.quantizer is not None and not exact:
+            return self._search_quantized(queries, k, rows)
+
+        candidates = self.vectors if rows is None else self.vectors[rows]
+
+        k = min(k, candidates.shape[0])
+        if k <= 0:
+            empty = np.empty((queries.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        scores = queries @ candidates.T
+        top = top_k_indices(scores, k)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+
+        if rows is not None:
+            top = np.asarray(rows)[top]
+
+        return top, top_scores
+
+    def _exclude_deleted(self, rows: np.ndarray) -> np.ndarray:
+        if not self._tombstones or len(rows) == 0:
+            return rows
+        deleted = np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones))
+        return rows[~np.isin(rows, deleted)]
+
+    def _detach_indexes(self) -> tuple:
+        """摘下挂载的索引, 数据重建后由 _attach_indexes 重新训练和写入"""
+        indexes = (self.ann_index, self.lexical_index, self.quantizer, self.rerank_factor)
+        self.ann_index = self.lexical_index = self.quantizer = None
+        self._codes = None
+        return indexes
+
+    def _attach_indexes(self, ann_index, lexical_index, quantizer, rerank_factor: int):
+        if lexical_index is not None:
+            lexical_index.clear()
+            self.attach_lexical_index(lexical_index)
+        # 空存储无法训练, 之后由上层按规模重新挂载
+        if ann_index is not None and self._size > 0:
+            self.attach_ann_index(ann_index)
+        if quantizer is not None and self._size > 0:
+            self.attach_quantizer(quantizer, rerank_factor)
+
+    def _index_times(self, rows: np.ndarray, metadatas: Sequence[Dict]):
+        """将带时间字段的记录插入有序索引 (按时间顺序写入时为O(1)追加)"""
+        for row, metadata in zip(rows, metadatas):
+            key = to_datetime(metadata.get(self.time_field))
+            if key is None:
+                continue
+            position = bisect.bisect_right(self._time_keys, key)
+            self._time_keys.insert(position, key)
+            self._time_rows.insert(position, int(row))
+
+    def _search_quantized(
+        self,
+        queries: np.ndarray,
+        k: int,
+        rows: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """在量化编码上粗筛候选,再用全精度向量重排"""
+        codes = self._codes[:self._size] if rows is None else self._codes[rows]
+
+        k = min(k, codes.shape[0])
+        if k <= 0:
+            empty = np.empty((queries.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        approx = self.quantizer.scores(codes, queries)
+        candidates = top_k_indices(approx, min(k * self.rerank_factor, codes.shape[0]))
+        if rows is not None:
+            candidates = np.asarray(rows)[candidates]
+
+        # 只读取候选行的全精度向量,内存映射下只会触及这些页
+        exact_scores = np.einsum('qcd,qd->qc', self._vectors[candidates], queries)
+        top = top_k_indices(exact_scores, k)
+
+        return np.take_along_axis(candidates, top, axis=1), np.take_along_axis(exact_scores, top, axis=1)
+
+    def _append_codes(self, codes: np.ndarray):
+        """追加量化编码,容量按倍数扩展"""
+        if self._codes is None:
+            self._codes = np.empty((max(self._size, 1),) + codes.shape[1:], dtype=codes.dtype)
+            self._codes_size = 0
+
+        required = self._codes_size + codes.shape[0]
+        if required > self._codes.shape[0]:
+            grown = np.empty((max(required, self._codes.shape[0] * 2),) + codes.shape[1:], dtype=codes.dtype)
+            grown[:self._codes_size] = self._codes[:self._codes_size]
+            self._codes = grown
+
+        self._codes[self._codes_size:required] = codes
+        self._codes_size = required
+
+    def _prepare(self, embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+        """将输入转换为(n, dim)的float32矩阵,余弦度量下做L2归一化"""
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+
+        if matrix.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: 期望{self.dim}, 实际{matrix.shape[1]}")
+
+        if self.metric == 'cosine':
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+
+        return matrix
+
+    def _reserve(self, required: int):
+        """容量不足时按倍数扩容,保证追加的均摊复杂度为O(1)"""
+        if required <= self.capacity:
+            return
+
+        new_capacity = self.capacity
+        while new_capacity < required:
+            new_capacity *= 2
+
+        if self.path is not None:
+            # 扩展文件后重新映射,已有数据无需复制
+            self._vectors.flush()
+            with open(os.path.join(self.path, self.VECTORS_FILE), 'r+b') as f:
+                f.truncate(new_capacity * self.dim * 4)
+            self._map_vectors()
+            return
+
+        grown = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        grown[:self._size] = self._vectors[:self._size]
+        self._vectors = grown
+
+    def _open(self, initial_capacity: int):
+        """打开(或创建)磁盘上的存储目录"""
+        meta_path = os.path.join(self.path, self.META_FILE)
+
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['dim'] != self.dim or meta['metric'] != self.metric:
+                raise ValueError(f"存储格式不匹配: {meta}")
+        else:
+            if self.read_only:
+                raise FileNotFoundError(f"向量存储不存在: {self.path}")
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, self.VECTORS_FILE), 'wb') as f:
+                f.truncate(initial_capacity * self.dim * 4)
+            open(os.path.join(self.path, self.RECORDS_FILE), 'ab').close()
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'dim': self.dim, 'metric': self.metric}, f)
+
+        self._records_inode = os.stat(os.path.join(self.path, self.RECORDS_FILE)).st_ino
+        self._load_sequences()
+        self._map_vectors()
+        self.refresh()
+
+    def _load_records(self) -> int:
+        """读取记录文件中新增的完整行, 并同步到时间索引和挂载的索引"""
+        records_path = os.path.join(self.path, self.RECORDS_FILE)
+        with open(records_path, 'rb') as f:
+            f.seek(self._records_offset)
+            data = f.read()
+
+        # 只处理完整的行,写到一半的记录留待下次刷新
+        complete = data.rfind(b'\n') + 1
+        if complete == 0:
+            return 0
+        records = [json.loads(line) for line in data[:complete].splitlines()]
+        self._records_offset += complete
+
+        if self._size + len(records) > self.capacity:
+            self._map_vectors()
+
+        rows = np.arange(self._size, self._size + len(records))
+        self._size += len(records)
+        for record in records:
+            self.ids.append(record['id'])
+            self.documents.append(record['document'])
+            self.metadatas.append(record['metadata'])
+        self._track_sequences([record['id'] for record in records])
+        self._index_times(rows, [record['metadata'] for record in records])
+        self.version += 1
+
+        if self.ann_index is not None:
+            self.ann_index.add(rows, self.vectors[rows])
+        if self.quantizer is not None:
+            self._append_codes(self.quantizer.encode(self.vectors[rows]))
+        if self.lexical_index is not None:
+            for row, record in zip(rows, records):
+                self.lexical_index.add(int(row), record['document'])
+
+        return len(records)
+
+    def _load_tombstones(self):
+        tombstones_path = os.path.join(self.path, self.TOMBSTONES_FILE)
+        if not os.path.exists(tombstones_path):
+            return
+        # 文件变短说明其他进程正在压缩, 等记录文件替换后整体重新加载
+        if os.path.getsize(tombstones_path) <= self._tombstones_offset:
+            return
+
+        with open(tombstones_path, 'rb') as f:
+            f.seek(self._tombstones_offset)
+            data = f.read()
+        complete = data.rfind(b'\n') + 1
+        if complete == 0:
+            return
+        self._tombstones.update(int(line) for line in data[:complete].splitlines())
+        self._tombstones_offset += complete
+        self.version += 1
+
+    def _reload(self) -> int:
+        """丢弃内存中的状态, 从磁盘重新加载全部记录并重建索引"""
+        indexes = self._detach_indexes()
+        self._size = 0
+        self.ids, self.documents, self.metadatas = [], [], []
+        self._time_keys, self._time_rows = [], []
+        self._tombstones = set()
+        self._records_offset = 0
+        self._tombstones_offset = 0
+        self._records_inode = os.stat(os.path.join(self.path, self.RECORDS_FILE)).st_ino
+
+        self._load_sequences()
+        self._map_vectors()
+        self._load_records()
+        self._load_tombstones()
+        self._attach_indexes(*indexes)
+        self._layout_version += 1
+        self.version += 1
+        return self._size
+
+    def _rewrite_files(self, vectors: np.ndarray, ids: List[str], documents: List[str], metadatas: List[Dict]):
+        """
+        写入压缩后的数据文件
+
+        替换顺序: 向量文件 -> 删除标记 -> 元数据 -> 记录文件。其他进程以记录文件被替换为信号重新加载,
+        此时向量文件和删除标记都已是新版本, 元数据中的序号高水位包含了被删除记录的ID。
+        """
+        vectors_path = os.path.join(self.path, self.VECTORS_FILE)
+        with open(vectors_path + '.tmp', 'wb') as f:
+            f.truncate(max(len(ids), 1) * self.dim * 4)
+        mapped = np.memmap(vectors_path + '.tmp', dtype=np.float32, mode='r+', shape=(max(len(ids), 1), self.dim))
+        mapped[:len(ids)] = vectors
+        mapped.flush()
+        del mapped
+
+        records_path = os.path.join(self.path, self.RECORDS_FILE)
+        with open(records_path + '.tmp', 'wb') as f:
+            f.write(self._format_records(ids, documents, metadatas).encode('utf-8'))
+
+        tombstones_path = os.path.join(self.path, self.TOMBSTONES_FILE)
+        open(tombstones_path + '.tmp', 'wb').close()
+
+        meta_path = os.path.join(self.path, self.META_FILE)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'metric': self.metric, 'sequences': self._sequences}, f)
+
+        os.replace(vectors_path + '.tmp', vectors_path)
+        os.replace(tombstones_path + '.tmp', tombstones_path)
+        os.replace(meta_path + '.tmp', meta_path)
+        os.replace(records_path + '.tmp', records_path)
+
+    def _load_sequences(self):
+        """合并元数据中记录的序号高水位 (由压缩写入)"""
+        with open(os.path.join(self.path, self.META_FILE), 'r', encoding='utf-8') as f:
+            sequences = json.load(f).get('sequences', {})
+        for prefix, sequence in sequences.items():
+            self._sequences[prefix] = max(self._sequences.get(prefix, 0), sequence)
+
+    def _track_sequences(self, ids: Sequence[str]):
+        """按 "{prefix}_{序号}" 格式的ID推进对应前缀的下一个可用序号"""
+        for id_val in ids:
+            prefix, separator, sequence = id_val.rpartition('_')
+            if separator and sequence.isdigit():
+                self._sequences[prefix] = max(self._sequences.get(prefix, 0), int(sequence) + 1)
+
+    def _map_vectors(self):
+        """按向量文件的当前大小建立内存映射"""
+        vectors_path = os.path.join(self.path, self.VECTORS_FILE)
+        rows = os.path.getsize(vectors_path) // (self.dim * 4)
+        self._vectors = np.memmap(
+            vectors_path,
+            dtype=np.float32,
+            mode='r' if self.read_only else 'r+',
+            shape=(rows, self.dim)
+        )
+
+    def _append_records(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Dict]):
+        """追加记录行, 每行对应一个向量"""
+        lines = self._format_records(ids, documents, metadatas)
+        with open(os.path.join(self.path, self.RECORDS_FILE), 'ab') as f:
+            f.write(lines.encode('utf-8'))
+            f.flush()
+            self._records_offset = f.tell()
+
+    @staticmethod
+    def _format_records(ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Dict]) -> str:
+        return ''.join(
+            json.dumps({'id': id_val, 'document': doc, 'metadata': meta}, ensure_ascii=False) + '\n'
+            for id_val, doc, meta in zip(ids, documents, metadatas)
+        )
+
+    @contextmanager
+    def _write_lock(self):
+        """写锁: 先取得进程内的线程锁, 持久化模式下再加跨进程文件锁"""
+        with self.lock:
+            if self.path is None or fcntl is None:
+                yield
+                return
+
+            with open(os.path.join(self.path, self.LOCK_FILE), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)